@@ -6,7 +6,13 @@ cd myapp || exit 1
 # Zainstaluj zależności
 pip install -r requirements.txt
 
+# Pliki wsadowe są przetwarzane w tle przez osobny proces (worker.py)
+export JOBS_ENABLED=1
+
 # Uruchom aplikację Flask przez Gunicorn w tle
 nohup gunicorn -w 4 run:app --bind 0.0.0.0:5000 > gunicorn.log 2>&1 &
 
-echo "Aplikacja uruchomiona. Log: myapp/gunicorn.log"
+# Uruchom proces przetwarzający zadania wsadowe w tle
+nohup python worker.py > worker.log 2>&1 &
+
+echo "Aplikacja uruchomiona. Log: myapp/gunicorn.log, zadania wsadowe: myapp/worker.log"
@@ -45,6 +45,14 @@ def create_app():
 
     app.jinja_env.filters['bitwise_and'] = bitwise_and
 
+    def timestamp(value):
+        try:
+            return datetime.fromtimestamp(float(value)).strftime('%Y-%m-%d %H:%M:%S')
+        except (TypeError, ValueError):
+            return ''
+
+    app.jinja_env.filters['timestamp'] = timestamp
+
     @app.context_processor
     def inject_now():
         return {'current_year': datetime.utcnow().year}
@@ -1,31 +1,33 @@
 import re
 from ldap3 import MODIFY_REPLACE
 from app.config_utils import get_default_attributes, get_default_ou
+from app.models.dn_utils import build_dn
+from app.models.uid_allocator import uid_allocator
 
-def get_next_uid_number(conn, search_base):
-    conn.search(search_base, "(uidNumber=*)", attributes=["uidNumber"])
-    uid_numbers = [int(entry.uidNumber.value) for entry in conn.entries if entry.uidNumber.value]
-    return max(uid_numbers) + 1 if uid_numbers else 1000
+# Checks create_user applies to the username and password (also used by batch_validate)
+USERNAME_PATTERN = re.compile(r'^[a-zA-Z0-9._-]+$')
+MIN_PASSWORD_LENGTH = 8
 
 
-def create_user(conn, username, firstname, lastname, password, ou, dc, search_base):
-    if not all([username, firstname, lastname, password]):
-        print("All fields are required.")
-        return False
+def new_user_dn(firstname, lastname, ou, dc):
+    # DN create_user gives a new user: CN "<first name> <last name>" in the default OU
+    return build_dn([("CN", f"{firstname} {lastname}")], suffix=f"{ou},{dc}")
 
-    if not re.match(r'^[a-zA-Z0-9._-]+$', username):
-        print("Invalid username format.")
-        return False
 
-    if len(password) < 8:
-        print("Password must be at least 8 characters long.")
-        return False
+def check_new_user(username, firstname, lastname, password):
+    # Reason create_user would refuse these fields, or None
+    if not all([username, firstname, lastname, password]):
+        return "All fields are required."
+    if not USERNAME_PATTERN.match(username):
+        return "Invalid username format."
+    if len(password) < MIN_PASSWORD_LENGTH:
+        return f"Password must be at least {MIN_PASSWORD_LENGTH} characters long."
+    return None
 
-    default_ou = get_default_ou()
-    default_attrs = get_default_attributes()
-    uid_number = get_next_uid_number(conn, search_base)
-    user_dn = f'CN={firstname} {lastname},{default_ou},{dc}'
 
+def new_user_attributes(username, firstname, lastname, dc, uid_number):
+    # Attributes of the add request create_user sends, with the configured default attributes
+    default_attrs = get_default_attributes()
     try:
         default_uac = int(default_attrs.get("userAccountControl", 544))
     except Exception:
@@ -50,6 +52,21 @@ def create_user(conn, username, firstname, lastname, password, ou, dc, search_ba
         if key in ["default_ou", "userAccountControl"]:
             continue
         attributes[key] = value.replace("{username}", username) if isinstance(value, str) else value
+    return attributes
+
+
+def create_user(conn, username, firstname, lastname, password, ou, dc, search_base, uid_number=None):
+    # uid_number: a number reserved by the caller (e.g. for a whole batch), otherwise one is allocated here
+    problem = check_new_user(username, firstname, lastname, password)
+    if problem:
+        print(problem)
+        return False
+
+    default_ou = get_default_ou()
+    if uid_number is None:
+        uid_number = uid_allocator.allocate(conn, search_base)
+    user_dn = new_user_dn(firstname, lastname, default_ou, dc)
+    attributes = new_user_attributes(username, firstname, lastname, dc, uid_number)
 
     if conn.add(user_dn, attributes=attributes):
         print(f"User {username} created successfully.")
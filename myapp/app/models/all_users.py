@@ -1,4 +1,12 @@
+import os
+from collections.abc import Mapping
+from functools import lru_cache
 from ldap3 import Connection
+from ldap3.utils.conv import escape_filter_chars
+from app.models.dn_utils import get_cn, normalize_dn, dn_to_domain, build_dn
+from app.models.ldap_retry import call_with_retry
+from app.models.ldap_controls import (server_side_sort_control, vlv_control, decode_vlv_response,
+                                      VLV_RESPONSE_OID)
 
 # Mapowanie wartości userAccountControl na flagi
 userAccountControlFlags = {
@@ -25,61 +33,297 @@ userAccountControlFlags = {
     1: "SCRIPT"
 }
 
-def get_all_users(conn: Connection, search_base: str, attributes: list = None):
+# Attributes that can be selected as table columns/filters in the display options
+SELECTABLE_USER_ATTRIBUTES = [
+    'objectClass', 'cn', 'sAMAccountName', 'userPrincipalName', 'givenName', 'sn',
+    'displayName', 'uid', 'uidNumber', 'gidNumber', 'unixHomeDirectory', 'loginShell',
+    'homeDirectory', 'homeDrive', 'mail', 'whenChanged', 'whenCreated', 'uSNChanged',
+    'uSNCreated', 'userAccountControl', 'sAMAccountType', 'pwdLastSet', 'primaryGroupID',
+    'objectCategory', 'objectGUID', 'objectSid', 'logonCount', 'instanceType',
+    'dSCorePropagationData', 'countryCode', 'codePage', 'badPwdCount',
+    'badPasswordTime', 'accountExpires'
+]
+
+# Page size for the Simple Paged Results control (AD's MaxPageSize is 1000 by default)
+DEFAULT_PAGE_SIZE = int(os.environ.get('LDAP_PAGE_SIZE', 500))
+# DNs looked up per OR-filter search by fetch_users_by_dn
+LOOKUP_BATCH_SIZE = int(os.environ.get('LDAP_LOOKUP_BATCH_SIZE', 200))
+
+# Attributes the user tables can be sorted on by the server (single-valued strings only;
+# AD refuses to sort on linked or constructed attributes such as distinguishedName)
+SORTABLE_USER_ATTRIBUTES = [
+    'cn', 'name', 'sAMAccountName', 'userPrincipalName', 'displayName',
+    'givenName', 'sn', 'mail', 'whenCreated', 'whenChanged'
+]
+
+# Attributes matched by the free-text filter of the paged user tables
+FILTERABLE_USER_ATTRIBUTES = ['cn', 'sAMAccountName', 'displayName', 'mail']
+
+
+def _attribute_value(attributes: dict, attr: str):
     """
-    Retrieves a list of users from Active Directory with dynamically defined attributes.
-    Maps userAccountControl values to corresponding flags if present.
+    Mimics ldap3's Entry attribute .value: None when empty, the single value, or the list of values.
+    """
+    value = attributes.get(attr)
+    if isinstance(value, list):
+        if not value:
+            return None
+        return value[0] if len(value) == 1 else value
+    return value
+
+
+# Flag table scanned when a userAccountControl value is displayed (highest bit first, as above)
+_UAC_FLAG_TABLE = tuple(userAccountControlFlags.items())
+ACCOUNTDISABLE = 2
+
+
+@lru_cache(maxsize=1024)
+def decode_user_account_control(uac: int) -> str:
+    """
+    Returns the comma separated flag names set in a userAccountControl bitmask.
+    Only a handful of distinct values exist in a domain, so the result is memoized.
+    """
+    flags = [flag for flag_val, flag in _UAC_FLAG_TABLE if uac & flag_val]
+    return ", ".join(flags) if flags else "UNKNOWN"
+
+
+@lru_cache(maxsize=64)
+def _column_index(requested: tuple) -> dict:
+    # Shared by every record of a listing, so each record only holds its list of values
+    return {attr: position for position, attr in enumerate(requested)}
+
+
+class UserRecord(Mapping):
+    """
+    Read-mostly user row, usable wherever the former per-user dicts were (user[attr],
+    user.get(attr), user.items(), and attribute access in templates).
+
+    userAccountControl is kept as the integer bitmask and only turned into flag names
+    when read through the mapping interface.
+    """
+    __slots__ = ('_columns', '_values', '_extra')
+
+    def __init__(self, columns: dict, values: list):
+        self._columns = columns
+        self._values = values
+        self._extra = None
+
+    def __getitem__(self, attr):
+        position = self._columns.get(attr)
+        if position is None:
+            if self._extra is not None and attr in self._extra:
+                return self._extra[attr]
+            raise KeyError(attr)
+        value = self._values[position]
+        if attr == 'userAccountControl' and value:
+            return decode_user_account_control(value)
+        return value
+
+    def __setitem__(self, attr, value):
+        position = self._columns.get(attr)
+        if position is not None:
+            self._values[position] = value
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[attr] = value
+
+    def __iter__(self):
+        yield from self._columns
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return len(self._columns) + (len(self._extra) if self._extra else 0)
+
+    def __repr__(self):
+        return f"UserRecord({dict(self)!r})"
+
+    @property
+    def uac(self) -> int:
+        """The raw userAccountControl bitmask (0 if it was not requested)."""
+        position = self._columns.get('userAccountControl')
+        return (self._values[position] or 0) if position is not None else 0
+
+    @property
+    def is_disabled(self) -> bool:
+        return bool(self.uac & ACCOUNTDISABLE)
+
+
+def user_from_attributes(attributes: dict, requested: list) -> UserRecord:
+    """
+    Builds a user row from a search response's attributes, keeping only the requested ones.
+    """
+    values = [_attribute_value(attributes, attr) for attr in requested]
+    columns = _column_index(tuple(requested))
+    position = columns.get('userAccountControl')
+    if position is not None and values[position]:
+        values[position] = int(values[position])  # keep the bitmask, flags are decoded on read
+    return UserRecord(columns, values)
+
+
+def iter_all_users(conn: Connection, search_base: str, attributes: list = None, page_size: int = None):
+    """
+    Lazily yields users from Active Directory, one page at a time, using the
+    Simple Paged Results control. Unlike a single search this is not truncated
+    at the server's MaxPageSize and never holds more than one page in memory.
 
     Args:
         conn (Connection): An active LDAP connection.
         search_base (str): The base from which to perform the search in Active Directory.
         attributes (list): A list of attributes to fetch (optional).
+        page_size (int): Number of entries requested per page (optional, defaults to LDAP_PAGE_SIZE).
 
-    Returns:
-        list: A list of dictionaries containing user data.
+    Yields:
+        UserRecord: User data, in the same format as returned by get_all_users.
     """
     if attributes is None or not isinstance(attributes, list):
         # Set default attributes if the list is not provided
         attributes = ['cn', 'distinguishedName', 'mail']
 
-    try:
-        search_filter = "(objectClass=user)"
-
-        # Perform the search with dynamically provided attributes
-        conn.search(search_base, search_filter, attributes=attributes)
+    entries = conn.extend.standard.paged_search(search_base, "(objectClass=user)", attributes=attributes,
+                                                paged_size=page_size or DEFAULT_PAGE_SIZE, generator=True)
+    for entry in entries:
+        if entry.get('type') != 'searchResEntry':
+            continue  # skip referrals
+        yield user_from_attributes(entry['attributes'], attributes)
 
-        users = []
-        for entry in conn.entries:
-            # Dynamically construct the result dictionary based on attributes
-            user_data = {}
-            for attr in attributes:
-                value = getattr(entry, attr, None)  # Retrieve the attribute if it exists
-                # Special handling for userAccountControl
-                if attr == "userAccountControl" and value:
-                    uac_value = int(value.value)  # Convert the value to an integer
-                    flags = [flag for flag_val, flag in userAccountControlFlags.items() if uac_value & flag_val]
-                    user_data[attr] = ", ".join(flags) if flags else "UNKNOWN"
-                else:
-                    user_data[attr] = value.value if value else None
 
-            users.append(user_data)
+def get_all_users(conn: Connection, search_base: str, attributes: list = None, page_size: int = None):
+    """
+    Retrieves a list of users from Active Directory with dynamically defined attributes.
+    userAccountControl values read through the returned rows are mapped to the corresponding flags.
 
-        return users
+    Args:
+        conn (Connection): An active LDAP connection.
+        search_base (str): The base from which to perform the search in Active Directory.
+        attributes (list): A list of attributes to fetch (optional).
+        page_size (int): Number of entries requested per page (optional).
 
+    Returns:
+        list: A list of UserRecord rows (read-only mappings) containing user data.
+    """
+    try:
+        return list(iter_all_users(conn, search_base, attributes, page_size))
     except Exception as e:
         # Return an empty list if any exception occurs
         return []
 
 
-def get_all_users_count(conn, search_base: str) -> int:
-    users = get_all_users(conn, search_base)
-    return len(users)
+def user_search_filter(filter_text: str = None) -> str:
+    """
+    Builds the LDAP filter for users, optionally restricted to those whose cn, sAMAccountName,
+    displayName or mail contains filter_text.
+    """
+    filter_text = (filter_text or '').strip()
+    if not filter_text:
+        return '(objectClass=user)'
+    escaped = escape_filter_chars(filter_text)
+    matches = ''.join(f'({attr}=*{escaped}*)' for attr in FILTERABLE_USER_ATTRIBUTES)
+    return f'(&(objectClass=user)(|{matches}))'
+
+
+def get_users_page(conn: Connection, search_base: str, attributes: list = None, offset: int = 0, count: int = 50,
+                   sort_key: str = 'cn', reverse: bool = False, filter_text: str = None) -> dict:
+    """
+    Retrieves one screen of users, sorted and windowed by the server with the server-side
+    sort and Virtual List View controls, so only `count` entries cross the wire.
+
+    Args:
+        conn (Connection): An active LDAP connection.
+        search_base (str): The base from which to perform the search in Active Directory.
+        attributes (list): A list of attributes to fetch (optional).
+        offset (int): 0-based position of the first user of the page in the sorted list.
+        count (int): Number of users on the page.
+        sort_key (str): Attribute to sort by, one of SORTABLE_USER_ATTRIBUTES.
+        reverse (bool): Sort in descending order.
+        filter_text (str): Only return users whose cn, sAMAccountName, displayName or mail contains this text.
+
+    Returns:
+        dict: users (list of UserRecord rows, as returned by get_all_users), offset (actual 0-based
+              position of the first user), count and total (number of users matching the filter).
+    """
+    if attributes is None or not isinstance(attributes, list):
+        attributes = ['cn', 'distinguishedName', 'mail']
+    if sort_key not in SORTABLE_USER_ATTRIBUTES:
+        raise ValueError(f"Cannot sort users by '{sort_key}'")
+    count = max(1, count)
+    offset = max(0, offset)
+
+    controls = [
+        server_side_sort_control([(sort_key, reverse)]),
+        # VLV offsets are 1-based; take the target entry and the count - 1 entries after it
+        vlv_control(offset + 1, 0, count - 1)
+    ]
+    conn.search(search_base, user_search_filter(filter_text), attributes=attributes, controls=controls)
+
+    users = [user_from_attributes(entry['attributes'], attributes)
+             for entry in conn.response if entry.get('type') == 'searchResEntry']
+
+    vlv_response = conn.result.get('controls', {}).get(VLV_RESPONSE_OID)
+    if vlv_response:
+        position = decode_vlv_response(vlv_response['value'])
+        total = position['content_count']
+        # The server clamps offsets past the end of the list to its last entry
+        offset = max(0, position['target_position'] - 1) if users else offset
+    else:
+        total = offset + len(users)
+
+    return {'users': users, 'offset': offset, 'count': count, 'total': total}
+
+
+def fetch_entries_by_dn(conn: Connection, dns, attributes: list, object_filter: str = '(objectClass=*)',
+                        batch_size: int = None) -> dict:
+    """
+    Reads attributes of many objects with a few OR-filter searches on distinguishedName (one per
+    batch of DNs and domain) instead of one BASE search per object. Searches that fail for a
+    transient reason are retried (see ldap_retry).
+
+    Args:
+        conn (Connection): An active LDAP connection.
+        dns (iterable): Distinguished names of the objects.
+        attributes (list): Attributes to read.
+        object_filter (str): Filter the objects must also match (optional).
+        batch_size (int): DNs per search (optional).
+
+    Returns:
+        dict: normalized DN -> (DN as stored, raw attributes). Objects that were not found are missing.
+    """
+    batch_size = batch_size or LOOKUP_BATCH_SIZE
+    by_base = {}
+    for dn in dict.fromkeys(dns):
+        domain = dn_to_domain(dn)
+        if domain:
+            by_base.setdefault(build_dn([('DC', part) for part in domain.split('.')]), []).append(dn)
+
+    found = {}
+    for search_base, base_dns in by_base.items():
+        for start in range(0, len(base_dns), batch_size):
+            batch = base_dns[start:start + batch_size]
+            search_filter = '(&{}(|{}))'.format(
+                object_filter, ''.join(f'(distinguishedName={escape_filter_chars(dn)})' for dn in batch))
+            call_with_retry(conn, 'search', search_base, search_filter, attributes=attributes)
+            for entry in conn.response or []:
+                if entry.get('type') == 'searchResEntry':
+                    found[normalize_dn(entry['dn'])] = (entry['dn'], entry['raw_attributes'])
+    return found
+
+
+def fetch_users_by_dn(conn: Connection, user_dns, attributes: list, batch_size: int = None) -> dict:
+    """
+    Reads attributes of many users in batches (see fetch_entries_by_dn).
+
+    Returns:
+        dict: normalized DN -> (DN as stored, raw attributes). Users that were not found are missing.
+    """
+    return fetch_entries_by_dn(conn, user_dns, attributes, '(objectClass=person)', batch_size)
+
 
 def get_user_groups(conn, user_dn):
     conn.search(user_dn, '(objectClass=*)', attributes=['memberOf'])
     if conn.entries:
         groups = conn.entries[0].memberOf.values if 'memberOf' in conn.entries[0] else []
-        return [g.split(',')[0].replace('CN=', '') for g in groups]
+        return [get_cn(g) or g for g in groups]
     return []
 
 
@@ -1,55 +1,218 @@
-import csv
+import itertools
 import os
-import openpyxl
-from app.models.add import create_user
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ldap3 import MODIFY_REPLACE
+from app.models.add import check_new_user, new_user_dn, new_user_attributes
+from app.models import connection as co
 from app.config_utils import get_default_ou
+from app.models.uid_allocator import uid_allocator
+from app.models.batch_journal import open_journal
+from app.models.all_users import LOOKUP_BATCH_SIZE
+from app.models.batch_files import iter_records, iter_chunks
+from app.models.batch_validate import validate_import_rows
+from app.models.write_throttle import get_write_throttle, is_overloaded
+from app.models.ldap_retry import (RETRY_ATTEMPTS, is_transient, is_connection_error, already_applied,
+                                   backoff_delay, rebind)
 
-def import_users_from_file(connection, filepath, dc, search_base):
-    success = 0
-    fail = 0
-    errors = []
+# Rows imported at the same time, each on its own bound connection (1 = one row after another)
+DEFAULT_IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 1))
+MAX_IMPORT_WORKERS = int(os.environ.get('IMPORT_MAX_WORKERS', 16))
 
-    ext = os.path.splitext(filepath)[1].lower()
-    rows = []
 
-    if ext == ".csv":
-        with open(filepath, newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            rows = list(reader)
+def _import_row(connection, row, default_ou, dc, search_base, uid_number, throttle=None):
+    """
+    Creates the user of one file row in three steps: add, password, pwdLastSet. A step that fails
+    for a transient reason (see ldap_retry) is retried after a backoff, continuing with that step,
+    so an added user whose password could not be set yet is finished instead of added again.
+    An add retried after a dropped connection may find the user there: that attempt went through.
+    After any other failure (e.g. busy) entryAlreadyExists means the name is taken, and the row fails.
+    Each LDAP call takes its own slot of the DC's write throttle (see write_throttle), given back
+    before a backoff, so the throttle sees the latency of single writes.
+    Returns (ok, error message or None, whether the failure was transient).
+    """
+    throttle = throttle or get_write_throttle(connection)
+    username = row.get('username')
+    try:
+        problem = check_new_user(username, row.get('first_name'), row.get('last_name'), row.get('password'))
+        if problem:
+            return False, f"❌ {username}: {problem}", False
+        user_dn = new_user_dn(row['first_name'], row['last_name'], default_ou, dc)
+        attributes = new_user_attributes(username, row['first_name'], row['last_name'], dc, uid_number)
+    except Exception as e:
+        return False, f"❌ {username or 'unknown'}: {str(e)}", False
+    steps = [
+        ('add', lambda: connection.add(user_dn, attributes=attributes)),
+        ('password', lambda: connection.extend.microsoft.modify_password(user_dn, row['password'])),
+        ('pwdLastSet', lambda: connection.modify(user_dn, {'pwdLastSet': [(MODIFY_REPLACE, ['-1'])]})),
+    ]
+    step, attempt = 0, 1
+    lost = False  # whether the previous attempt of this step dropped with the connection
+    while step < len(steps):
+        name, run = steps[step]
+        with throttle.slot() as write:
+            try:
+                ok, error = bool(run()), None
+            except Exception as e:
+                ok, error = False, e
+            result = connection.result if error is None else None  # only results of the call just made
+            write.overloaded = not ok and is_overloaded(result, error)
+        if not ok and name == 'add' and lost and already_applied('add', result, error):
+            ok = True
+        if ok:
+            step, lost = step + 1, False
+            continue
 
-    elif ext in [".xlsx", ".xls"]:
-        wb = openpyxl.load_workbook(filepath)
-        sheet = wb.active
-        headers = [cell.value for cell in sheet[1]]
+        transient = is_transient(result, error)
+        if attempt == RETRY_ATTEMPTS or not transient:
+            reason = str(error) if error is not None else (result or {}).get('description')
+            return False, f"❌ {username}: {name} failed ({reason})", transient
+        time.sleep(backoff_delay(attempt))
+        attempt += 1
+        lost = is_connection_error(error)
+        if lost or connection.closed:
+            rebind(connection)
+    return True, None, False
 
-        for row in sheet.iter_rows(min_row=2, values_only=True):
-            row_data = dict(zip(headers, row))
-            rows.append(row_data)
 
-    else:
-        return {"error": "Unsupported file type. Use CSV or XLSX."}
+def _open_worker_connections(connection, count):
+    """
+    Returns a queue holding `connection` and up to count - 1 additional bound connections,
+    and the list of the additional ones (to be released by the caller).
+    """
+    connections = queue.Queue()
+    connections.put(connection)
+    extra = []
+    for _ in range(count - 1):
+        is_connected, worker_connection = co.acquire_sibling_connection(connection)
+        if not is_connected:
+            break  # import with the connections we have
+        extra.append(worker_connection)
+        connections.put(worker_connection)
+    return connections, extra
+
+
+def iter_import_file(filepath):
+    """
+    Returns an iterator over the data rows of a CSV, XLSX or JSON Lines user import file as
+    (row number, dict keyed by the header row) pairs (the schema fields for JSON Lines), numbered as
+    in the file. The file is read as the iterator advances (see batch_files). Raises ValueError
+    for other file types (right away).
+    """
+    return iter_records(filepath, schema='import_users')
+
+
+def read_import_file(filepath) -> list:
+    """
+    Reads the data rows of a user import file (see iter_import_file), e.g. for a preview.
+    """
+    return list(iter_import_file(filepath))
+
+
+def import_users_from_file(connection, filepath, dc, search_base, workers=None, progress=None, dry_run=False,
+                           on_start=None):
+    """
+    Creates the users listed in a CSV, XLSX or JSON Lines file.
+
+    The file is read twice, both times streamed: once to count the rows (a malformed JSON Lines
+    row fails the import here, before anything is written) and once to import them in chunks of
+    LOOKUP_BATCH_SIZE rows. Only the outcome of each row is kept, not its values.
+
+    With workers > 1 the rows are spread over that many bound connections by a bounded thread
+    pool, so the add / password / pwdLastSet round trips of different rows overlap.
+    The summary still lists the rows in file order. `progress`, when given, is called with the
+    number of finished rows after each row (from the worker threads when workers > 1).
+    `on_start`, when given, is called with the number of data rows and the number of rows already
+    finished (see below) before the first row is imported.
+    Each write of a row (add, password, pwdLastSet) takes a slot of the DC's write throttle
+    (see write_throttle), so fewer of them run at once while the DC is loaded.
+
+    Every row's outcome is written to a checkpoint journal (see batch_journal). If the import of
+    the same file by the same admin was cut short, the rows it finished are not imported again:
+    their recorded outcome is reported instead, without touching the directory. Rows that failed
+    for a transient reason are imported again.
+
+    With dry_run=True nothing is written: the rows are only checked (see validate_import_rows).
+
+    Returns:
+        dict: added and failed counts, errors (in row order) and results, one
+              {"row", "username", "ok", "error"} dict per data row (numbered as in the file); the
+              validation report with dry_run=True; or {"error": ...}.
+    """
+    try:
+        if dry_run:
+            return validate_import_rows(connection, iter_import_file(filepath), dc, search_base)
+        total = sum(1 for _ in iter_import_file(filepath))
+    except ValueError as e:
+        return {"error": str(e)}
 
     default_ou = get_default_ou()
+    throttle = get_write_throttle(connection)
+    outcomes = []  # (row number, username, ok, error) per data row, in file order
+    with open_journal('import_users', filepath, connection, search_base) as journal:
+        done = len(journal.completed)
+        if on_start is not None:
+            on_start(total, done)
+
+        workers = max(1, min(workers or DEFAULT_IMPORT_WORKERS, MAX_IMPORT_WORKERS, total - done or 1))
+        finished = itertools.count(done + 1)  # next() is atomic, so worker threads can share it
+
+        def import_row(worker_connection, row_number, row, uid_number):
+            # Every write of the row waits for a slot of the DC's write throttle (see _import_row)
+            ok, error, transient = _import_row(worker_connection, row, default_ou, dc, search_base, uid_number,
+                                               throttle)
+            journal.record(row_number, ok, error, transient=transient)
+            if progress is not None:
+                progress(next(finished))
+            return ok, error
+
+        connections, extra = _open_worker_connections(connection, workers) if workers > 1 else (None, [])
 
-    for row in rows:
+        def run(args):
+            # ldap3 sync connections are not thread safe: each row borrows a connection exclusively
+            worker_connection = connections.get()
+            try:
+                return import_row(worker_connection, *args)
+            finally:
+                connections.put(worker_connection)
+
+        executor = ThreadPoolExecutor(max_workers=connections.qsize()) if connections is not None else None
         try:
-            ok = create_user(
-                connection,
-                row['username'],
-                row['first_name'],
-                row['last_name'],
-                row['password'],
-                default_ou,    # ✅ dodany OU
-                dc,
-                search_base
-            )
-            if ok:
-                success += 1
-            else:
-                fail += 1
-                errors.append(f"❌ {row['username']}")
-        except Exception as e:
-            fail += 1
-            errors.append(f"❌ {row.get('username', 'unknown')}: {str(e)}")
-
-    return {"added": success, "failed": fail, "errors": errors}
+            for chunk in iter_chunks(iter_import_file(filepath), LOOKUP_BATCH_SIZE):
+                chunk_outcomes = {}  # row number -> (ok, error)
+                pending = []
+                for row_number, row in chunk:
+                    record = journal.get(row_number)
+                    if record is not None:
+                        chunk_outcomes[row_number] = (record['ok'], record['error'])
+                    else:
+                        pending.append((row_number, row))
+
+                # One reservation per chunk instead of a uidNumber lookup per row
+                uid_numbers = uid_allocator.reserve(connection, search_base, len(pending)) if pending else range(0)
+                args = [(row_number, row, uid_number) for (row_number, row), uid_number in zip(pending, uid_numbers)]
+                if executor is None:
+                    new_outcomes = [import_row(connection, *row_args) for row_args in args]
+                else:
+                    new_outcomes = list(executor.map(run, args))  # map keeps file order
+                for (row_number, _), outcome in zip(pending, new_outcomes):
+                    chunk_outcomes[row_number] = outcome
+
+                outcomes.extend((row_number, row.get('username'), *chunk_outcomes[row_number])
+                                for row_number, row in chunk)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            for worker_connection in extra:
+                co.release_connection(worker_connection)
+
+    results = [{"row": row_number, "username": username, "ok": ok, "error": error}
+               for row_number, username, ok, error in outcomes]
+    success = sum(1 for result in results if result["ok"])
+    return {
+        "added": success,
+        "failed": len(results) - success,
+        "errors": [result["error"] for result in results if not result["ok"]],
+        "results": results
+    }
@@ -1,7 +1,8 @@
-import csv
-import openpyxl
 import connection_utils as cu
 from ldap3 import Connection, MODIFY_REPLACE
+from app.models.batch_files import iter_rows
+from app.models.write_pipeline import WritePipeline
+from app.models.batch_journal import open_journal
 
 
 def delete_user_from_ad(conn: Connection, canonical_name: str, domain: str, organizational_unit: str = "Users") -> bool:
@@ -25,74 +26,105 @@ def delete_user_from_ad(conn: Connection, canonical_name: str, domain: str, orga
     return conn.result['result'] == 0
 
 
-def delete_multiple_users(conn: Connection, file_path: str) -> int:
+def iter_deletion_file(file_path: str):
     """
-    Process a batch file (CSV or XLSX) and delete users listed in the file.
+    Returns an iterator over the users of a batch file (CSV or XLSX) with the columns Canonical Name,
+    Domain and Organizational Unit, after a header row, or of a JSON Lines file with those fields.
+    The file is read as the iterator advances (see batch_files).
 
     Args:
-        conn (Connection): The connection object representing the connection to Active Directory.
-        file_path (str): The path to the CSV or XLSX file containing the user data.
+        file_path (str): The path to the CSV, XLSX or JSON Lines file containing the user data.
 
     Returns:
-        int: The number of users successfully processed.
+        iterator: (row number, distinguished name) pairs, in file order; the DN is None for an
+        incomplete row. Raises ValueError for other file types (right away).
     """
-    processed_count = 0
+    return _deletion_dns(iter_rows(file_path, schema='delete_users'))
 
-    file_extension = file_path.split('.')[-1].lower()
 
-    if file_extension == 'csv':
-        processed_count = csv_deletion(file_path, conn)
-    elif file_extension == 'xlsx':
-        processed_count = excel_deletion(file_path, conn)
+def _deletion_dns(records):
+    for row_number, record in records:
+        if len(record) < 3 or any(value is None for value in record[:3]):
+            yield row_number, None  # incomplete row
+            continue
+        canonical_name, domain, organizational_unit = (str(value).strip() for value in record[:3])
+        yield row_number, cu.create_distinguished_name(username=canonical_name, domain=domain,
+                                                       organizational_unit=organizational_unit)
 
-    return processed_count
 
+def read_deletion_file(file_path: str) -> list:
+    """
+    Reads the users of a deletion batch file (see iter_deletion_file).
 
-def csv_deletion(file_path: str, conn: Connection) -> int:
+    Returns:
+        list: (row number, DN) pairs, in file order (empty for other file types).
     """
-    Processes a CSV file to delete users listed in the file.
+    try:
+        user_dns = iter_deletion_file(file_path)
+    except ValueError:
+        return []
+    return list(user_dns)
+
+
+def delete_users(conn: Connection, rows, on_result=None, journal=None) -> list:
+    """
+    Deletes many users, pipelined over one asynchronous connection (see WritePipeline).
 
     Args:
-        file_path (str): The path to the CSV file containing the user data.
         conn (Connection): The connection object representing the connection to Active Directory.
+        rows (iterable): (row number, DN) pairs (see iter_deletion_file), read as the deletes are sent.
+                         A row without a DN fails as incomplete.
+        on_result (callable): Called with each result as soon as it is known, optional.
+        journal (BatchJournal): Checkpoint journal keyed by row number, optional. Rows it already
+                                holds are not deleted again; their recorded outcome is returned instead.
 
     Returns:
-        int: The number of users successfully processed.
+        list: One {"tag", "dn", "ok", "error", "transient"} result per row, tagged with its row number.
     """
-    processed_count = 0
-    with open(file_path, mode='r', newline='', encoding='utf-8') as file:
-        reader = csv.reader(file)
-        next(reader)  # Skip header row
-        for row in reader:
-            if row:
-                canonical_name = row[0].strip()
-                domain = row[1].strip()
-                organizational_unit = row[2].strip()
-                if delete_user_from_ad(conn, canonical_name, domain, organizational_unit):
-                    processed_count += 1
-
-    return processed_count
-
-
-def excel_deletion(file_path: str, conn: Connection) -> int:
+    results = []
+
+    def record(result):
+        if journal is not None:
+            journal.record(result["tag"], result["ok"], result["error"], transient=result["transient"])
+        if on_result is not None:
+            on_result(result)
+
+    with WritePipeline(conn, on_result=record) as pipeline:
+        for row_number, user_dn in rows:
+            if user_dn is None:
+                result = {"tag": row_number, "dn": None, "ok": False, "error": "incomplete row", "transient": False}
+                results.append(result)
+                record(result)
+                continue
+            done = journal.get(row_number) if journal is not None else None
+            if done is not None:
+                results.append({"tag": row_number, "dn": user_dn, "ok": done["ok"], "error": done["error"],
+                                "transient": False})
+                continue
+            pipeline.delete(user_dn, tag=row_number)
+
+    results.extend(pipeline.results)
+    results.sort(key=lambda result: result["tag"])
+    return results
+
+
+def delete_multiple_users(conn: Connection, file_path: str) -> int:
     """
-    Processes an Excel (XLSX) file to delete users listed in the file.
+    Process a batch file (CSV, XLSX or JSON Lines) and delete users listed in the file.
+    The file is read through once first, so a malformed row stops the file before any user is
+    deleted; then it is read again as the deletes are sent.
 
     Args:
-        file_path (str): The path to the Excel file containing the user data.
         conn (Connection): The connection object representing the connection to Active Directory.
+        file_path (str): The path to the CSV, XLSX or JSON Lines file containing the user data.
 
     Returns:
         int: The number of users successfully processed.
+
+    Raises:
+        ValueError: For other file types or a malformed row, before anything is deleted.
     """
-    processed_count = 0
-    wb = openpyxl.load_workbook(file_path)
-    sheet = wb.active
-    for row in sheet.iter_rows(min_row=2):
-        canonical_name = row[0].value.strip()
-        domain = row[1].value.strip()
-        organizational_unit = row[2].value.strip()
-        if delete_user_from_ad(conn, canonical_name, domain, organizational_unit):
-            processed_count += 1
-
-    return processed_count
+    sum(1 for _ in iter_deletion_file(file_path))
+    with open_journal('delete_users', file_path, conn) as journal:
+        results = delete_users(conn, iter_deletion_file(file_path), journal=journal)
+    return sum(1 for result in results if result["ok"])
@@ -0,0 +1,142 @@
+# myapp/app/models/batch_files.py
+# Streaming row sources for batch files. Rows are read one at a time (csv reader, openpyxl in
+# read-only mode with values_only, one JSON object per line), so memory does not grow with the
+# size of the file the way a fully loaded workbook does.
+import csv
+import itertools
+import json
+import os
+import openpyxl
+
+# Extensions the batch loaders accept
+JSONL_EXTENSIONS = ('.jsonl', '.ndjson')
+SUPPORTED_EXTENSIONS = ('.csv', '.xlsx', '.xls') + JSONL_EXTENSIONS
+
+# Fields of a JSON Lines row per batch operation, in the column order of its CSV / XLSX files
+JSONL_SCHEMAS = {
+    'import_users': ('username', 'first_name', 'last_name', 'password'),
+    'delete_users': ('canonical_name', 'domain', 'organizational_unit'),
+    'block_users': ('canonical_name', 'domain', 'organizational_unit'),
+    'expire_users': ('canonical_name', 'domain', 'organizational_unit', 'expiration_date'),
+    'group_membership': ('user_canonical_name', 'user_domain', 'user_organizational_unit',
+                         'group_canonical_name', 'group_domain', 'group_organizational_unit'),
+}
+
+
+def _is_empty(values) -> bool:
+    return all(value is None or (isinstance(value, str) and not value.strip()) for value in values)
+
+
+def _iter_csv_rows(file_path: str, skip_header: bool):
+    # utf-8-sig: a byte order mark written by Excel is not part of the first header
+    with open(file_path, mode='r', newline='', encoding='utf-8-sig') as file:
+        reader = csv.reader(file)
+        if skip_header:
+            next(reader, None)
+        # Records, not lines: a quoted cell spanning lines is still one row, as in a spreadsheet
+        for row_number, row in enumerate(reader, start=2 if skip_header else 1):
+            if not _is_empty(row):
+                yield row_number, row
+
+
+def _iter_xlsx_rows(file_path: str, skip_header: bool):
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        first_row = 2 if skip_header else 1
+        for row_number, row in enumerate(wb.active.iter_rows(min_row=first_row, values_only=True), start=first_row):
+            if not _is_empty(row):
+                yield row_number, list(row)
+    finally:
+        wb.close()  # a read-only workbook keeps the file open until closed
+
+
+def _iter_jsonl_rows(file_path: str, fields: tuple):
+    name = os.path.basename(file_path)
+    with open(file_path, mode='r', encoding='utf-8-sig') as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{name}, line {line_number}: invalid JSON ({e})")
+            if not isinstance(record, dict):
+                raise ValueError(f"{name}, line {line_number}: expected a JSON object")
+            unknown = [key for key in record if key not in fields]
+            if unknown:
+                raise ValueError(f"{name}, line {line_number}: unknown field(s) {', '.join(unknown)} "
+                                 f"(expected {', '.join(fields)})")
+            row = []
+            for field in fields:
+                value = record.get(field)
+                # Numbers become strings, as CSV cells are; true/false or nested values are rejected
+                # rather than passed on as e.g. the username True
+                if isinstance(value, bool) or not isinstance(value, (str, int, float, type(None))):
+                    raise ValueError(f"{name}, line {line_number}: field {field} must be a string, a number or null")
+                row.append(str(value) if isinstance(value, (int, float)) else value)
+            yield line_number, row
+
+
+def iter_rows(file_path: str, skip_header: bool = True, schema: str = None):
+    """
+    Returns an iterator over the rows of a CSV or XLSX file (first sheet) as (row number, list of
+    cell values) pairs, skipping empty rows. Rows are numbered as in the file (the header is row 1),
+    so results and error messages can point at the row even when empty rows were left out.
+    The file is read as the iterator advances.
+
+    JSON Lines files (.jsonl / .ndjson) hold one object per line with the fields of the batch
+    operation's schema (see JSONL_SCHEMAS); each object becomes a row in the schema's column order.
+    They have no header row; their rows are numbered by line. A line that is not such an object
+    raises ValueError when reached.
+
+    Args:
+        file_path (str): Path to the file.
+        skip_header (bool): Leave out the first row (CSV / XLSX).
+        schema (str): Batch operation, a key of JSONL_SCHEMAS (needed for JSON Lines).
+
+    Raises:
+        ValueError: For other file types (right away, not when iterating).
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext not in SUPPORTED_EXTENSIONS:
+        raise ValueError(f"Unsupported file type {ext or file_path}. Use CSV, XLSX or JSON Lines.")
+    if ext in JSONL_EXTENSIONS:
+        if schema not in JSONL_SCHEMAS:
+            raise ValueError(f"JSON Lines input is not supported for {schema}")
+        return _iter_jsonl_rows(file_path, JSONL_SCHEMAS[schema])
+    if ext == '.csv':
+        return _iter_csv_rows(file_path, skip_header)
+    return _iter_xlsx_rows(file_path, skip_header)
+
+
+def iter_chunks(items, size: int):
+    """
+    Yields lists of up to `size` consecutive items of an iterable, reading it as it goes, so a batch
+    step (lookups, validation, writes) holds one chunk of rows at a time instead of the whole file.
+    """
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, max(1, size)))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_records(file_path: str, schema: str = None):
+    """
+    Returns an iterator over the data rows of a CSV or XLSX file as (row number, dict keyed by the
+    header row) pairs, or of a JSON Lines file with dicts of the fields of `schema` (see iter_rows).
+    Cells missing at the end of a row are None. Raises ValueError for other file types.
+    """
+    if os.path.splitext(file_path)[1].lower() in JSONL_EXTENSIONS:
+        fields = JSONL_SCHEMAS.get(schema, ())
+        return ((row_number, dict(zip(fields, row))) for row_number, row in iter_rows(file_path, schema=schema))
+    return _records(iter_rows(file_path, skip_header=False))
+
+
+def _records(rows):
+    _, header = next(rows, (None, None))
+    if header is None:
+        return
+    for row_number, row in rows:
+        yield row_number, {key: row[index] if index < len(row) else None for index, key in enumerate(header)}
@@ -0,0 +1,98 @@
+# myapp/app/models/batch_journal.py
+# Checkpoint journal of a batch run: one JSON line per finished row, appended as soon as the
+# row's outcome is known. When a run is cut short (worker killed, timeout), running the same
+# file again replays the journal and only processes the rows that have no outcome yet.
+from threading import Lock
+import hashlib
+import json
+import logging
+import os
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+JOURNAL_DIR = os.environ.get('BATCH_JOURNAL_DIR', os.path.join("app", "data", "journals"))
+
+
+class BatchJournal:
+    """
+    Append-only JSONL journal of row outcomes, keyed by a row key (index or DN).
+
+    Each record is flushed to the OS right away, so it survives the process being killed;
+    a torn last line (crash while writing) is ignored when the journal is read back.
+    Rows whose last record is a transient failure (record(..., transient=True)) do not count as
+    done, so a resumed run tries them again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = Lock()
+        self.completed = {}  # row key -> record, from a previous attempt of the same run
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get('transient'):
+                        self.completed.pop(record['key'], None)
+                    else:
+                        self.completed[record['key']] = record
+            if self.completed:
+                logger.info(f"Resuming batch run from {path}: {len(self.completed)} row(s) already done")
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(completed=exc_type is None)
+
+    def get(self, key):
+        return self.completed.get(self._key(key))
+
+    @staticmethod
+    def _key(key):
+        return key if isinstance(key, str) else str(key)  # JSON object keys come back as strings
+
+    def record(self, key, ok: bool, error: str = None, **extra):
+        """
+        Appends the outcome of one row.
+        """
+        record = {'key': self._key(key), 'ok': bool(ok), 'error': error, **extra}
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if record.get('transient'):
+                self.completed.pop(record['key'], None)
+            else:
+                self.completed[record['key']] = record
+
+    def close(self, completed: bool = False):
+        """
+        Closes the journal. A completed run deletes it, so running the file again later is a new run.
+        """
+        with self._lock:
+            if not self._file.closed:
+                os.fsync(self._file.fileno())
+                self._file.close()
+        if completed and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def open_journal(operation: str, file_path: str, conn, scope: str = '') -> BatchJournal:
+    """
+    Opens the journal of running `operation` on a batch file over `conn`. The journal is identified
+    by the operation, the DC and bind identity of `conn`, the scope (e.g. the search base) and the
+    file content, so the same upload saved under another name resumes the same run, while another
+    admin (or the same file against another DC) starts a run of their own.
+    """
+    identity = f"{(conn.server.host or '').lower()}:{conn.server.port}\0{(conn.user or '').lower()}"
+    digest = hashlib.sha256(f"{operation}\0{identity}\0{scope.lower()}\0".encode('utf-8'))
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    os.makedirs(JOURNAL_DIR, exist_ok=True)
+    return BatchJournal(os.path.join(JOURNAL_DIR, f"{operation}_{digest.hexdigest()[:32]}.jsonl"))
@@ -0,0 +1,214 @@
+# myapp/app/models/batch_validate.py
+# Dry-run validation of batch files: every row is checked against the directory before anything
+# is written, with a few OR-filter searches of up to LDAP_LOOKUP_BATCH_SIZE values each instead of
+# finding the conflicts one failed write at a time. Rows are read and checked one chunk at a time.
+from ldap3 import NO_ATTRIBUTES
+from ldap3.utils.conv import escape_filter_chars
+
+from app.config_utils import get_default_ou
+from app.models.add import USERNAME_PATTERN, MIN_PASSWORD_LENGTH, new_user_dn
+from app.models.all_users import LOOKUP_BATCH_SIZE, fetch_entries_by_dn, fetch_users_by_dn
+from app.models.batch_files import iter_chunks
+from app.models.dn_utils import normalize_dn
+from app.models.expire import expiration_timestamp
+
+# AD limit on sAMAccountName (pre-Windows 2000 logon name)
+MAX_SAM_ACCOUNT_NAME_LENGTH = 20
+
+
+class ValidationReport:
+    """
+    Problems found in a batch file, per row. A row can have several problems.
+    """
+
+    def __init__(self, total: int = 0):
+        self.total = total
+        self._problems = {}  # row -> {"row", "subject", "errors"}
+
+    def add(self, row, subject: str, error: str):
+        problem = self._problems.setdefault(row, {"row": row, "subject": subject, "errors": []})
+        problem["errors"].append(error)
+
+    @property
+    def problems(self) -> list:
+        return [self._problems[row] for row in sorted(self._problems)]
+
+    @property
+    def ok(self) -> bool:
+        return not self._problems
+
+    def to_dict(self) -> dict:
+        """
+        Returns:
+            dict: "total" rows, "valid" and "invalid" row counts, "ok" and "problems", one
+                  {"row", "subject", "errors"} dict per invalid row, in row order.
+        """
+        return {
+            "total": self.total,
+            "valid": self.total - len(self._problems),
+            "invalid": len(self._problems),
+            "ok": self.ok,
+            "problems": self.problems
+        }
+
+
+def find_existing_values(conn, search_base: str, attribute: str, values, batch_size: int = None) -> dict:
+    """
+    Looks up which of many values of a (unique) attribute are already taken, e.g. sAMAccountName,
+    with one (|(attribute=value)...) search per batch of values.
+
+    Returns:
+        dict: lowercased value -> DN of the object that has it.
+    """
+    batch_size = batch_size or LOOKUP_BATCH_SIZE
+    values = list(dict.fromkeys(str(value).lower() for value in values))
+    found = {}
+    for start in range(0, len(values), batch_size):
+        batch = values[start:start + batch_size]
+        search_filter = '(|{})'.format(''.join(f'({attribute}={escape_filter_chars(value)})' for value in batch))
+        conn.search(search_base, search_filter, attributes=[attribute])
+        for entry in conn.response or []:
+            if entry.get('type') != 'searchResEntry':
+                continue
+            for value in entry['attributes'].get(attribute) or []:
+                found[str(value).lower()] = entry['dn']
+    return found
+
+
+def find_existing_dns(conn, dns, batch_size: int = None) -> set:
+    """
+    Returns the normalized DNs of the given objects (of any class) that exist.
+    """
+    return set(fetch_entries_by_dn(conn, dns, [NO_ATTRIBUTES], batch_size=batch_size))
+
+
+def _text(value) -> str:
+    return str(value).strip() if value is not None else ''
+
+
+def validate_import_rows(conn, rows, dc: str, search_base: str, batch_size: int = None) -> dict:
+    """
+    Checks the rows of a user import file the way create_user would, without writing anything:
+    required fields, username format and length, password length, usernames and CNs repeated in
+    the file, sAMAccountNames already taken, users whose CN already exists in the target OU and
+    a missing target OU. Rows are read and looked up in chunks of `batch_size`, with a few batched
+    searches per chunk; only the usernames and DNs seen so far are kept for the repeat checks.
+
+    Args:
+        conn: LDAP connection object.
+        rows (iterable): (row number, row dict) pairs (see iter_import_file); the dicts have the keys
+                         username, first_name, last_name and password.
+        dc (str): Domain DN the users would be created in (e.g. "DC=example,DC=com").
+        search_base (str): Search base for the sAMAccountName lookup.
+        batch_size (int): Rows per chunk and values per search (optional).
+
+    Returns:
+        dict: The report, see ValidationReport.to_dict. Rows are numbered as in the file.
+    """
+    batch_size = batch_size or LOOKUP_BATCH_SIZE
+    report = ValidationReport()
+    default_ou = get_default_ou()
+    container_dn = f"{default_ou},{dc}"
+    container_exists = None
+
+    usernames = {}  # lowercased username -> first row
+    user_dns = {}  # normalized user DN -> first row
+    for chunk in iter_chunks(rows, batch_size):
+        report.total += len(chunk)
+        checked = []  # (row, username, user DN) of rows to look up
+        for line, row in chunk:
+            username, first_name, last_name, password = (
+                _text(row.get(key)) for key in ('username', 'first_name', 'last_name', 'password'))
+            if not all([username, first_name, last_name, password]):
+                report.add(line, username, "All fields are required.")
+                continue
+            if not USERNAME_PATTERN.match(username):
+                report.add(line, username, "Invalid username format.")
+            elif len(username) > MAX_SAM_ACCOUNT_NAME_LENGTH:
+                report.add(line, username, f"Username is longer than {MAX_SAM_ACCOUNT_NAME_LENGTH} characters.")
+            if len(password) < MIN_PASSWORD_LENGTH:
+                report.add(line, username, f"Password must be at least {MIN_PASSWORD_LENGTH} characters long.")
+
+            user_dn = new_user_dn(first_name, last_name, default_ou, dc)
+            first = usernames.setdefault(username.lower(), line)
+            if first != line:
+                report.add(line, username, f"Username repeats row {first}.")
+            first = user_dns.setdefault(normalize_dn(user_dn), line)
+            if first != line:
+                report.add(line, username, f"Name '{first_name} {last_name}' repeats row {first}.")
+            checked.append((line, username, user_dn))
+
+        if not checked:
+            continue
+        if container_exists is None:
+            container_exists = normalize_dn(container_dn) in find_existing_dns(conn, [container_dn], batch_size)
+        if not container_exists:
+            for line, username, _ in checked:
+                report.add(line, username, f"Target container {container_dn} does not exist.")
+
+        taken = find_existing_values(conn, search_base, 'sAMAccountName', (username for _, username, _ in checked),
+                                     batch_size)
+        existing_dns = find_existing_dns(conn, (user_dn for _, _, user_dn in checked), batch_size)
+        for line, username, user_dn in checked:
+            if username.lower() in taken:
+                report.add(line, username, f"Username is already used by {taken[username.lower()]}.")
+            if normalize_dn(user_dn) in existing_dns:
+                report.add(line, username, "An object with this name already exists in the target OU.")
+    return report.to_dict()
+
+
+def validate_user_dns(conn, rows, batch_size: int = None) -> dict:
+    """
+    Checks that the users listed in a delete / block batch file exist, with one batched search
+    per chunk of `batch_size` rows.
+
+    Args:
+        rows (iterable): (row number, DN) pairs (see iter_deletion_file); the DN is None for an
+                         incomplete row.
+
+    Returns:
+        dict: The report, see ValidationReport.to_dict. Rows are numbered as in the file.
+    """
+    batch_size = batch_size or LOOKUP_BATCH_SIZE
+    report = ValidationReport()
+    for chunk in iter_chunks(rows, batch_size):
+        report.total += len(chunk)
+        found = fetch_users_by_dn(conn, (user_dn for _, user_dn in chunk if user_dn is not None), [NO_ATTRIBUTES],
+                                  batch_size)
+        for row, user_dn in chunk:
+            if user_dn is None:
+                report.add(row, '', "Incomplete row.")
+            elif normalize_dn(user_dn) not in found:
+                report.add(row, user_dn, "User not found.")
+    return report.to_dict()
+
+
+def validate_expiration_rows(conn, rows, batch_size: int = None) -> dict:
+    """
+    Checks an expiration batch file: dates and user existence, with one batched search per chunk
+    of `batch_size` rows.
+
+    Args:
+        rows (iterable): (row number, user DN, 'DD-MM-YYYY') triples (see iter_expiration_file);
+                         DN and date are None for an incomplete row.
+
+    Returns:
+        dict: The report, see ValidationReport.to_dict. Rows are numbered as in the file.
+    """
+    batch_size = batch_size or LOOKUP_BATCH_SIZE
+    report = ValidationReport()
+    for chunk in iter_chunks(rows, batch_size):
+        report.total += len(chunk)
+        found = fetch_users_by_dn(conn, (user_dn for _, user_dn, _ in chunk if user_dn is not None), [NO_ATTRIBUTES],
+                                  batch_size)
+        for row, user_dn, expiration_date in chunk:
+            if user_dn is None:
+                report.add(row, '', "Incomplete row.")
+                continue
+            try:
+                expiration_timestamp(expiration_date)
+            except ValueError:
+                report.add(row, user_dn, f"Invalid expiration date '{expiration_date}' (expected DD-MM-YYYY).")
+            if normalize_dn(user_dn) not in found:
+                report.add(row, user_dn, "User not found.")
+    return report.to_dict()
@@ -1,6 +1,10 @@
 from connection_utils import create_distinguished_name
 from ldap3 import MODIFY_REPLACE
-import csv, openpyxl
+
+from app.models.all_users import ACCOUNTDISABLE, LOOKUP_BATCH_SIZE, fetch_users_by_dn
+from app.models.batch_files import iter_rows, iter_chunks
+from app.models.dn_utils import normalize_dn
+from app.models.write_pipeline import WritePipeline
 
 def change_users_block_status(conn, canonical_name: str, domain: str, organizational_unit: str = "CN=Users") -> bool:
     """
@@ -74,83 +78,136 @@ def block_user_account(conn, canonical_name: str, domain: str, organizational_un
     return False
 
 
-def block_multiple_users(conn, file_path: str) -> int:
-    """
-    Processes a CSV or XLSX file and blocks listed users by disabling their accounts.
+def fetch_account_states(conn, user_dns, batch_size: int = None) -> dict:
     """
-    processed_count = 0
-    try:
-        file_extension = file_path.split('.')[-1].lower()
-
-        if file_extension == 'csv':
-            processed_count = csv_blocking(conn, file_path)
-        elif file_extension == 'xlsx':
-            processed_count = excel_blocking(conn, file_path)
-        else:
-            print(f"Unsupported file extension: {file_extension}")
-    except Exception as e:
-        print(f"Exception while processing file: {e}")
-
-    return processed_count
+    Reads userAccountControl and pwdLastSet of many users in batches (see fetch_users_by_dn).
 
-
-def csv_blocking(conn, file_path: str) -> int:
+    Returns:
+        dict: normalized DN -> {"dn": ..., "uac": int, "pwd_last_set": int | None}.
+              Users that were not found are missing from the result.
+    """
+    states = {}
+    found = fetch_users_by_dn(conn, user_dns, ['userAccountControl', 'pwdLastSet'], batch_size)
+    for key, (dn, raw) in found.items():
+        try:
+            uac = int(raw.get('userAccountControl')[0])
+        except (TypeError, IndexError, ValueError):
+            print(f"Failed to parse userAccountControl of {dn}")
+            continue
+        pwd_last_set = raw.get('pwdLastSet') or [None]
+        states[key] = {
+            "dn": dn,
+            "uac": uac,
+            "pwd_last_set": int(pwd_last_set[0]) if pwd_last_set[0] is not None else None
+        }
+    return states
+
+
+def bulk_change_block_status(conn, user_dns, action: str = 'block', on_result=None, batch_size: int = None) -> dict:
     """
-    Reads a CSV file and disables each user listed.
+    Blocks, unblocks or toggles many users. The DNs are read in chunks of `batch_size`; for each
+    chunk the current account states are prefetched with one batched search (see
+    fetch_account_states), new userAccountControl values are computed in memory and only the
+    modifies that change something are sent, pipelined over one connection for the whole list.
+
+    Args:
+        conn (Connection): An active LDAP connection.
+        user_dns (iterable): Distinguished names of the users. A DN listed twice is processed once.
+        action (str): 'block', 'unblock' or 'toggle'.
+        on_result (callable): Called with each write result (see WritePipeline), optional.
+        batch_size (int): DNs per chunk (optional, LOOKUP_BATCH_SIZE by default).
+
+    Returns:
+        dict: "changed" and "unchanged" (DNs already in the requested state), "not_found"
+              (DNs) and "failed" ((DN, reason) pairs).
     """
-    processed_count = 0
-    try:
-        with open(file_path, mode='r', newline='', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            header = next(reader)
-            for row in reader:
-                if len(row) < 3:
-                    print(f"Skipping incomplete row: {row}")
+    batch_size = batch_size or LOOKUP_BATCH_SIZE
+    summary = {"changed": [], "unchanged": [], "not_found": [], "failed": []}
+    seen = set()
+
+    with WritePipeline(conn, on_result=on_result) as pipeline:
+        for chunk in iter_chunks(user_dns, batch_size):
+            unique = []
+            for dn in chunk:
+                key = normalize_dn(dn)
+                if key not in seen:
+                    seen.add(key)
+                    unique.append(dn)
+            states = fetch_account_states(conn, unique, batch_size)
+
+            for dn in unique:
+                state = states.get(normalize_dn(dn))
+                if state is None:
+                    summary["not_found"].append(dn)
                     continue
 
-                canonical_name = row[0].strip()
-                domain = row[1].strip()
-                organizational_unit = row[2].strip()
+                uac = state["uac"]
+                disable = not uac & ACCOUNTDISABLE if action == 'toggle' else action == 'block'
+                new_account_control = uac | ACCOUNTDISABLE if disable else uac & ~ACCOUNTDISABLE
+                if new_account_control == uac:
+                    summary["unchanged"].append(dn)
+                    continue
+                if not disable and not state["pwd_last_set"]:
+                    # Same rule as change_users_block_status
+                    summary["failed"].append((dn, "pwdLastSet is 0 (user must change password at next login)"))
+                    continue
+                pipeline.modify(dn, {'userAccountControl': [(MODIFY_REPLACE, [str(new_account_control)])]}, tag=dn)
 
-                print(f"Processing: {canonical_name}, {domain}, {organizational_unit}")
+    for result in pipeline.results:
+        if result["ok"]:
+            summary["changed"].append(result["tag"])
+        else:
+            summary["failed"].append((result["tag"], result["error"]))
+    return summary
+
+
+def iter_block_file(file_path: str):
+    """
+    Returns an iterator over the users of a CSV or XLSX file with the columns Canonical Name, Domain
+    and Organizational Unit, after a header row, or of a JSON Lines file with those fields.
+    The file is read as the iterator advances (see batch_files). Raises ValueError for other file
+    types (right away).
+
+    Returns:
+        iterator: (row number, distinguished name) pairs, in file order; the DN is None for an
+        incomplete row.
+    """
+    return _block_dns(iter_rows(file_path, schema='block_users'))
 
-                if block_user_account(conn, canonical_name, domain, organizational_unit):
-                    processed_count += 1
-                else:
-                    print(f"Failed to block user: {canonical_name}")
-    except Exception as e:
-        print(f"Error reading CSV: {e}")
 
-    return processed_count
+def _block_dns(records):
+    for row_number, record in records:
+        if len(record) < 3 or any(value is None for value in record[:3]):
+            yield row_number, None  # incomplete row
+            continue
+        canonical_name, domain, organizational_unit = (str(value).strip() for value in record[:3])
+        yield row_number, create_distinguished_name(username=canonical_name, domain=domain,
+                                                    organizational_unit=organizational_unit)
 
 
-def excel_blocking(conn, file_path: str) -> int:
+def read_block_file(file_path: str) -> list:
     """
-    Reads an Excel file and disables each user listed.
+    Reads the users of a block batch file (see iter_block_file). Raises ValueError for other file types.
+
+    Returns:
+        list: (row number, DN) pairs, in file order.
     """
-    processed_count = 0
-    try:
-        wb = openpyxl.load_workbook(file_path)
-        sheet = wb.active
-        for row in sheet.iter_rows(min_row=2):
-            canonical_name = row[0].value.strip()
-            domain = row[1].value.strip()
-            organizational_unit = row[2].value.strip()
-            print(f"Processing from Excel: {canonical_name}, {domain}, {organizational_unit}")
-
-            if block_user_account(conn, canonical_name, domain, organizational_unit):
-                processed_count += 1
-            else:
-                print(f"Failed to block user: {canonical_name}")
-    except Exception as e:
-        print(f"Error reading Excel file: {e}")
-
-    return processed_count
-
-
-def get_blocked_users_count(conn, search_base: str) -> int:
+    return list(iter_block_file(file_path))
+
+
+def block_multiple_users(conn, file_path: str) -> int:
     """
-    Returns the number of currently disabled user accounts in the directory.
+    Processes a CSV, XLSX or JSON Lines file and blocks listed users by disabling their accounts.
+    The file is read through once first, so a malformed row raises ValueError before any account
+    is changed; then it is read in chunks as the users are blocked (see bulk_change_block_status).
+    Returns the number of listed users that are disabled afterwards.
     """
-    conn.search(search_base, '(&(objectClass=user)(userAccountControl:1.2.840.113556.1.4.803:=2))')
-    return len(conn.entries)
+    sum(1 for _ in iter_block_file(file_path))
+    user_dns = (user_dn for _, user_dn in iter_block_file(file_path) if user_dn is not None)
+    summary = bulk_change_block_status(conn, user_dns, action='block')
+
+    for dn in summary["not_found"]:
+        print(f"User not found: {dn}")
+    for dn, reason in summary["failed"]:
+        print(f"Failed to block user {dn}: {reason}")
+    return len(summary["changed"]) + len(summary["unchanged"])
@@ -1,8 +1,12 @@
 # myapp/app/models/connection.py
-from ldap3 import Server, Connection, ALL, Tls
+from ldap3 import Server, Connection, ALL, ASYNC, BASE, Tls
 from ldap3.core.exceptions import LDAPException
 import ssl  # For Tls configuration if needed for specific CA certs
 import logging  # For logging connection attempts and errors
+import hashlib
+import os
+import time
+from threading import Lock
 
 # Assuming connection_utils.py is in the same directory (models)
 # and that the 'models' directory is in sys.path.
@@ -10,25 +14,22 @@ import logging  # For logging connection attempts and errors
 # from ..connection_utils import validate_ldap_server, correct_username
 # For now, assuming it's in the same 'models' package:
 import connection_utils as cu  # Relative import for modules within the same package
+from app.models.server_info_cache import server_info_cache
 
 # Get a logger for this module
 logger = logging.getLogger(__name__)
 
 
-def connect_to_active_directory(ldap_server_form_input: str, username: str, password: str, domain: str) -> tuple[bool, Connection | None]:
+def _normalize_server_url(ldap_server_form_input: str) -> str:
     """
-    Creates a connection (plain LDAP) with Active Directory.
+    Normalizes the server given in the login form to a plain ldap:// URL.
 
     Args:
-        ldap_server_form_input (str): Server's IP or name (e.g., "ad.example.com" or "ldap://ad.example.com:389").
-        username (str): User's login name.
-        password (str): User's password.
-        domain (str): User's domain name (e.g., "example.com").
+        ldap_server_form_input (str): Server's IP or name, with or without a scheme.
 
     Returns:
-        Tuple (bool, Connection | None): Success flag and connection object (or None).
+        str: Server URL with the ldap:// scheme.
     """
-
     # Default to ldap:// if no scheme is provided
     if "://" not in ldap_server_form_input:
         server_url = f"ldap://{ldap_server_form_input}"
@@ -38,20 +39,46 @@ def connect_to_active_directory(ldap_server_form_input: str, username: str, pass
         if server_url.startswith("ldaps://"):
             logger.warning(f"LDAPS requested but not supported by server. Forcing downgrade to ldap://")
             server_url = server_url.replace("ldaps://", "ldap://")
+    return server_url
 
+
+def _open_connection(server_url: str, ldap_username: str, password: str) -> Connection:
+    """
+    Opens and binds a new connection. Raises LDAPException on failure.
+    """
+    # Root DSE and schema come from the shared cache when this server was seen before
+    server = server_info_cache.make_server(server_url)
+
+    conn = Connection(
+        server,
+        user=ldap_username,
+        password=password,
+        auto_bind=True,
+        raise_exceptions=True,
+        receive_timeout=15
+    )
+    server_info_cache.after_bind(server_url, conn)
+    return conn
+
+
+def connect_to_active_directory(ldap_server_form_input: str, username: str, password: str, domain: str) -> tuple[bool, Connection | None]:
+    """
+    Creates a connection (plain LDAP) with Active Directory.
+
+    Args:
+        ldap_server_form_input (str): Server's IP or name (e.g., "ad.example.com" or "ldap://ad.example.com:389").
+        username (str): User's login name.
+        password (str): User's password.
+        domain (str): User's domain name (e.g., "example.com").
+
+    Returns:
+        Tuple (bool, Connection | None): Success flag and connection object (or None).
+    """
+    server_url = _normalize_server_url(ldap_server_form_input)
     corrected_ldap_username = cu.correct_username(username=username, domain=domain)
 
     try:
-        server = Server(server_url, get_info=ALL, use_ssl=False)
-
-        conn = Connection(
-            server,
-            user=corrected_ldap_username,
-            password=password,
-            auto_bind=True,
-            raise_exceptions=True,
-            receive_timeout=15
-        )
+        conn = _open_connection(server_url, corrected_ldap_username, password)
 
         logger.info(f"Connected to LDAP server {server_url} as {corrected_ldap_username}")
         return True, conn
@@ -64,6 +91,254 @@ def connect_to_active_directory(ldap_server_form_input: str, username: str, pass
         return False, None
 
 
+class LDAPConnectionPool:
+    """
+    Per-process pool of already bound connections.
+
+    Connections are keyed by server URL, bind user and a hash of the password, so a
+    connection is only ever handed back to a caller presenting the same credentials.
+    Every gunicorn worker gets its own pool (the pool resets itself after a fork).
+    """
+
+    def __init__(self, max_size: int = 8, max_idle: float = 300.0, ping_after: float = 60.0):
+        """
+        Args:
+            max_size (int): Maximum number of idle connections kept by this worker.
+            max_idle (float): Seconds after which an idle connection is unbound instead of reused.
+            ping_after (float): Idle seconds after which a connection is probed before being reused.
+        """
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.ping_after = ping_after
+        self._lock = Lock()
+        self._pid = os.getpid()
+        self._idle = {}  # key -> list of (connection, last_used)
+        self._in_use = {}  # id(connection) -> key
+
+    @staticmethod
+    def _make_key(server_url: str, ldap_username: str, password: str) -> tuple:
+        password_hash = hashlib.sha256(password.encode('utf-8')).hexdigest()
+        return server_url.lower(), ldap_username.lower(), password_hash
+
+    def _check_fork(self):
+        # Sockets inherited from the parent process must not be shared, so just forget them
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._idle = {}
+            self._in_use = {}
+
+    def _is_alive(self, conn: Connection, idle_for: float) -> bool:
+        if conn.closed or not conn.bound:
+            return False
+        if idle_for < self.ping_after:
+            return True
+        try:
+            # Cheap probe: a BASE read of one root DSE attribute
+            return conn.search('', '(objectClass=*)', search_scope=BASE, attributes=['currentTime'])
+        except Exception as e:
+            logger.info(f"Pooled LDAP connection failed liveness probe: {e}")
+            return False
+
+    def _take_idle(self, key: tuple) -> Connection | None:
+        with self._lock:
+            self._check_fork()
+            candidates = self._idle.get(key, [])
+            while candidates:
+                conn, last_used = candidates.pop()
+                idle_for = time.monotonic() - last_used
+                if idle_for > self.max_idle:
+                    disconnect_from_active_directory(conn)
+                    continue
+                # Mark as used before probing so a concurrent release cannot hand it out twice
+                self._in_use[id(conn)] = key
+                break
+            else:
+                return None
+
+        if self._is_alive(conn, idle_for):
+            return conn
+
+        with self._lock:
+            self._in_use.pop(id(conn), None)
+        disconnect_from_active_directory(conn)
+        return self._take_idle(key)
+
+    def acquire(self, server_url: str, ldap_username: str, password: str) -> Connection:
+        """
+        Returns a bound connection, reusing an idle one when possible.
+        Raises LDAPException if a new connection cannot be established.
+        """
+        key = self._make_key(server_url, ldap_username, password)
+        conn = self._take_idle(key)
+        if conn is not None:
+            return conn
+
+        conn = _open_connection(server_url, ldap_username, password)
+        logger.info(f"Opened pooled LDAP connection to {server_url} as {ldap_username}")
+        with self._lock:
+            self._check_fork()
+            self._in_use[id(conn)] = key
+        return conn
+
+    def acquire_sibling(self, conn: Connection) -> Connection:
+        """
+        Returns another bound connection to the same server with the same credentials as
+        `conn`, which must have been acquired from this pool. Raises LDAPException on failure.
+        """
+        with self._lock:
+            key = self._in_use.get(id(conn))
+        if key is None:
+            raise LDAPException("Connection was not acquired from the pool")
+        server_url = key[0]
+        return self.acquire(server_url, conn.user, conn.password)
+
+    def release(self, conn: Connection, discard: bool = False) -> bool:
+        """
+        Returns a connection to the pool. Connections not acquired from this pool,
+        closed connections and connections released with discard=True are unbound.
+        """
+        with self._lock:
+            self._check_fork()
+            key = self._in_use.pop(id(conn), None)
+            if key is not None and not discard and not conn.closed and conn.bound:
+                self._idle.setdefault(key, []).append((conn, time.monotonic()))
+                self._evict_locked()
+                return True
+        return disconnect_from_active_directory(conn)
+
+    def _evict_locked(self):
+        """
+        Unbinds expired idle connections and the least recently used ones above max_size.
+        Must be called with the lock held.
+        """
+        now = time.monotonic()
+        idle = sorted(((last_used, key, conn) for key, conns in self._idle.items() for conn, last_used in conns),
+                      key=lambda item: item[0])
+        overflow = max(0, len(idle) - self.max_size)
+
+        kept = {}
+        for position, (last_used, key, conn) in enumerate(idle):
+            if position < overflow or now - last_used > self.max_idle:
+                disconnect_from_active_directory(conn)
+            else:
+                kept.setdefault(key, []).append((conn, last_used))
+        self._idle = kept
+
+    def clear(self):
+        """
+        Unbinds every idle connection.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn, _ in conns:
+                disconnect_from_active_directory(conn)
+
+
+_pool = LDAPConnectionPool(
+    max_size=int(os.environ.get('LDAP_POOL_MAX_SIZE', 8)),
+    max_idle=float(os.environ.get('LDAP_POOL_MAX_IDLE', 300)),
+    ping_after=float(os.environ.get('LDAP_POOL_PING_AFTER', 60))
+)
+
+
+def acquire_connection(ldap_server_form_input: str, username: str, password: str, domain: str) -> tuple[bool, Connection | None]:
+    """
+    Returns an already bound connection from the worker's pool, opening one if needed.
+
+    Args:
+        ldap_server_form_input (str): Server's IP or name (e.g., "ad.example.com" or "ldap://ad.example.com:389").
+        username (str): User's login name.
+        password (str): User's password.
+        domain (str): User's domain name (e.g., "example.com").
+
+    Returns:
+        Tuple (bool, Connection | None): Success flag and connection object (or None).
+        The connection must be handed back with release_connection.
+    """
+    server_url = _normalize_server_url(ldap_server_form_input)
+    corrected_ldap_username = cu.correct_username(username=username, domain=domain)
+
+    try:
+        return True, _pool.acquire(server_url, corrected_ldap_username, password)
+    except LDAPException as e:
+        logger.error(f"LDAP connection/bind error to {server_url} as {corrected_ldap_username}: {e}")
+        return False, None
+    except Exception as e:
+        logger.error(f"Generic error during LDAP connection attempt to {server_url}: {e}", exc_info=True)
+        return False, None
+
+
+def acquire_sibling_connection(conn: Connection) -> tuple[bool, Connection | None]:
+    """
+    Returns an additional bound connection with the same server and credentials as a
+    connection obtained from acquire_connection, e.g. for work spread over several threads
+    (ldap3 sync connections must not be shared between threads).
+
+    Args:
+        conn (Connection): A connection obtained from acquire_connection.
+
+    Returns:
+        Tuple (bool, Connection | None): Success flag and connection object (or None).
+        The connection must be handed back with release_connection.
+    """
+    try:
+        return True, _pool.acquire_sibling(conn)
+    except LDAPException as e:
+        logger.error(f"Could not open an additional LDAP connection as {conn.user}: {e}")
+        return False, None
+    except Exception as e:
+        logger.error(f"Generic error opening an additional LDAP connection: {e}", exc_info=True)
+        return False, None
+
+
+def open_async_connection(conn: Connection) -> tuple[bool, Connection | None]:
+    """
+    Opens a connection using ldap3's asynchronous strategy to the same server and with the
+    same credentials as `conn`. Operations on it return a message id immediately; results
+    are fetched with get_response. Errors are reported in the results, not raised.
+
+    Args:
+        conn (Connection): A bound connection.
+
+    Returns:
+        Tuple (bool, Connection | None): Success flag and connection object (or None).
+        The connection is not pooled and must be closed with disconnect_from_active_directory.
+    """
+    try:
+        async_conn = Connection(
+            conn.server,
+            user=conn.user,
+            password=conn.password,
+            client_strategy=ASYNC,
+            auto_bind=True,
+            raise_exceptions=False
+        )
+        return True, async_conn
+    except LDAPException as e:
+        logger.error(f"Could not open an asynchronous LDAP connection as {conn.user}: {e}")
+        return False, None
+    except Exception as e:
+        logger.error(f"Generic error opening an asynchronous LDAP connection: {e}", exc_info=True)
+        return False, None
+
+
+def release_connection(conn: Connection | None, discard: bool = False) -> bool:
+    """
+    Hands a connection obtained from acquire_connection back to the pool.
+
+    Args:
+        conn (Connection | None): The connection object or None.
+        discard (bool): Unbind the connection instead of keeping it (e.g. after an error).
+
+    Returns:
+        bool: False only if unbinding a discarded connection failed.
+    """
+    if conn is None:
+        return True
+    return _pool.release(conn, discard=discard)
+
+
 def disconnect_from_active_directory(conn: Connection | None) -> bool:
     """
     Disconnects from the Active Directory server by unbinding the connection.
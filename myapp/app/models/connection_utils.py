@@ -1,6 +1,7 @@
 # myapp/app/models/connection_utils.py
 import re
 import os
+from app.models.dn_utils import build_dn, parse_dn
 
 
 # from ldap3.utils.conv import escape_filter_chars # Uncomment if needed elsewhere
@@ -79,6 +80,7 @@ def create_distinguished_name(username: str, domain: str, organizational_unit: s
         domain (str): The domain (e.g., "sub.domain.local").
         organizational_unit (str, optional): The organizational unit (OU) or container string.
                              Can be "OU=Sales/OU=HR", "CN=Users", "Users" (will convert to CN=Users).
+                             Prefixed components are DN fragments (escaped as in RFC 4514), bare names are not.
                              If None, defaults to "CN=Users".
         is_group (bool): True if the DN is for a group, False for a user.
     Returns:
@@ -90,32 +92,36 @@ def create_distinguished_name(username: str, domain: str, organizational_unit: s
         raise ValueError("Username and domain cannot be empty for create_distinguished_name.")
 
     domain_dn_suffix = domain_to_dn(domain)  # Use the new function here
-    dn = f"CN={username},"
+    rdns = [("CN", username)]
 
     if not organizational_unit:
-        dn += "CN=Users,"
+        rdns.append(("CN", "Users"))
     elif "/" in organizational_unit:
         ou_path_components = organizational_unit.split("/")
-        processed_components = []
         for part in reversed(ou_path_components):
-            if not (part.upper().startswith("OU=") or part.upper().startswith("CN=")):
-                processed_components.append(f"OU={part}")
-            else:
-                processed_components.append(part)
-        dn += ",".join(processed_components) + ","
+            rdns.extend(_container_rdns(part))
     else:
-        standard_containers_map = {"USERS": "CN=Users", "BUILTIN": "CN=Builtin"}
+        standard_containers_map = {"USERS": "Users", "BUILTIN": "Builtin"}
         normalized_ou_str = organizational_unit.upper()
 
-        if normalized_ou_str in standard_containers_map and not organizational_unit.upper().startswith("CN="):
-            dn += f"{standard_containers_map[normalized_ou_str]},"
-        elif not (organizational_unit.upper().startswith("OU=") or organizational_unit.upper().startswith("CN=")):
-            dn += f"OU={organizational_unit},"
+        if normalized_ou_str in standard_containers_map:
+            rdns.append(("CN", standard_containers_map[normalized_ou_str]))
         else:
-            dn += f"{organizational_unit},"
+            rdns.extend(_container_rdns(organizational_unit))
 
-    dn += domain_dn_suffix
-    return dn
+    # Values are escaped (RFC 4514), so names containing commas, '+', '#' etc. stay valid
+    return build_dn(rdns, suffix=domain_dn_suffix)
+
+
+def _container_rdns(part: str) -> list:
+    """
+    Turns one component of an organizational unit path into RDNs. Components with a type
+    prefix ("OU=Sales", "CN=Users", "OU=Sales\\, EMEA,OU=IT") are DN fragments in RFC 4514
+    syntax; bare names ("Sales") are plain OU names.
+    """
+    if part.upper().startswith("OU=") or part.upper().startswith("CN="):
+        return list(parse_dn(part))
+    return [("OU", part)]
 
 
 def correct_username(username: str, domain: str) -> str:
@@ -0,0 +1,335 @@
+# myapp/app/models/directory_mirror.py
+from ldap3 import Connection, BASE
+from ldap3.protocol.microsoft import extended_dn_control, show_deleted_control
+from ldap3.utils.ciDict import CaseInsensitiveDict
+from datetime import datetime
+import base64
+from contextlib import closing
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+
+from app.models.all_users import SELECTABLE_USER_ATTRIBUTES, DEFAULT_PAGE_SIZE, user_from_attributes
+from app.models.range_retrieval import iter_ranged_values
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+MIRROR_ENABLED = os.environ.get('LDAP_MIRROR_ENABLED', '').lower() in ('1', 'true', 'yes')
+MIRROR_DIR = os.environ.get('LDAP_MIRROR_DIR', os.path.join("app", "data"))
+SYNC_INTERVAL = float(os.environ.get('LDAP_MIRROR_SYNC_INTERVAL', 0))
+
+# memberOf is a back-link: AD does not bump a user's uSNChanged when group membership
+# changes, so it is rebuilt from the mirrored groups' member values instead of being stored.
+_COMPUTED_ATTRIBUTES = {'memberof'}
+_SYNC_ATTRIBUTES = sorted(set(SELECTABLE_USER_ATTRIBUTES) | {
+    'name', 'cn', 'distinguishedName', 'objectGUID', 'objectClass', 'uSNChanged', 'isDeleted', 'member'
+})
+MIRRORED_USER_ATTRIBUTES = {attr.lower() for attr in _SYNC_ATTRIBUTES} | _COMPUTED_ATTRIBUTES
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    guid TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    dn TEXT NOT NULL,
+    dn_lower TEXT NOT NULL,
+    usn INTEGER NOT NULL,
+    attributes TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS objects_kind ON objects (kind, dn_lower);
+CREATE TABLE IF NOT EXISTS memberships (
+    group_guid TEXT NOT NULL,
+    member_guid TEXT,
+    member_dn_lower TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS memberships_group ON memberships (group_guid);
+CREATE INDEX IF NOT EXISTS memberships_member_guid ON memberships (member_guid);
+CREATE INDEX IF NOT EXISTS memberships_member_dn ON memberships (member_dn_lower);
+CREATE TABLE IF NOT EXISTS sync_state (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_RANGE_RE = re.compile(r'^member;range=(\d+)-(\d+|\*)$', re.IGNORECASE)
+
+
+def _single(value):
+    """
+    Returns the first value of a multi-valued result, or the value itself.
+    """
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+def _normalize_guid(guid) -> str:
+    return str(guid).strip('{}').replace('-', '').lower()
+
+
+def _split_extended_dn(value: str) -> tuple[str | None, str]:
+    """
+    Splits '<GUID=...>;<SID=...>;CN=...' (extended DN control format) into (guid, dn).
+    Plain DNs are returned unchanged with a None guid.
+    """
+    guid = None
+    rest = value
+    while rest.startswith('<'):
+        end = rest.find('>')
+        if end < 0:
+            break
+        part = rest[1:end]
+        rest = rest[end + 1:].lstrip(';')
+        if part.upper().startswith('GUID='):
+            guid = _normalize_guid(part[5:])
+    return guid, rest
+
+
+def _encode_value(value):
+    if isinstance(value, list):
+        return [_encode_value(v) for v in value]
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, bytes):
+        return {'$bytes': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, str) and value.startswith('<GUID='):
+        return _split_extended_dn(value)[1]
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def _decode_value(obj):
+    if '$datetime' in obj:
+        return datetime.fromisoformat(obj['$datetime'])
+    if '$bytes' in obj:
+        return base64.b64decode(obj['$bytes'])
+    return obj
+
+
+class DirectoryMirror:
+    """
+    Local SQLite copy of the users and groups below one search base.
+
+    The first sync loads everything; later syncs only fetch objects whose
+    uSNChanged is above the stored watermark (tombstones included, via the
+    show-deleted control). The watermark is tied to the DC it was read from,
+    since USNs are local to each DC; talking to another DC triggers a full reload.
+
+    The mirror is shared by everyone using the application, so it should only be
+    enabled when all administrators may see the same users and groups.
+    """
+
+    def __init__(self, db_path: str, sync_interval: float = 0.0, page_size: int = None):
+        self.db_path = db_path
+        self.sync_interval = sync_interval
+        self.page_size = page_size or DEFAULT_PAGE_SIZE
+        self._last_sync = 0.0
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with closing(self._connect()) as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit mode; transactions are opened explicitly with BEGIN IMMEDIATE
+        return sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+
+    @staticmethod
+    def _state(db: sqlite3.Connection) -> dict:
+        return dict(db.execute('SELECT name, value FROM sync_state').fetchall())
+
+    def is_ready(self) -> bool:
+        with closing(self._connect()) as db:
+            return 'watermark' in self._state(db)
+
+    def sync(self, conn: Connection, search_base: str) -> bool:
+        """
+        Brings the mirror up to date: a full load the first time, only changes afterwards.
+
+        Returns:
+            bool: True if the mirror is usable after the call.
+        """
+        if time.monotonic() - self._last_sync < self.sync_interval:
+            return True
+
+        conn.search('', '(objectClass=*)', search_scope=BASE, attributes=['highestCommittedUSN', 'dsServiceName'])
+        root_dse = conn.response[0]['raw_attributes']
+        # Read before searching so nothing written during the sync is skipped next time
+        highest_usn = int(root_dse['highestCommittedUSN'][0])
+        dsa = root_dse['dsServiceName'][0].decode('utf-8').lower()
+
+        db = self._connect()
+        try:
+            db.execute('BEGIN IMMEDIATE')  # one syncing worker at a time
+            state = self._state(db)
+            if state.get('dsa') == dsa and state.get('watermark') and int(state['watermark']) >= highest_usn:
+                db.execute('ROLLBACK')  # another worker already got here
+                self._last_sync = time.monotonic()
+                return True
+
+            full_load = (state.get('dsa') != dsa or state.get('search_base') != search_base.lower()
+                         or 'watermark' not in state)
+            if full_load:
+                logger.info(f"Directory mirror: full load of {search_base} from {dsa}")
+                db.execute('DELETE FROM objects')
+                db.execute('DELETE FROM memberships')
+                search_filter = '(|(objectClass=user)(objectClass=group))'
+                controls = [extended_dn_control()]
+            else:
+                search_filter = (f"(&(|(objectClass=user)(objectClass=group))"
+                                 f"(uSNChanged>={int(state['watermark']) + 1}))")
+                controls = [extended_dn_control(), show_deleted_control()]
+
+            changed = 0
+            entries = conn.extend.standard.paged_search(search_base, search_filter, attributes=_SYNC_ATTRIBUTES,
+                                                        controls=controls, paged_size=self.page_size,
+                                                        generator=True)
+            for entry in entries:
+                if entry.get('type') == 'searchResEntry':
+                    self._apply(db, conn, entry)
+                    changed += 1
+
+            db.executemany('INSERT OR REPLACE INTO sync_state (name, value) VALUES (?, ?)', [
+                ('dsa', dsa),
+                ('search_base', search_base.lower()),
+                ('watermark', str(highest_usn))
+            ])
+            db.execute('COMMIT')
+            self._last_sync = time.monotonic()
+            if changed:
+                logger.info(f"Directory mirror: applied {changed} changes up to USN {highest_usn}")
+            return True
+        except Exception as e:
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            logger.error(f"Directory mirror sync failed: {e}", exc_info=True)
+            return False
+        finally:
+            db.close()
+
+    def _apply(self, db: sqlite3.Connection, conn: Connection, entry: dict):
+        attributes = entry['attributes']
+        guid = _normalize_guid(_single(attributes.get('objectGUID')))
+
+        if _single(attributes.get('isDeleted')) in (True, 'TRUE'):
+            db.execute('DELETE FROM objects WHERE guid = ?', (guid,))
+            db.execute('DELETE FROM memberships WHERE group_guid = ?', (guid,))
+            return
+
+        dn = _split_extended_dn(entry['dn'])[1]
+        object_classes = [str(c).lower() for c in (attributes.get('objectClass') or [])]
+        kind = 'group' if 'group' in object_classes else 'user'
+
+        stored = {}
+        member_values = []
+        for attr, value in attributes.items():
+            if attr.lower() == 'member' or _RANGE_RE.match(attr):
+                member_values.extend(value if isinstance(value, list) else [value])
+            elif attr.lower() not in _COMPUTED_ATTRIBUTES and attr.lower() != 'isdeleted':
+                stored[attr] = _encode_value(value)
+
+        db.execute('INSERT OR REPLACE INTO objects (guid, kind, dn, dn_lower, usn, attributes) VALUES (?, ?, ?, ?, ?, ?)',
+                   (guid, kind, dn, dn.lower(), int(_single(attributes.get('uSNChanged')) or 0), json.dumps(stored)))
+
+        if kind == 'group':
+            member_values.extend(self._remaining_members(conn, entry['dn'], attributes))
+            db.execute('DELETE FROM memberships WHERE group_guid = ?', (guid,))
+            rows = []
+            for value in member_values:
+                member_guid, member_dn = _split_extended_dn(str(value))
+                rows.append((guid, member_guid, member_dn.lower()))
+            db.executemany('INSERT INTO memberships (group_guid, member_guid, member_dn_lower) VALUES (?, ?, ?)', rows)
+
+    @staticmethod
+    def _remaining_members(conn: Connection, group_dn: str, attributes: dict) -> list:
+        """
+        Follows range retrieval (member;range=0-1499 ...) for groups with more members than AD returns at once.
+        """
+        values = []
+        for attr in attributes.keys():
+            match = _RANGE_RE.match(attr)
+            if not match or match.group(2) == '*':
+                continue
+            values.extend(iter_ranged_values(conn, group_dn, 'member', start=int(match.group(2)) + 1,
+                                             controls=[extended_dn_control()]))
+        return values
+
+    def covers(self, attributes: list) -> bool:
+        return all(attr.lower() in MIRRORED_USER_ATTRIBUTES for attr in attributes)
+
+    def iter_users(self, attributes: list):
+        """
+        Yields mirrored users in the same format as all_users.iter_all_users.
+        """
+        wants_member_of = any(attr.lower() == 'memberof' for attr in attributes)
+        db = self._connect()
+        try:
+            rows = db.execute("SELECT guid, dn_lower, attributes FROM objects WHERE kind = 'user' ORDER BY dn_lower")
+            for guid, dn_lower, attributes_json in rows:
+                stored = CaseInsensitiveDict(json.loads(attributes_json, object_hook=_decode_value))
+                if wants_member_of:
+                    stored['memberOf'] = self._member_of(db, guid, dn_lower)
+                yield user_from_attributes(stored, attributes)
+        finally:
+            db.close()
+
+    @staticmethod
+    def _member_of(db: sqlite3.Connection, guid: str, dn_lower: str) -> list:
+        rows = db.execute(
+            "SELECT DISTINCT g.dn FROM memberships m JOIN objects g ON g.guid = m.group_guid "
+            "WHERE m.member_guid = ? OR (m.member_guid IS NULL AND m.member_dn_lower = ?) ORDER BY g.dn_lower",
+            (guid, dn_lower))
+        return [row[0] for row in rows]
+
+    def get_groups(self) -> list:
+        """
+        Returns the mirrored groups as a list of {'cn': ..., 'dn': ...}, like group_modify.list_all_groups.
+        """
+        groups = []
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT dn, attributes FROM objects WHERE kind = 'group' ORDER BY dn_lower")
+            for dn, attributes_json in rows:
+                cn = _single(CaseInsensitiveDict(json.loads(attributes_json)).get('cn'))
+                if cn:
+                    groups.append({'cn': str(cn), 'dn': dn})
+        return groups
+
+
+_mirrors = {}
+
+
+def get_mirror(search_base: str) -> DirectoryMirror | None:
+    """
+    Returns the mirror for a search base, or None when mirroring is disabled.
+    """
+    if not MIRROR_ENABLED:
+        return None
+    key = search_base.lower()
+    if key not in _mirrors:
+        file_name = re.sub(r'[^a-z0-9]+', '_', key).strip('_') or 'default'
+        _mirrors[key] = DirectoryMirror(os.path.join(MIRROR_DIR, f"mirror_{file_name}.sqlite3"), SYNC_INTERVAL)
+    return _mirrors[key]
+
+
+def mirrored_users(conn: Connection, search_base: str, attributes: list):
+    """
+    Returns an iterator over users read from the synced mirror, or None when the
+    mirror is disabled, cannot sync, or does not hold all requested attributes.
+    """
+    mirror = get_mirror(search_base)
+    if mirror is None or not mirror.covers(attributes) or not mirror.sync(conn, search_base):
+        return None
+    return mirror.iter_users(attributes)
+
+
+def mirrored_groups(conn: Connection, search_base: str) -> list | None:
+    """
+    Returns the groups from the synced mirror, or None when the mirror is disabled or cannot sync.
+    """
+    mirror = get_mirror(search_base)
+    if mirror is None or not mirror.sync(conn, search_base):
+        return None
+    return mirror.get_groups()
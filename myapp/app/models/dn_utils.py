@@ -0,0 +1,162 @@
+# myapp/app/models/dn_utils.py
+# Distinguished Name parsing and building (RFC 4514), shared by the routes and models.
+# Parsed DNs and extracted CNs are memoized, since the same group and container DNs
+# show up again and again in memberOf values and form submissions.
+import os
+import re
+from functools import lru_cache
+from ldap3.utils.dn import parse_dn as _ldap3_parse_dn, escape_rdn
+from ldap3.core.exceptions import LDAPInvalidDnError
+
+DN_CACHE_SIZE = int(os.environ.get('DN_CACHE_SIZE', 65536))
+
+_ESCAPED_CHAR = re.compile(r'\\([0-9A-Fa-f]{2}|.)')
+
+
+def unescape_value(value: str) -> str:
+    """
+    Turns an escaped RDN value (e.g. "Doe\\, John" or "A\\2C B") back into its plain text.
+    """
+    if '\\' not in value:
+        return value
+    # \XX pairs are UTF-8 bytes and may form a multi-byte character together
+    decoded = bytearray()
+    position = 0
+    for match in _ESCAPED_CHAR.finditer(value):
+        decoded += value[position:match.start()].encode('utf-8')
+        token = match.group(1)
+        decoded += bytes.fromhex(token) if len(token) == 2 else token.encode('utf-8')
+        position = match.end()
+    decoded += value[position:].encode('utf-8')
+    return decoded.decode('utf-8', errors='replace')
+
+
+@lru_cache(maxsize=DN_CACHE_SIZE)
+def parse_dn(dn: str) -> tuple:
+    """
+    Parses a DN into its RDNs.
+
+    Args:
+        dn (str): The distinguished name, e.g. "CN=Doe\\, John,OU=Sales,DC=example,DC=com".
+
+    Returns:
+        tuple: One tuple of (attribute type, unescaped value) pairs per RDN, from the leaf up,
+               e.g. ((('CN', 'Doe, John'),), (('OU', 'Sales'),), (('DC', 'example'),), (('DC', 'com'),)).
+
+    Raises:
+        ValueError: If the DN is not valid.
+    """
+    try:
+        components = _ldap3_parse_dn(dn, strip=True)
+    except LDAPInvalidDnError as e:
+        raise ValueError(f"Invalid distinguished name '{dn}': {e}") from e
+
+    rdns = []
+    current_rdn = []
+    for attribute_type, value, separator in components:
+        current_rdn.append((attribute_type, unescape_value(value)))
+        if separator != '+':  # '+' joins the AVAs of a multi-valued RDN
+            rdns.append(tuple(current_rdn))
+            current_rdn = []
+    return tuple(rdns)
+
+
+@lru_cache(maxsize=DN_CACHE_SIZE)
+def get_cn(dn: str) -> str | None:
+    """
+    Returns the (unescaped) CN of the leaf RDN, or None if the DN is invalid or its leaf is not a CN.
+    """
+    try:
+        rdns = parse_dn(dn)
+    except ValueError:
+        return None
+    if not rdns:
+        return None
+    attribute_type, value = rdns[0][0]
+    return value if attribute_type.lower() == 'cn' else None
+
+
+@lru_cache(maxsize=DN_CACHE_SIZE)
+def normalize_dn(dn: str) -> str:
+    """
+    Returns a canonical form of a DN for comparisons: lower case, no spaces around
+    separators and a single escaping style. Invalid DNs are just lower-cased.
+    """
+    try:
+        rdns = parse_dn(dn)
+    except ValueError:
+        return dn.strip().lower()
+    return build_dn(rdns).lower()
+
+
+def dn_equal(first_dn: str, second_dn: str) -> bool:
+    """
+    Compares two DNs the way Active Directory does (case-insensitively, ignoring escaping differences).
+    """
+    return normalize_dn(first_dn) == normalize_dn(second_dn)
+
+
+def build_dn(rdns, suffix: str = None) -> str:
+    """
+    Builds a DN string from RDNs, escaping the values.
+
+    Args:
+        rdns: An iterable of (attribute type, value) pairs, or of tuples of such pairs
+              for multi-valued RDNs, from the leaf up (the format returned by parse_dn).
+        suffix (str): An already formatted DN appended at the end (e.g. "DC=example,DC=com").
+
+    Returns:
+        str: The distinguished name.
+    """
+    parts = []
+    for rdn in rdns:
+        if rdn and isinstance(rdn[0], str):
+            rdn = (rdn,)
+        parts.append('+'.join(f"{attribute_type}={escape_rdn(value)}" for attribute_type, value in rdn))
+    if suffix:
+        parts.append(suffix)
+    return ','.join(parts)
+
+
+def dn_to_domain(dn: str) -> str | None:
+    """
+    Returns the DNS domain of a DN from its DC components ("CN=x,DC=example,DC=com" -> "example.com").
+    """
+    try:
+        rdns = parse_dn(dn)
+    except ValueError:
+        return None
+    domain_parts = [value for rdn in rdns for attribute_type, value in rdn if attribute_type.lower() == 'dc']
+    return '.'.join(domain_parts) if domain_parts else None
+
+
+def split_dn(dn: str) -> tuple[str | None, str | None, str | None]:
+    """
+    Splits a DN into the object's CN, its domain and the container path in the format
+    accepted by create_distinguished_name's organizational_unit argument (escaped components
+    joined with '/', parent first).
+    Example: From "CN=John Doe,OU=Sales,CN=Users,DC=example,DC=com"
+    Returns: ("John Doe", "example.com", "CN=Users/OU=Sales")
+    Or: ("John Doe", "example.com", "OU=Sales") if just "OU=Sales".
+    Returns (None, None, None) if the DN cannot be parsed.
+    """
+    if not dn:
+        return None, None, None
+    try:
+        rdns = parse_dn(dn)
+    except ValueError:
+        return None, None, None
+
+    object_cn = get_cn(dn)
+    domain_str = dn_to_domain(dn)
+
+    # Containers between the leaf and the first DC component, listed from parent to child
+    containers = []
+    for rdn in rdns[1:]:
+        attribute_type, value = rdn[0]
+        if attribute_type.lower() == 'dc':
+            break
+        containers.append(build_dn([(attribute_type.upper(), value)]))
+    ou_path = "/".join(reversed(containers)) if containers else None
+
+    return object_cn, domain_str, ou_path
@@ -1,7 +1,23 @@
 from connection_utils import create_distinguished_name
 from datetime import datetime
+from functools import lru_cache
 from ldap3 import MODIFY_REPLACE
-import openpyxl, csv
+from app.models.all_users import LOOKUP_BATCH_SIZE, fetch_users_by_dn
+from app.models.batch_files import iter_rows, iter_chunks
+from app.models.dn_utils import normalize_dn
+from app.models.write_pipeline import WritePipeline
+from app.models.batch_journal import open_journal
+
+
+@lru_cache(maxsize=4096)
+def expiration_timestamp(expiration_date: str) -> int:
+    """
+    Converts a 'DD-MM-YYYY' date to an accountExpires value (100 ns intervals since 1601-01-01).
+    Cached, since batch files usually repeat a handful of dates. Raises ValueError for invalid dates.
+    """
+    expiration_time = datetime.strptime(expiration_date, '%d-%m-%Y')
+    return int(expiration_time.timestamp() * 10000000 + 116444736000000000)
+
 
 def set_account_expiration(conn, canonical_name: str, domain: str, expiration_date: str, organizational_unit: str = "CN=Users") -> bool:
     """
@@ -19,93 +35,153 @@ def set_account_expiration(conn, canonical_name: str, domain: str, expiration_da
     """
     user_dn = create_distinguished_name(username=canonical_name, domain=domain, organizational_unit=organizational_unit)
 
-    expiration_time = datetime.strptime(expiration_date, '%d-%m-%Y')
-    
-    expiration_timestamp = int(expiration_time.timestamp() * 10000000 + 116444736000000000)
-
-    conn.modify(user_dn, {'accountExpires': [(MODIFY_REPLACE, [expiration_timestamp])]})
+    conn.modify(user_dn, {'accountExpires': [(MODIFY_REPLACE, [expiration_timestamp(expiration_date)])]})
     
     return conn.result['result'] == 0
 
 
-def expire_multiple_users(conn, file_path: str) -> int:
+def bulk_set_account_expiration(conn, rows, on_result=None, journal=None, batch_size: int = None) -> dict:
     """
-    Process a batch file (CSV or XLSX) and set the 'accountExpires' attribute for users listed in the file.
+    Sets 'accountExpires' for many users at once.
+
+    All dates are parsed first (each distinct date once), keeping only each user's DN and target
+    value, so invalid dates are known before anything is written. The target users are then
+    resolved in chunks of `batch_size` with one batched search per chunk (see fetch_users_by_dn).
+    Users whose accountExpires already holds the target value are skipped and the remaining
+    modifies are pipelined over one connection.
 
     Args:
-        conn (Connection): The connection object representing the connection to Active Directory.
-        file_path (str): The path to the CSV or XLSX file containing the user data. The file should contain
-                         user information including canonical name and the expiration date for each user.
-        
+        conn (Connection): An active LDAP connection.
+        rows (iterable): (user DN, expiration date 'DD-MM-YYYY') pairs. For a DN listed twice the last date wins.
+        on_result (callable): Called with each write result (see WritePipeline), optional.
+        journal (BatchJournal): Checkpoint journal keyed by DN, optional. Users it already holds are
+                                neither looked up nor written again; their recorded outcome is reported.
+        batch_size (int): Users per chunk (optional, LOOKUP_BATCH_SIZE by default).
+
     Returns:
-        int: The number of users successfully processed (i.e., whose 'accountExpires' attribute was set).
+        dict: "updated" and "unchanged" (DNs), "not_found" (DNs), "invalid_date" ((DN, date) pairs)
+              and "failed" ((DN, reason) pairs).
     """
-    processed_count = 0
+    summary = {"updated": [], "unchanged": [], "not_found": [], "invalid_date": [], "failed": []}
+
+    targets = {}
+    for user_dn, expiration_date in rows:
+        try:
+            targets[user_dn] = expiration_timestamp(expiration_date)
+        except ValueError:
+            summary["invalid_date"].append((user_dn, expiration_date))
+            targets.pop(user_dn, None)
+
+    if journal is not None:
+        for user_dn in list(targets):
+            done = journal.get(user_dn)
+            if done is not None:
+                category = done['category']
+                summary[category].append((user_dn, done['error']) if category == 'failed' else user_dn)
+                del targets[user_dn]
+
+    def record(result):
+        if journal is not None:
+            journal.record(result["tag"], result["ok"], result["error"],
+                           category='updated' if result["ok"] else 'failed', transient=result["transient"])
+        if on_result is not None:
+            on_result(result)
+
+    with WritePipeline(conn, on_result=record) as pipeline:
+        for chunk in iter_chunks(targets.items(), batch_size or LOOKUP_BATCH_SIZE):
+            found = fetch_users_by_dn(conn, (user_dn for user_dn, _ in chunk), ['accountExpires'], batch_size)
+            for user_dn, timestamp in chunk:
+                entry = found.get(normalize_dn(user_dn))
+                if entry is None:
+                    category = 'not_found'
+                else:
+                    current = entry[1].get('accountExpires') or []
+                    if not current or current[0] != str(timestamp).encode('ascii'):
+                        pipeline.modify(user_dn, {'accountExpires': [(MODIFY_REPLACE, [timestamp])]}, tag=user_dn)
+                        continue
+                    category = 'unchanged'
+                summary[category].append(user_dn)
+                if journal is not None:
+                    journal.record(user_dn, category == 'unchanged', None, category=category)
+
+    for result in pipeline.results:
+        if result["ok"]:
+            summary["updated"].append(result["tag"])
+        else:
+            summary["failed"].append((result["tag"], result["error"]))
+    return summary
+
+
+def iter_expiration_file(file_path: str):
+    """
+    Returns an iterator over the rows of a batch file (CSV or XLSX) with the columns Canonical Name,
+    Domain, Organizational Unit and Expiration Date ('DD-MM-YYYY'), after a header row, or of a
+    JSON Lines file with those fields. The file is read as the iterator advances (see batch_files).
 
-    file_extension = file_path.split('.')[-1].lower()
+    Returns:
+        iterator: (row number, user DN, expiration date) triples, in file order; DN and date are None
+        for an incomplete row. Raises ValueError for unsupported file types (right away).
+    """
+    return _expiration_rows(iter_rows(file_path, schema='expire_users'))
 
-    if file_extension == 'csv':
-        processed_count = csv_expiring(conn,file_path=file_path)
 
-    elif file_extension == 'xlsx':
-        processed_count = excel_expiring(conn,file_path=file_path)
-        
-    return processed_count
+def _expiration_rows(records):
+    for row_number, record in records:
+        if len(record) < 4 or any(value is None for value in record[:4]):
+            yield row_number, None, None  # incomplete row
+            continue
+        if isinstance(record[3], datetime):
+            record[3] = record[3].strftime('%d-%m-%Y')  # a date cell in Excel
+        canonical_name, domain, organizational_unit, expiration_date = (str(value).strip() for value in record[:4])
+        user_dn = create_distinguished_name(username=canonical_name, domain=domain, organizational_unit=organizational_unit)
+        yield row_number, user_dn, expiration_date
 
 
-def csv_expiring(conn, file_path: str) -> int:
+def expiration_pairs(rows):
     """
-    Processes a CSV file to set the 'accountExpires' attribute for users listed in the file.
+    Returns the (user DN, expiration date) pairs of the complete rows of iter_expiration_file,
+    the input of bulk_set_account_expiration.
+    """
+    return ((user_dn, expiration_date) for _, user_dn, expiration_date in rows if user_dn is not None)
 
-    Args:
-        file_path (str): The path to the CSV file containing the user data. The file should include the following columns:
-                         - Canonical Name
-                         - Domain
-                         - Organizational Unit
-                         - Expiration Date (in format 'DD-MM-YYYY')
+
+def read_expiration_file(file_path: str) -> list:
+    """
+    Reads the rows of an expiration batch file (see iter_expiration_file).
 
     Returns:
-        int: The number of users successfully processed (i.e., whose 'accountExpires' attribute was set).
+        list: (row number, user DN, expiration date) triples. Raises ValueError for unsupported file types.
     """
-    processed_count = 0
-    with open(file_path, mode='r', newline='', encoding='utf-8') as file:
-        reader = csv.reader(file)
-        next(reader)
-        for row in reader:
-            if row:
-                canonical_name = row[0].strip()
-                domain = row[1].strip()
-                organizational_unit = row[2].strip()
-                expiration_date = row[3].strip()
-                if set_account_expiration(conn=conn, canonical_name=canonical_name, domain=domain,expiration_date=expiration_date, organizational_unit=organizational_unit):
-                    processed_count += 1
+    return list(iter_expiration_file(file_path))
 
-    return processed_count
 
-def excel_expiring(conn, file_path: str)-> int:
+def expire_users_from_file(conn, file_path: str) -> dict:
     """
-    Processes an Excel (XLSX) file to change the block status of users listed in the file.
-
-    Args:
-        file_path (str): The path to the Excel file containing the user data.
+    Process a batch file (CSV, XLSX or JSON Lines) and set the 'accountExpires' attribute for users listed in the file.
 
     Returns:
-        int: The number of users successfully processed.
+        dict: The summary of bulk_set_account_expiration.
     """
-    processed_count = 0
-    wb = openpyxl.load_workbook(file_path)
-    sheet = wb.active
-    for row in sheet.iter_rows(min_row=2):
-        canonical_name = row[0].value.strip()
-        domain = row[1].value.strip()
-        organizational_unit = row[2].value.strip()
-        expiration_date=row[3].value.strip()
-        if set_account_expiration(conn=conn, canonical_name=canonical_name, domain=domain,expiration_date=expiration_date, organizational_unit=organizational_unit):
-            processed_count += 1
+    rows = expiration_pairs(iter_expiration_file(file_path))
+    with open_journal('expire_users', file_path, conn) as journal:
+        return bulk_set_account_expiration(conn, rows, journal=journal)
 
-    return processed_count
 
-def get_expiring_users_count(conn, search_base: str) -> int:
-    conn.search(search_base, '(&(objectClass=user)(accountExpires>=1))')
-    return len(conn.entries)
+def expire_multiple_users(conn, file_path: str) -> int:
+    """
+    Process a batch file (CSV, XLSX or JSON Lines) and set the 'accountExpires' attribute for users listed in the file.
 
+    Args:
+        conn (Connection): The connection object representing the connection to Active Directory.
+        file_path (str): The path to the CSV, XLSX or JSON Lines file containing the user data. The file should contain
+                         user information including canonical name and the expiration date for each user.
+        
+    Returns:
+        int: The number of users whose 'accountExpires' attribute holds the requested date afterwards.
+    """
+    try:
+        summary = expire_users_from_file(conn, file_path)
+    except ValueError as e:
+        print(e)
+        return 0
+    return len(summary["updated"]) + len(summary["unchanged"])
@@ -0,0 +1,137 @@
+# myapp/app/models/group_catalog.py
+from ldap3 import Connection
+from ldap3.protocol.microsoft import show_deleted_control
+import logging
+import os
+import time
+from threading import Lock
+
+from app.models.all_users import DEFAULT_PAGE_SIZE
+from app.models.dn_utils import normalize_dn
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+
+class GroupCatalog:
+    """
+    Per-process cache of all groups under a search base, with CN -> DN and DN -> CN indexes
+    and the group nesting graph.
+
+    A cached group list is trusted for `ttl` seconds. After that one probe asks the DC for
+    any group (live or deleted) with a uSNChanged above the highest one seen; only if there
+    is one is the full group list downloaded again. Groups added or removed through this
+    app invalidate the catalog straight away.
+    """
+
+    def __init__(self, ttl: float = 60.0, page_size: int = None):
+        """
+        Args:
+            ttl (float): Seconds a group list is used without checking the DC for changes.
+            page_size (int): Number of entries requested per page when loading the groups.
+        """
+        self.ttl = ttl
+        self.page_size = page_size or DEFAULT_PAGE_SIZE
+        self._lock = Lock()
+        self._entries = {}  # (server, search_base) -> dict(groups, by_cn, by_dn, parents, ancestors, usn, checked_at)
+
+    @staticmethod
+    def _make_key(conn: Connection, search_base: str) -> tuple:
+        # uSNChanged values are local to a DC, so entries are kept per server
+        return str(conn.server.name).lower(), normalize_dn(search_base)
+
+    def _load(self, conn: Connection, search_base: str) -> dict:
+        groups = []
+        parents = {}
+        highest_usn = 0
+        entries = conn.extend.standard.paged_search(search_base, '(objectClass=group)',
+                                                    attributes=['cn', 'distinguishedName', 'uSNChanged', 'memberOf'],
+                                                    paged_size=self.page_size, generator=True)
+        for entry in entries:
+            if entry.get('type') != 'searchResEntry':
+                continue
+            raw = entry['raw_attributes']
+            cn_values = raw.get('cn') or []
+            dn_values = raw.get('distinguishedName') or [entry['dn'].encode('utf-8')]
+            if not cn_values or not dn_values:
+                continue
+            group = {'cn': cn_values[0].decode('utf-8'), 'dn': dn_values[0].decode('utf-8')}
+            groups.append(group)
+            # Nesting edges for the group graph: this group -> the groups it is a direct member of
+            parents[normalize_dn(group['dn'])] = tuple(normalize_dn(value.decode('utf-8'))
+                                                       for value in raw.get('memberOf') or [])
+            usn_values = raw.get('uSNChanged')
+            if usn_values:
+                highest_usn = max(highest_usn, int(usn_values[0]))
+
+        return {
+            'groups': groups,
+            'by_cn': {group['cn']: group['dn'] for group in groups},
+            'by_dn': {normalize_dn(group['dn']): group for group in groups},
+            'parents': parents,
+            'ancestors': {},  # memoized transitive closures, see group_graph
+            'usn': highest_usn,
+            'checked_at': time.monotonic()
+        }
+
+    def _changed_since(self, conn: Connection, search_base: str, usn: int) -> bool:
+        """
+        Returns True if a group was created, modified, renamed or deleted after `usn`.
+        Deleted groups are tombstones in CN=Deleted Objects, visible with the show deleted control.
+        """
+        try:
+            conn.search(search_base, f'(&(objectClass=group)(uSNChanged>={usn + 1}))', attributes=['uSNChanged'],
+                        size_limit=1, controls=[show_deleted_control()])
+            return bool(conn.response) and any(entry.get('type') == 'searchResEntry' for entry in conn.response)
+        except Exception as e:
+            # sizeLimitExceeded (more than one group changed) ends up here too; reloading is always safe
+            logger.info(f"Group catalog change check for {search_base} returned {e}, reloading")
+            return True
+
+    def get(self, conn: Connection, search_base: str) -> dict:
+        """
+        Returns the catalog entry for the search base, loading or refreshing it if needed.
+
+        Returns:
+            dict: groups (list of {'cn': ..., 'dn': ...}), by_cn (CN -> DN), by_dn (normalized DN -> group)
+                  and parents (normalized DN -> normalized DNs of the groups it directly belongs to).
+        """
+        key = self._make_key(conn, search_base)
+        with self._lock:
+            entry = self._entries.get(key)
+
+        now = time.monotonic()
+        if entry is not None and now - entry['checked_at'] < self.ttl:
+            return entry
+
+        if entry is not None and not self._changed_since(conn, search_base, entry['usn']):
+            entry['checked_at'] = now
+            return entry
+
+        entry = self._load(conn, search_base)
+        logger.info(f"Group catalog for {search_base} loaded: {len(entry['groups'])} groups, USN {entry['usn']}")
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def groups(self, conn: Connection, search_base: str) -> list:
+        return list(self.get(conn, search_base)['groups'])
+
+    def dn_for_cn(self, conn: Connection, search_base: str, group_cn: str) -> str | None:
+        return self.get(conn, search_base)['by_cn'].get(group_cn)
+
+    def cn_for_dn(self, conn: Connection, search_base: str, group_dn: str) -> str | None:
+        group = self.get(conn, search_base)['by_dn'].get(normalize_dn(group_dn))
+        return group['cn'] if group else None
+
+    def invalidate(self):
+        """
+        Drops every cached group list of this process (e.g. after adding or removing a group).
+        """
+        with self._lock:
+            self._entries = {}
+
+
+group_catalog = GroupCatalog(
+    ttl=float(os.environ.get('GROUP_CATALOG_TTL', 60))
+)
@@ -0,0 +1,119 @@
+# myapp/app/models/group_graph.py
+# Transitive (nested) group membership. Effective groups are resolved in-process from the
+# group nesting graph kept by the group catalog; effective members use AD's
+# LDAP_MATCHING_RULE_IN_CHAIN, so the DC walks the nesting in a single search.
+from ldap3 import Connection, BASE
+from ldap3.utils.conv import escape_filter_chars
+import logging
+
+from app.models.all_users import DEFAULT_PAGE_SIZE
+from app.models.dn_utils import normalize_dn
+from app.models.group_catalog import group_catalog
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+LDAP_MATCHING_RULE_IN_CHAIN = '1.2.840.113556.1.4.1941'
+
+
+def _ancestors(entry: dict, group_key: str) -> frozenset:
+    """
+    Returns the normalized DNs of every group `group_key` is nested in, directly or not.
+    Results are memoized in the catalog entry, so they live until the group list changes.
+    Nesting cycles (allowed by AD) are handled.
+    """
+    memo = entry['ancestors']
+    if group_key in memo:
+        return memo[group_key]
+
+    parents = entry['parents']
+    found = set()
+    stack = list(parents.get(group_key, ()))
+    while stack:
+        parent = stack.pop()
+        if parent in found:
+            continue
+        found.add(parent)
+        known = memo.get(parent)
+        if known is not None:
+            found.update(known)
+        else:
+            stack.extend(parents.get(parent, ()))
+
+    result = frozenset(found)
+    memo[group_key] = result
+    return result
+
+
+def _direct_groups(conn: Connection, entry: dict, dn: str) -> tuple:
+    key = normalize_dn(dn)
+    if key in entry['parents']:
+        return entry['parents'][key]  # a group: its memberOf is already in the graph
+    conn.search(dn, '(objectClass=*)', search_scope=BASE, attributes=['memberOf'])
+    if not conn.response or conn.response[0].get('type') != 'searchResEntry':
+        return ()
+    values = conn.response[0]['raw_attributes'].get('memberOf') or []
+    return tuple(normalize_dn(value.decode('utf-8')) for value in values)
+
+
+def get_effective_groups(conn: Connection, search_base: str, dn: str) -> list:
+    """
+    Returns all groups a user (or group) belongs to, directly or through nested groups.
+    Costs at most one BASE read per call once the group catalog is loaded (none for groups).
+
+    Args:
+        conn (Connection): An active LDAP connection.
+        search_base (str): The base under which groups are catalogued (e.g. "DC=example,DC=com").
+        dn (str): Distinguished name of the user or group.
+
+    Returns:
+        list: {'cn': ..., 'dn': ..., 'direct': bool} dicts sorted by CN. Groups outside the
+              search base are not included.
+    """
+    entry = group_catalog.get(conn, search_base)
+    direct = _direct_groups(conn, entry, dn)
+
+    effective = set(direct)
+    for group_key in direct:
+        effective.update(_ancestors(entry, group_key))
+    effective.discard(normalize_dn(dn))  # a group nested in itself through a cycle
+
+    direct_keys = set(direct)
+    groups = [dict(entry['by_dn'][key], direct=key in direct_keys) for key in effective if key in entry['by_dn']]
+    return sorted(groups, key=lambda group: group['cn'].lower())
+
+
+def iter_effective_members(conn: Connection, search_base: str, group_dn: str, page_size: int = None):
+    """
+    Lazily yields the DNs of all members of a group, including members of nested groups
+    (and the nested groups themselves), with one paged LDAP_MATCHING_RULE_IN_CHAIN search.
+
+    Args:
+        conn (Connection): An active LDAP connection.
+        search_base (str): The base from which to perform the search.
+        group_dn (str): Distinguished name of the group.
+        page_size (int): Number of entries requested per page (optional).
+
+    Yields:
+        str: Member distinguished names.
+    """
+    search_filter = f'(memberOf:{LDAP_MATCHING_RULE_IN_CHAIN}:={escape_filter_chars(group_dn)})'
+    entries = conn.extend.standard.paged_search(search_base, search_filter, attributes=['1.1'],
+                                                paged_size=page_size or DEFAULT_PAGE_SIZE, generator=True)
+    for entry in entries:
+        if entry.get('type') == 'searchResEntry':
+            yield entry['dn']
+
+
+def get_nested_groups(conn: Connection, search_base: str, group_dn: str) -> list:
+    """
+    Returns the groups nested in a group at any depth, answered from the in-process group graph.
+
+    Returns:
+        list: {'cn': ..., 'dn': ...} dicts sorted by CN.
+    """
+    entry = group_catalog.get(conn, search_base)
+    target = normalize_dn(group_dn)
+    nested = [entry['by_dn'][key] for key in entry['parents']
+              if key != target and target in _ancestors(entry, key)]
+    return sorted(nested, key=lambda group: group['cn'].lower())
@@ -1,60 +1,54 @@
 # myapp/app/models/group_modify.py
-from ldap3 import MODIFY_ADD, MODIFY_DELETE, MODIFY_REPLACE
-import openpyxl, csv, json
+from ldap3 import MODIFY_ADD, MODIFY_DELETE, MODIFY_REPLACE, NO_ATTRIBUTES
+import json
 import re
 import uuid
 import logging
+import os
 
 # Corrected import: Assuming connection_utils.py is in the same directory (models)
 # and 'models' directory is in sys.path due to routes.py modification.
 # Changed from relative import to direct import.
 from connection_utils import create_distinguished_name, domain_to_dn
+from app.models.group_catalog import group_catalog
+from app.models.all_users import fetch_entries_by_dn
+from app.models.range_retrieval import iter_ranged_values
+from app.models.dn_utils import normalize_dn, dn_to_domain
+from app.models.write_pipeline import WritePipeline
+from app.models.batch_files import iter_rows
+from app.models.ldap_retry import call_with_retry
 
 # Get a logger for this module
 logger = logging.getLogger(__name__)
 
+# Members added or removed per modify by apply_group_membership_changes. AD has no fixed cap on
+# values per modify, but the request must stay under the DC's MaxReceiveBuffer (10 MB by default).
+GROUP_MODIFY_CHUNK_SIZE = int(os.environ.get('GROUP_MODIFY_CHUNK_SIZE', 1000))
+
 
 # Function to list all groups, returns dicts with 'cn' and 'dn'
 def list_all_groups(conn, domain: str) -> list:
     """
     Retrieves a list of all groups in the specified domain,
     including their common name (cn) and distinguished name (dn).
+    The list comes from the group catalog, which only searches the DC again when groups changed.
     Args:
         conn: LDAP connection object.
         domain (str): The LDAP domain to search in (e.g., "testad.local").
     Returns:
         list: A list of dictionaries, where each dict has 'cn' and 'dn' for a group.
     """
-    groups_data = []
     # domain_to_dn is now imported from connection_utils
     search_base = domain_to_dn(domain)
+    return group_catalog.groups(conn, search_base)
 
-    conn.search(search_base, '(objectClass=group)', attributes=['cn', 'distinguishedName'])
-
-    for entry in conn.entries:
-        cn_val = None
-        dn_val = None
-
-        if hasattr(entry, 'cn') and entry.cn:
-            # Handle ldap3.abstract.value.Values object or list of values
-            if hasattr(entry.cn, 'value'):
-                cn_val_raw = entry.cn.value
-                cn_val = str(cn_val_raw[0]) if isinstance(cn_val_raw, list) and cn_val_raw else str(cn_val_raw)
-            elif isinstance(entry.cn, list):
-                cn_val = str(entry.cn[0]) if entry.cn else None
-            else:
-                cn_val = str(entry.cn)
-
-        if hasattr(entry, 'distinguishedName') and entry.distinguishedName:
-            dn_val = str(entry.distinguishedName.value) if hasattr(entry.distinguishedName, 'value') else str(
-                entry.distinguishedName)
 
-        if cn_val and dn_val:
-            groups_data.append({
-                'cn': cn_val,
-                'dn': dn_val
-            })
-    return groups_data
+def group_cn_to_dn_map(conn, domain: str) -> dict:
+    """
+    Returns a mapping from group CN to group DN for all groups in the domain.
+    The mapping is the group catalog's index itself and must not be modified.
+    """
+    return group_catalog.get(conn, domain_to_dn(domain))['by_cn']
 
 
 def add_user_to_group(conn, username: str, users_domain: str, users_ou: str, group: str, group_domain: str,
@@ -79,126 +73,156 @@ def remove_user_from_group(conn, username: str, users_domain: str, users_ou: str
     return conn.extend.microsoft.remove_members_from_groups(user_dn, group_dn)
 
 
-def csv_adding_to_groups(conn, file_path: str) -> int:
-    processed_count = 0
+def _membership_file_rows(file_path: str):
+    """
+    Reads a group membership batch file (CSV or XLSX) with the columns user CN, user domain, user OU,
+    group CN, group domain and group OU, after a header row, or a JSON Lines file with the fields of
+    JSONL_SCHEMAS['group_membership']. The file is read as the returned iterator advances (see batch_files).
+
+    Returns:
+        iterator: (user DN, group DN) pairs, in file order (none for other file types).
+    """
     try:
-        with open(file_path, mode='r', newline='', encoding='utf-8-sig') as file:
-            reader = csv.reader(file)
-            next(reader)  # Skip header
-            for row in reader:
-                if row and len(row) >= 6:
-                    users_canonical_name = row[0].strip()
-                    users_domain = row[1].strip()
-                    users_ou = row[2].strip()
-                    group_canonical_name = row[3].strip()
-                    group_domain = row[4].strip()
-                    group_ou = row[5].strip()
-                    if add_user_to_group(conn, username=users_canonical_name, users_domain=users_domain,
-                                         users_ou=users_ou, group=group_canonical_name, group_domain=group_domain,
-                                         group_ou=group_ou):
-                        processed_count += 1
-    except Exception as e:
-        logger.error(f"Error processing CSV for adding to groups ({file_path}): {e}", exc_info=True)
-    return processed_count
+        records = iter_rows(file_path, schema='group_membership')
+    except ValueError:
+        return iter(())
+    return _membership_pairs(records)
+
+
+def _membership_pairs(records):
+    for _, record in records:
+        if len(record) < 6:
+            continue
+        users_canonical_name, users_domain, users_ou, group_canonical_name, group_domain, group_ou = (
+            str(value).strip() if value is not None else '' for value in record[:6])
+        if not all([users_canonical_name, users_domain, group_canonical_name, group_domain]):
+            continue
+        user_dn = create_distinguished_name(users_canonical_name, users_domain, users_ou)
+        group_dn = create_distinguished_name(group_canonical_name, group_domain, group_ou, is_group=True)
+        yield user_dn, group_dn
+
+
+def apply_group_membership_changes(conn, rows, remove: bool = False, chunk_size: int = None) -> dict:
+    """
+    Adds (or removes) many users to (from) groups with one multi-valued modify per group and chunk,
+    instead of one check and modify per (user, group) pair.
 
+    Rows are grouped by target group. For each group its current member list is read once (with
+    range retrieval) and members already present (or already absent, when removing) are dropped
+    without a write. The rest is sent as MODIFY_ADD / MODIFY_DELETE of up to `chunk_size` values,
+    pipelined over one connection. AD applies a modify atomically, so when a chunk is rejected
+    (e.g. one member does not exist) its members are retried one by one to find the failing ones.
+    Groups missing from the group catalog are looked up in the directory before they are reported
+    as not found, since the catalog of this process may predate a group created elsewhere.
 
-def csv_removing_from_groups(conn, file_path: str) -> int:
-    processed_count = 0
+    Args:
+        conn: LDAP connection object.
+        rows (iterable): (user DN, group DN) pairs.
+        remove (bool): Remove the users from the groups instead of adding them.
+        chunk_size (int): Values per modify (optional, GROUP_MODIFY_CHUNK_SIZE by default).
+
+    Returns:
+        dict: "changed" and "skipped" ((user DN, group DN) pairs), "group_not_found" (group DNs)
+              and "failed" ((user DN, group DN, reason) triples).
+    """
+    chunk_size = max(1, chunk_size or GROUP_MODIFY_CHUNK_SIZE)
+    summary = {"changed": [], "skipped": [], "group_not_found": [], "failed": []}
+
+    by_group = {}
+    for user_dn, group_dn in rows:
+        group = by_group.setdefault(normalize_dn(group_dn), {"dn": group_dn, "members": {}})
+        group["members"].setdefault(normalize_dn(user_dn), user_dn)
+
+    uncatalogued = []
+    for group_key, group in by_group.items():
+        domain = dn_to_domain(group["dn"])
+        if not domain or group_key not in group_catalog.get(conn, domain_to_dn(domain))['by_dn']:
+            uncatalogued.append(group["dn"])
+    missing = set()
+    if uncatalogued:
+        found = fetch_entries_by_dn(conn, uncatalogued, [NO_ATTRIBUTES], '(objectClass=group)')
+        missing = {normalize_dn(group_dn) for group_dn in uncatalogued} - set(found)
+        if found:
+            group_catalog.invalidate()  # out of date: these groups were created since it was loaded
+
+    operation = MODIFY_DELETE if remove else MODIFY_ADD
+    chunks = {}
+    with WritePipeline(conn) as pipeline:
+        for group_key, group in by_group.items():
+            if group_key in missing:
+                summary["group_not_found"].append(group["dn"])
+                continue
+
+            current = {normalize_dn(member) for member in iter_group_members(conn, group["dn"])}
+            pending = []
+            for member_key, user_dn in group["members"].items():
+                if (member_key in current) != remove:
+                    summary["skipped"].append((user_dn, group["dn"]))
+                else:
+                    pending.append(user_dn)
+
+            for start in range(0, len(pending), chunk_size):
+                chunk = pending[start:start + chunk_size]
+                tag = len(chunks)
+                chunks[tag] = (group["dn"], chunk)
+                pipeline.modify(group["dn"], {'member': [(operation, chunk)]}, tag=tag)
+
+    for result in pipeline.results:
+        group_dn, chunk = chunks[result["tag"]]
+        if result["ok"]:
+            summary["changed"].extend((user_dn, group_dn) for user_dn in chunk)
+            continue
+        logger.warning(f"Membership modify of {len(chunk)} members on {group_dn} failed ({result['error']}), "
+                       f"retrying members one by one")
+        for user_dn in chunk:
+            try:
+                ok = call_with_retry(conn, 'modify', group_dn, {'member': [(operation, [user_dn])]})
+                reason = None if ok else conn.result.get('description')
+            except Exception as e:
+                ok, reason = False, str(e)
+            if ok:
+                summary["changed"].append((user_dn, group_dn))
+            else:
+                summary["failed"].append((user_dn, group_dn, reason))
+    return summary
+
+
+def _apply_membership_file(conn, file_path: str, remove: bool) -> int:
     try:
-        with open(file_path, mode='r', newline='', encoding='utf-8-sig') as file:
-            reader = csv.reader(file)
-            next(reader)  # Skip header
-            for row in reader:
-                if row and len(row) >= 6:
-                    users_canonical_name = row[0].strip()
-                    users_domain = row[1].strip()
-                    users_ou = row[2].strip()
-                    group_canonical_name = row[3].strip()
-                    group_domain = row[4].strip()
-                    group_ou = row[5].strip()
-                    if remove_user_from_group(conn, username=users_canonical_name, users_domain=users_domain,
-                                              users_ou=users_ou, group=group_canonical_name, group_domain=group_domain,
-                                              group_ou=group_ou):
-                        processed_count += 1
+        summary = apply_group_membership_changes(conn, _membership_file_rows(file_path), remove=remove)
     except Exception as e:
-        logger.error(f"Error processing CSV for removing from groups ({file_path}): {e}", exc_info=True)
-    return processed_count
+        logger.error(f"Error processing group membership file ({file_path}): {e}", exc_info=True)
+        return 0
+    for group_dn in summary["group_not_found"]:
+        logger.warning(f"Group not found: {group_dn}")
+    for user_dn, group_dn, reason in summary["failed"]:
+        logger.error(f"Membership change of {user_dn} in {group_dn} failed: {reason}")
+    return len(summary["changed"]) + len(summary["skipped"])
+
+
+def csv_adding_to_groups(conn, file_path: str) -> int:
+    return _apply_membership_file(conn, file_path, remove=False)
+
+
+def csv_removing_from_groups(conn, file_path: str) -> int:
+    return _apply_membership_file(conn, file_path, remove=True)
 
 
 def excel_adding_to_groups(conn, file_path: str) -> int:
-    processed_count = 0
-    try:
-        wb = openpyxl.load_workbook(file_path)
-        sheet = wb.active
-        header_skipped = False
-        for row in sheet.iter_rows(min_row=1):
-            if not header_skipped:
-                header_skipped = True
-                continue
-            row_values = [cell.value for cell in row]
-            if row_values and len(row_values) >= 6 and any(row_values):
-                users_canonical_name = str(row_values[0]).strip() if row_values[0] is not None else ''
-                users_domain = str(row_values[1]).strip() if row_values[1] is not None else ''
-                users_ou = str(row_values[2]).strip() if row_values[2] is not None else ''
-                group_canonical_name = str(row_values[3]).strip() if row_values[3] is not None else ''
-                group_domain = str(row_values[4]).strip() if row_values[4] is not None else ''
-                group_ou = str(row_values[5]).strip() if row_values[5] is not None else ''
-                if all([users_canonical_name, users_domain, group_canonical_name, group_domain]):
-                    if add_user_to_group(conn, username=users_canonical_name, users_domain=users_domain,
-                                         users_ou=users_ou, group=group_canonical_name, group_domain=group_domain,
-                                         group_ou=group_ou):
-                        processed_count += 1
-    except Exception as e:
-        logger.error(f"Error processing Excel for adding to groups ({file_path}): {e}", exc_info=True)
-    return processed_count
+    return _apply_membership_file(conn, file_path, remove=False)
 
 
 def excel_removing_from_groups(conn, file_path: str) -> int:
-    processed_count = 0
-    try:
-        wb = openpyxl.load_workbook(file_path)
-        sheet = wb.active
-        header_skipped = False
-        for row in sheet.iter_rows(min_row=1):
-            if not header_skipped:
-                header_skipped = True
-                continue
-            row_values = [cell.value for cell in row]
-            if row_values and len(row_values) >= 6 and any(row_values):
-                users_canonical_name = str(row_values[0]).strip() if row_values[0] is not None else ''
-                users_domain = str(row_values[1]).strip() if row_values[1] is not None else ''
-                users_ou = str(row_values[2]).strip() if row_values[2] is not None else ''
-                group_canonical_name = str(row_values[3]).strip() if row_values[3] is not None else ''
-                group_domain = str(row_values[4]).strip() if row_values[4] is not None else ''
-                group_ou = str(row_values[5]).strip() if row_values[5] is not None else ''
-                if all([users_canonical_name, users_domain, group_canonical_name, group_domain]):
-                    if remove_user_from_group(conn, username=users_canonical_name, users_domain=users_domain,
-                                              users_ou=users_ou, group=group_canonical_name, group_domain=group_domain,
-                                              group_ou=group_ou):
-                        processed_count += 1
-    except Exception as e:
-        logger.error(f"Error processing Excel for removing from groups ({file_path}): {e}", exc_info=True)
-    return processed_count
+    return _apply_membership_file(conn, file_path, remove=True)
 
 
 def batch_group_adding(conn, file_path: str) -> int:
-    processed_count = 0
-    file_extension = file_path.split('.')[-1].lower()
-    if file_extension == 'csv':
-        processed_count = csv_adding_to_groups(conn, file_path=file_path)
-    elif file_extension == 'xlsx':
-        processed_count = excel_adding_to_groups(conn, file_path=file_path)
-    return processed_count
+    # CSV, XLSX and JSON Lines files alike (unsupported files process no rows)
+    return _apply_membership_file(conn, file_path, remove=False)
 
 
 def batch_group_removing(conn, file_path: str) -> int:
-    processed_count = 0
-    file_extension = file_path.split('.')[-1].lower()
-    if file_extension == 'csv':
-        processed_count = csv_removing_from_groups(conn, file_path=file_path)
-    elif file_extension == 'xlsx':
-        processed_count = excel_removing_from_groups(conn, file_path=file_path)
-    return processed_count
+    return _apply_membership_file(conn, file_path, remove=True)
 
 
 def load_json_config(file_path: str) -> dict:
@@ -222,7 +246,10 @@ def remove_group(conn, group_cn: str, domain: str, group_container_ou: str) -> b
         group_dn = create_distinguished_name(username=group_cn, domain=domain, organizational_unit=group_container_ou,
                                              is_group=True)
         logger.info(f"Attempting to delete group with DN: {group_dn}")
-        return conn.delete(group_dn)
+        success = conn.delete(group_dn)
+        if success:
+            group_catalog.invalidate()
+        return success
     except Exception as e:
         logger.error(f"Exception in remove_group for {group_cn} in {group_container_ou}: {e}", exc_info=True)
         if hasattr(conn, 'result'):  # Check if result attribute exists before setting
@@ -287,6 +314,8 @@ def add_new_group(conn, config: dict) -> bool:
         if not success:
             logger.error(
                 f"LDAP add failed for group {group_name_cn}. DN: {group_dn}. Result: {conn.result if hasattr(conn, 'result') else 'N/A'}")
+        else:
+            group_catalog.invalidate()
         return success
 
     except Exception as e:
@@ -327,6 +356,20 @@ def process_config_file(conn, file_path: str) -> bool:
     # Removed the final 'return True' as it should depend on the action's success
 
 
+def iter_group_members(conn, group_dn: str):
+    """
+    Lazily yields the distinguished names (DNs) of the direct members of a group.
+    Follows AD's range retrieval (member;range=0-1499, 1500-2999, ...), so very large groups
+    such as "Domain Users" are complete and only one range is held in memory at a time.
+    Args:
+        conn: LDAP connection object.
+        group_dn (str): The distinguished name (DN) of the group.
+    Yields:
+        str: Member DNs.
+    """
+    yield from iter_ranged_values(conn, group_dn, 'member', search_filter='(objectClass=group)')
+
+
 def list_group_members(conn, domain: str, group_dn: str) -> list:
     """
     Retrieves the distinguished names (DNs) of members of a specific group in a given LDAP domain.
@@ -338,16 +381,7 @@ def list_group_members(conn, domain: str, group_dn: str) -> list:
         list: A list of member DNs in the specified group, or an empty list.
     """
     try:
-        # Read the entry directly using the group's DN as the search base and a base scope search
-        if conn.search(group_dn, '(objectClass=group)', search_scope='BASE',
-                       attributes=['member']):  # search_scope='BASE'
-            if conn.entries:
-                entry = conn.entries[0]
-                # entry.member might be a ValuesView object, so access its .values attribute
-                if hasattr(entry, 'member') and entry.member and hasattr(entry.member,
-                                                                         'values') and entry.member.values:
-                    return [str(member_val) for member_val in entry.member.values]
-        return []
+        return list(iter_group_members(conn, group_dn))
     except Exception as e:
         logger.error(f"Error listing members of group {group_dn}: {e}", exc_info=True)
         return []
@@ -0,0 +1,400 @@
+# myapp/app/models/jobs.py
+# Background jobs for batch files. The web workers only store the uploaded file and a job
+# record; a separate worker process (worker.py) claims queued jobs from the SQLite job store,
+# runs them over its own LDAP connection and records progress and per-row results.
+from cryptography.fernet import Fernet
+from contextlib import closing
+from threading import Lock
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+
+from app.models import connection as co
+from app.models.batch_add import import_users_from_file
+from app.models.batch_delete_users import iter_deletion_file, delete_users
+from app.models.block import iter_block_file, bulk_change_block_status
+from app.models.expire import iter_expiration_file, expiration_pairs, bulk_set_account_expiration
+from app.models.batch_journal import open_journal
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+JOBS_ENABLED = os.environ.get('JOBS_ENABLED', '').lower() in ('1', 'true', 'yes')
+JOBS_DIR = os.environ.get('JOBS_DIR', os.path.join("app", "data", "jobs"))
+JOBS_POLL_INTERVAL = float(os.environ.get('JOBS_POLL_INTERVAL', 1))
+# Runs of a job before it is given up (a job interrupted by a worker shutdown resumes from its journal)
+JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', 3))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    status TEXT NOT NULL,
+    file_name TEXT,
+    file_path TEXT,
+    params TEXT NOT NULL,
+    credentials TEXT,
+    total INTEGER,
+    processed INTEGER NOT NULL DEFAULT 0,
+    summary TEXT,
+    error TEXT,
+    worker_pid INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, created_at);
+CREATE TABLE IF NOT EXISTS job_rows (
+    job_id TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    ok INTEGER NOT NULL,
+    subject TEXT,
+    message TEXT,
+    PRIMARY KEY (job_id, row)
+);
+"""
+
+# Fields of a job returned to the web pages (credentials and file paths stay in the store)
+_PUBLIC_FIELDS = ('id', 'kind', 'status', 'file_name', 'total', 'processed', 'summary', 'error',
+                  'created_at', 'started_at', 'finished_at')
+
+
+class JobStore:
+    """
+    Job queue and results kept in one SQLite file shared by the web workers and the job worker.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            with closing(sqlite3.connect(self.db_path, timeout=60)) as db:
+                db.execute('PRAGMA journal_mode=WAL')
+                db.executescript(_SCHEMA)
+                columns = {row[1] for row in db.execute('PRAGMA table_info(jobs)')}
+                if 'attempts' not in columns:  # job stores created before jobs were resumable
+                    db.execute('ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+            self._initialized = True
+        db = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    @staticmethod
+    def _public(row: sqlite3.Row) -> dict:
+        job = {field: row[field] for field in _PUBLIC_FIELDS}
+        job['summary'] = json.loads(job['summary']) if job['summary'] else None
+        return job
+
+    def enqueue(self, kind: str, owner: str, file_name: str, file_path: str, params: dict, credentials: str) -> str:
+        """
+        Adds a queued job and returns its ID.
+        """
+        job_id = uuid.uuid4().hex
+        with closing(self._connect()) as db:
+            db.execute('INSERT INTO jobs (id, kind, owner, status, file_name, file_path, params, credentials, created_at) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       (job_id, kind, owner, 'queued', file_name, file_path, json.dumps(params), credentials, time.time()))
+        return job_id
+
+    def claim_next(self) -> dict | None:
+        """
+        Marks the oldest queued job as running by this process and returns it (with its
+        credentials, file path and params), or None when the queue is empty.
+        """
+        with closing(self._connect()) as db:
+            db.execute('BEGIN IMMEDIATE')  # only one worker can claim a given job
+            try:
+                row = db.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+                if row is None:
+                    return None
+                db.execute("UPDATE jobs SET status = 'running', worker_pid = ?, started_at = ?, attempts = attempts + 1 "
+                           "WHERE id = ?", (os.getpid(), time.time(), row['id']))
+            finally:
+                db.execute('COMMIT')
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        return job
+
+    def requeue_interrupted(self, max_attempts: int) -> tuple[int, int]:
+        """
+        Queues again the jobs left running by a worker process that no longer exists, so they resume
+        from their checkpoint journal. Jobs that already ran max_attempts times are marked interrupted.
+
+        Returns:
+            tuple: (requeued, given up) job counts.
+        """
+        requeued, given_up = 0, 0
+        with closing(self._connect()) as db:
+            for row in db.execute("SELECT id, worker_pid, attempts FROM jobs WHERE status = 'running'").fetchall():
+                if row['worker_pid'] == os.getpid() or _process_alive(row['worker_pid']):
+                    continue
+                if row['attempts'] < max_attempts:
+                    db.execute("UPDATE jobs SET status = 'queued', worker_pid = NULL WHERE id = ?", (row['id'],))
+                    requeued += 1
+                else:
+                    db.execute("UPDATE jobs SET status = 'interrupted', credentials = NULL, finished_at = ? "
+                               "WHERE id = ?", (time.time(), row['id']))
+                    given_up += 1
+        return requeued, given_up
+
+    def set_progress(self, job_id: str, processed: int, total: int = None):
+        with closing(self._connect()) as db:
+            if total is None:
+                db.execute('UPDATE jobs SET processed = ? WHERE id = ?', (processed, job_id))
+            else:
+                db.execute('UPDATE jobs SET processed = ?, total = ? WHERE id = ?', (processed, total, job_id))
+
+    def finish(self, job_id: str, status: str, rows: list = (), summary: dict = None, error: str = None):
+        """
+        Stores the per-row results and the outcome of a job, and forgets its credentials.
+
+        Args:
+            rows (list): (row number, ok, subject, message) tuples.
+        """
+        with closing(self._connect()) as db:
+            db.execute('BEGIN')
+            db.executemany('INSERT OR REPLACE INTO job_rows (job_id, row, ok, subject, message) VALUES (?, ?, ?, ?, ?)',
+                           [(job_id, row, int(ok), subject, message) for row, ok, subject, message in rows])
+            db.execute('UPDATE jobs SET status = ?, summary = ?, error = ?, credentials = NULL, finished_at = ? '
+                       'WHERE id = ?', (status, json.dumps(summary) if summary else None, error, time.time(), job_id))
+            db.execute('COMMIT')
+
+    def get(self, job_id: str, owner: str) -> dict | None:
+        with closing(self._connect()) as db:
+            row = db.execute('SELECT * FROM jobs WHERE id = ? AND owner = ?', (job_id, owner)).fetchone()
+        return self._public(row) if row else None
+
+    def list_jobs(self, owner: str, limit: int = 50) -> list:
+        with closing(self._connect()) as db:
+            rows = db.execute('SELECT * FROM jobs WHERE owner = ? ORDER BY created_at DESC LIMIT ?',
+                              (owner, limit)).fetchall()
+        return [self._public(row) for row in rows]
+
+    def rows(self, job_id: str, offset: int = 0, limit: int = 500, failed_only: bool = False) -> list:
+        query = 'SELECT row, ok, subject, message FROM job_rows WHERE job_id = ?'
+        if failed_only:
+            query += ' AND ok = 0'
+        with closing(self._connect()) as db:
+            rows = db.execute(query + ' ORDER BY row LIMIT ? OFFSET ?', (job_id, limit, offset)).fetchall()
+        return [{'row': row['row'], 'ok': bool(row['ok']), 'subject': row['subject'], 'message': row['message']}
+                for row in rows]
+
+
+def _process_alive(pid: int | None) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+job_store = JobStore(os.environ.get('JOBS_DB', os.path.join(JOBS_DIR, "jobs.sqlite3")))
+
+
+def encrypt_credentials(key: bytes, ldap_server: str, login: str, password: str, domain: str) -> str:
+    """
+    Encrypts the bind credentials a job runs with (same Fernet key as the session password).
+    """
+    payload = json.dumps({'ldap_server': ldap_server, 'login': login, 'password': password, 'domain': domain})
+    return Fernet(key).encrypt(payload.encode('utf-8')).decode('ascii')
+
+
+def enqueue_job(kind: str, owner: str, upload_path: str, file_name: str, params: dict, credentials: str) -> str:
+    """
+    Moves an uploaded file into the job directory and queues a job for it.
+
+    Args:
+        kind (str): One of JOB_HANDLERS.
+        owner (str): Who may see the job (see job_owner in routes).
+        upload_path (str): The saved upload; it is moved, not copied.
+        file_name (str): The original file name, for display.
+        params (dict): JSON serializable parameters of the handler.
+        credentials (str): Output of encrypt_credentials.
+
+    Returns:
+        str: The job ID.
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    file_path = os.path.join(JOBS_DIR, f"{uuid.uuid4().hex}{os.path.splitext(upload_path)[1].lower()}")
+    os.replace(upload_path, file_path)
+    return job_store.enqueue(kind, owner, file_name, file_path, params, credentials)
+
+
+class JobProgress:
+    """
+    Progress reporter handed to a running job. Writes are throttled, since rows can finish
+    thousands of times per second.
+    """
+
+    def __init__(self, job_id: str, min_interval: float = 0.5):
+        self.job_id = job_id
+        self.min_interval = min_interval
+        self.processed = 0
+        self._written_at = 0.0
+        self._lock = Lock()
+
+    def start(self, total: int, done: int = 0):
+        self.processed = done
+        job_store.set_progress(self.job_id, done, total)
+
+    def advance(self, processed=None):
+        """
+        Counts one more finished row. Called with an int, it is the number of finished rows
+        (reports from worker threads can arrive out of order); other arguments, such as a write
+        result, are ignored.
+        """
+        with self._lock:
+            if isinstance(processed, int):
+                self.processed = max(self.processed, processed)
+            else:
+                self.processed += 1
+            now = time.monotonic()
+            if now - self._written_at < self.min_interval:
+                return
+            self._written_at = now
+            processed = self.processed
+        job_store.set_progress(self.job_id, processed)
+
+
+def _run_import(conn, job: dict, progress: JobProgress):
+    params = job['params']
+    result = import_users_from_file(conn, job['file_path'], params['dc'], params['search_base'],
+                                    workers=params.get('workers'), progress=progress.advance,
+                                    on_start=progress.start)
+    if 'error' in result:
+        raise ValueError(result['error'])
+    rows = [(result_row['row'], result_row['ok'], result_row['username'], result_row['error'])
+            for result_row in result['results']]
+    return rows, {'added': result['added'], 'failed': result['failed']}
+
+
+def _run_delete(conn, job: dict, progress: JobProgress):
+    # The file is streamed twice (count, then delete) rather than held in memory
+    total = sum(1 for _ in iter_deletion_file(job['file_path']))
+    with open_journal('delete_users', job['file_path'], conn) as journal:
+        progress.start(total, len(journal.completed))
+        results = delete_users(conn, iter_deletion_file(job['file_path']), on_result=progress.advance,
+                               journal=journal)
+    rows = [(result['tag'], result['ok'], result['dn'], result['error']) for result in results]
+    deleted = sum(1 for result in results if result['ok'])
+    return rows, {'deleted': deleted, 'failed': len(results) - deleted}
+
+
+def _summary_rows(user_dns, summary: dict, messages: dict) -> list:
+    """
+    Turns a bulk engine summary keyed by DN back into per-row results, numbered as in the file
+    like the import results. `user_dns` are the (row number, DN) pairs of the file; rows without a
+    DN (incomplete rows, which the engines never see) fail as such.
+
+    Args:
+        messages (dict): summary category -> (ok, message); categories holding (DN, detail)
+                         pairs get the detail appended (or used alone when the message is None).
+    """
+    outcomes = {}
+    for category, (ok, message) in messages.items():
+        for item in summary.get(category, []):
+            if isinstance(item, tuple):
+                outcomes[item[0]] = (ok, f"{message}: {item[1]}" if message else item[1])
+            else:
+                outcomes[item] = (ok, message)
+
+    rows = []
+    for row_number, dn in user_dns:
+        ok, message = outcomes.get(dn, (False, 'not processed')) if dn is not None else (False, 'incomplete row')
+        rows.append((row_number, ok, dn, message))
+    return rows
+
+
+def _run_block(conn, job: dict, progress: JobProgress):
+    progress.start(sum(1 for _ in iter_block_file(job['file_path'])))
+    user_dns = (user_dn for _, user_dn in iter_block_file(job['file_path']) if user_dn is not None)
+    summary = bulk_change_block_status(conn, user_dns, action='block', on_result=progress.advance)
+    rows = _summary_rows(iter_block_file(job['file_path']), summary,
+                         {'changed': (True, 'blocked'), 'unchanged': (True, 'already blocked'),
+                          'not_found': (False, 'not found'), 'failed': (False, None)})
+    return rows, {category: len(items) for category, items in summary.items()}
+
+
+def _run_expire(conn, job: dict, progress: JobProgress):
+    total = sum(1 for _ in iter_expiration_file(job['file_path']))
+    with open_journal('expire_users', job['file_path'], conn) as journal:
+        progress.start(total, len(journal.completed))
+        summary = bulk_set_account_expiration(conn, expiration_pairs(iter_expiration_file(job['file_path'])),
+                                              on_result=progress.advance, journal=journal)
+    user_dns = ((row_number, user_dn) for row_number, user_dn, _ in iter_expiration_file(job['file_path']))
+    rows = _summary_rows(user_dns, summary,
+                         {'updated': (True, 'expiration set'), 'unchanged': (True, 'already set'),
+                          'not_found': (False, 'not found'), 'invalid_date': (False, 'invalid date'),
+                          'failed': (False, None)})
+    return rows, {category: len(items) for category, items in summary.items()}
+
+
+# Job kind -> handler(conn, job, progress) returning (rows, summary)
+JOB_HANDLERS = {
+    'import_users': _run_import,
+    'delete_users': _run_delete,
+    'block_users': _run_block,
+    'expire_users': _run_expire,
+}
+
+
+def run_job(job: dict, key: bytes):
+    """
+    Runs one claimed job and records its outcome. The uploaded file is removed afterwards.
+    """
+    progress = JobProgress(job['id'])
+    conn = None
+    try:
+        credentials = json.loads(Fernet(key).decrypt(job['credentials'].encode('ascii')))
+        is_connected, conn = co.acquire_connection(credentials['ldap_server'], credentials['login'],
+                                                   credentials['password'], credentials['domain'])
+        if not is_connected:
+            raise ConnectionError("LDAP connection failed")
+
+        logger.info(f"Running {job['kind']} job {job['id']}")
+        rows, summary = JOB_HANDLERS[job['kind']](conn, job, progress)
+        job_store.set_progress(job['id'], len(rows), len(rows))
+        job_store.finish(job['id'], 'done', rows, summary)
+        logger.info(f"Job {job['id']} done: {summary}")
+    except Exception as e:
+        logger.error(f"Job {job['id']} failed: {e}", exc_info=True)
+        job_store.finish(job['id'], 'failed', error=str(e))
+        co.release_connection(conn, discard=True)
+        conn = None
+    finally:
+        co.release_connection(conn)
+        if job.get('file_path') and os.path.exists(job['file_path']):
+            os.remove(job['file_path'])
+
+
+def run_worker(key: bytes, poll_interval: float = None):
+    """
+    Runs queued jobs one after another until the process is stopped.
+    """
+    poll_interval = poll_interval or JOBS_POLL_INTERVAL
+    requeued, given_up = job_store.requeue_interrupted(JOBS_MAX_ATTEMPTS)
+    if requeued or given_up:
+        logger.warning(f"Jobs interrupted by a previous worker shutdown: {requeued} resumed, "
+                       f"{given_up} given up after {JOBS_MAX_ATTEMPTS} attempts")
+    logger.info("Job worker started")
+    while True:
+        job = job_store.claim_next()
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        run_job(job, key)
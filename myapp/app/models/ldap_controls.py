@@ -0,0 +1,162 @@
+# myapp/app/models/ldap_controls.py
+# Request/response controls that ldap3 does not ship: server-side sort (RFC 2891)
+# and Virtual List View (draft-ietf-ldapext-ldapv3-vlv), both supported by Active Directory.
+from pyasn1.codec.ber import decoder
+from pyasn1.type.namedtype import NamedTypes, NamedType, OptionalNamedType, DefaultedNamedType
+from pyasn1.type.tag import Tag, tagClassContext, tagFormatSimple, tagFormatConstructed
+from pyasn1.type.univ import Sequence, SequenceOf, OctetString, Integer, Boolean, Enumerated, Choice
+from ldap3.protocol.controls import build_control
+
+SERVER_SORT_OID = '1.2.840.113556.1.4.473'
+SERVER_SORT_RESPONSE_OID = '1.2.840.113556.1.4.474'
+VLV_REQUEST_OID = '2.16.840.1.113730.3.4.9'
+VLV_RESPONSE_OID = '2.16.840.1.113730.3.4.10'
+
+
+class SortKey(Sequence):
+    # SortKey ::= SEQUENCE {
+    #     attributeType   AttributeDescription,
+    #     orderingRule    [0] MatchingRuleId OPTIONAL,
+    #     reverseOrder    [1] BOOLEAN DEFAULT FALSE }
+    componentType = NamedTypes(
+        NamedType('attributeType', OctetString()),
+        OptionalNamedType('orderingRule', OctetString().subtype(
+            implicitTag=Tag(tagClassContext, tagFormatSimple, 0))),
+        DefaultedNamedType('reverseOrder', Boolean(False).subtype(
+            implicitTag=Tag(tagClassContext, tagFormatSimple, 1)))
+    )
+
+
+class SortKeyList(SequenceOf):
+    # SortKeyList ::= SEQUENCE OF SortKey
+    componentType = SortKey()
+
+
+class SortResult(Sequence):
+    # SortResult ::= SEQUENCE {
+    #     sortResult  ENUMERATED,
+    #     attributeType [0] AttributeDescription OPTIONAL }
+    componentType = NamedTypes(
+        NamedType('sortResult', Enumerated()),
+        OptionalNamedType('attributeType', OctetString().subtype(
+            implicitTag=Tag(tagClassContext, tagFormatSimple, 0)))
+    )
+
+
+class ByOffset(Sequence):
+    # byOffset [0] SEQUENCE {
+    #     offset          INTEGER (0 .. maxInt),
+    #     contentCount    INTEGER (0 .. maxInt) }
+    tagSet = Sequence.tagSet.tagImplicitly(Tag(tagClassContext, tagFormatConstructed, 0))
+    componentType = NamedTypes(
+        NamedType('offset', Integer()),
+        NamedType('contentCount', Integer())
+    )
+
+
+class VlvTarget(Choice):
+    # target CHOICE {
+    #     byOffset            [0] SEQUENCE { ... },
+    #     greaterThanOrEqual  [1] AssertionValue }
+    componentType = NamedTypes(
+        NamedType('byOffset', ByOffset()),
+        NamedType('greaterThanOrEqual', OctetString().subtype(
+            implicitTag=Tag(tagClassContext, tagFormatSimple, 1)))
+    )
+
+
+class VirtualListViewRequest(Sequence):
+    # VirtualListViewRequest ::= SEQUENCE {
+    #     beforeCount    INTEGER (0..maxInt),
+    #     afterCount     INTEGER (0..maxInt),
+    #     target         CHOICE { ... },
+    #     contextID      OCTET STRING OPTIONAL }
+    componentType = NamedTypes(
+        NamedType('beforeCount', Integer()),
+        NamedType('afterCount', Integer()),
+        NamedType('target', VlvTarget()),
+        OptionalNamedType('contextID', OctetString())
+    )
+
+
+class VirtualListViewResponse(Sequence):
+    # VirtualListViewResponse ::= SEQUENCE {
+    #     targetPosition    INTEGER (0 .. maxInt),
+    #     contentCount      INTEGER (0 .. maxInt),
+    #     virtualListViewResult ENUMERATED { ... },
+    #     contextID         OCTET STRING OPTIONAL }
+    componentType = NamedTypes(
+        NamedType('targetPosition', Integer()),
+        NamedType('contentCount', Integer()),
+        NamedType('virtualListViewResult', Enumerated()),
+        OptionalNamedType('contextID', OctetString())
+    )
+
+
+def server_side_sort_control(sort_keys: list, criticality: bool = True):
+    """
+    Builds a server-side sort request control.
+
+    Args:
+        sort_keys (list): (attribute, reverse) tuples. Active Directory only honours the first key.
+        criticality (bool): Fail the search if the server cannot sort.
+    """
+    control_value = SortKeyList()
+    for position, (attribute, reverse) in enumerate(sort_keys):
+        sort_key = SortKey()
+        sort_key.setComponentByName('attributeType', attribute)
+        if reverse:
+            sort_key.setComponentByName('reverseOrder', True)
+        control_value.setComponentByPosition(position, sort_key)
+    return build_control(SERVER_SORT_OID, criticality, control_value)
+
+
+def vlv_control(offset: int, before_count: int, after_count: int, content_count: int = 0,
+                context_id: bytes | None = None, criticality: bool = True):
+    """
+    Builds a Virtual List View request control selecting entries by position.
+
+    Args:
+        offset (int): 1-based position of the target entry in the sorted result.
+        before_count (int): Entries to return before the target.
+        after_count (int): Entries to return after the target.
+        content_count (int): Client's estimate of the result size (0 when unknown).
+        context_id (bytes | None): contextID from the previous VLV response, if any.
+        criticality (bool): Fail the search if the server does not support VLV.
+    """
+    by_offset = ByOffset()
+    by_offset.setComponentByName('offset', offset)
+    by_offset.setComponentByName('contentCount', content_count)
+
+    target = VlvTarget()
+    target.setComponentByName('byOffset', by_offset)
+
+    control_value = VirtualListViewRequest()
+    control_value.setComponentByName('beforeCount', before_count)
+    control_value.setComponentByName('afterCount', after_count)
+    control_value.setComponentByName('target', target)
+    if context_id:
+        control_value.setComponentByName('contextID', context_id)
+    return build_control(VLV_REQUEST_OID, criticality, control_value)
+
+
+def decode_vlv_response(control_value: bytes) -> dict:
+    """
+    Decodes the value of a VLV response control, as left undecoded by ldap3 in conn.result['controls'].
+    """
+    response, _ = decoder.decode(control_value, asn1Spec=VirtualListViewResponse())
+    context_id = response['contextID']
+    return {
+        'target_position': int(response['targetPosition']),
+        'content_count': int(response['contentCount']),
+        'result': int(response['virtualListViewResult']),
+        'context_id': bytes(context_id) if context_id.hasValue() else None
+    }
+
+
+def decode_sort_response(control_value: bytes) -> int:
+    """
+    Decodes the value of a server-side sort response control and returns its result code.
+    """
+    response, _ = decoder.decode(control_value, asn1Spec=SortResult())
+    return int(response['sortResult'])
@@ -0,0 +1,125 @@
+# myapp/app/models/ldap_retry.py
+# Retries of batch operations that failed for a transient reason (the DC answered busy /
+# unavailable / timeLimitExceeded, or the connection dropped), with jittered exponential backoff
+# and a rebind of dropped connections, so one hiccup does not fail a row or abandon a file.
+from ldap3 import Connection
+from ldap3.core.exceptions import LDAPException, LDAPCommunicationError, LDAPResponseTimeoutError, LDAPOperationResult
+import logging
+import os
+import random
+import time
+
+from app.models.write_throttle import is_overloaded
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# Attempts per operation, including the first one
+RETRY_ATTEMPTS = int(os.environ.get('LDAP_RETRY_ATTEMPTS', 4))
+# Backoff before attempt n + 1 is random between 0 and min(max delay, base delay * 2 ** (n - 1)) seconds
+RETRY_BASE_DELAY = float(os.environ.get('LDAP_RETRY_BASE_DELAY', 0.5))
+RETRY_MAX_DELAY = float(os.environ.get('LDAP_RETRY_MAX_DELAY', 15))
+
+# Results that mean a retried request had already been applied before its connection dropped
+ALREADY_APPLIED_RESULT_CODES = {
+    'add': {68},  # entryAlreadyExists
+    'delete': {32},  # noSuchObject
+    'modify': {16, 20},  # noSuchAttribute, attributeOrValueExists (member already removed / added)
+}
+
+
+def _result_code(result: dict | None = None, error: Exception | None = None) -> int | None:
+    if isinstance(error, LDAPOperationResult):
+        return error.result
+    return result.get('result') if result else None
+
+
+def is_connection_error(error: Exception | None) -> bool:
+    """
+    Tells whether an exception means the connection is gone (and must be rebound before a retry).
+    """
+    return isinstance(error, (LDAPCommunicationError, LDAPResponseTimeoutError))
+
+
+def is_transient(result: dict | None = None, error: Exception | None = None) -> bool:
+    """
+    Sorts a failed operation's result (or exception) into transient (worth retrying) or permanent.
+    """
+    return is_overloaded(result, error) or is_connection_error(error)
+
+
+def already_applied(operation: str, result: dict | None = None, error: Exception | None = None) -> bool:
+    """
+    Tells whether the failure of a retried write means the previous attempt went through.
+    Only meaningful when that attempt was lost with its connection (see is_connection_error):
+    after a busy / unavailable answer the DC did not perform the write, so e.g. entryAlreadyExists
+    means the entry belongs to someone else.
+    """
+    return _result_code(result, error) in ALREADY_APPLIED_RESULT_CODES.get(operation, ())
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    Seconds to wait after failed attempt number `attempt` (1-based), with full jitter so writers
+    that failed together do not retry together.
+    """
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+
+def rebind(conn: Connection) -> bool:
+    """
+    Reopens and binds a connection whose socket was dropped, keeping the same Connection object.
+    """
+    try:
+        conn.unbind()
+    except Exception:
+        pass  # the socket is already gone
+    try:
+        conn.bind()  # opens the socket again first
+        logger.info(f"Rebound LDAP connection as {conn.user}")
+        return True
+    except LDAPException as e:
+        logger.warning(f"Could not rebind LDAP connection as {conn.user}: {e}")
+        return False
+
+
+def call_with_retry(conn: Connection, operation: str, *args, attempts: int = None, lost: bool = False, **kwargs):
+    """
+    Runs conn.<operation>(*args, **kwargs) on a synchronous connection, retrying transient
+    failures with backoff and rebinding the connection when it was dropped. A write retried after
+    its connection dropped that finds its work already done (e.g. the entry of a retried delete is
+    gone) counts as a success. `lost` tells that an earlier attempt, made by the caller, was lost
+    that way too.
+
+    Returns:
+        The operation's return value; conn.result holds the last result. The exception of the
+        last attempt is raised when it failed permanently or ran out of attempts.
+    """
+    attempts = max(1, attempts or RETRY_ATTEMPTS)
+    # lost: whether the previous attempt dropped with the connection, so its outcome is unknown
+    for attempt in range(1, attempts + 1):
+        try:
+            outcome = getattr(conn, operation)(*args, **kwargs)
+            error = None
+        except LDAPException as e:
+            outcome, error = False, e
+
+        result = conn.result if error is None else None
+        if error is None and (outcome or not is_transient(result)):
+            if not outcome and lost and already_applied(operation, result):
+                return True
+            return outcome
+        if error is not None and lost and already_applied(operation, error=error):
+            return True
+        if attempt == attempts or not is_transient(result, error):
+            if error is not None:
+                raise error
+            return outcome
+
+        delay = backoff_delay(attempt)
+        logger.info(f"Transient LDAP failure of {operation} ({error or result.get('description')}), "
+                    f"retrying in {delay:.2f}s (attempt {attempt + 1} of {attempts})")
+        time.sleep(delay)
+        lost = is_connection_error(error)
+        if lost or conn.closed:
+            rebind(conn)
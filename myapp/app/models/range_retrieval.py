@@ -0,0 +1,65 @@
+# myapp/app/models/range_retrieval.py
+# Active Directory returns at most MaxValRange (1500 by default) values of a multi-valued
+# attribute per read; larger attributes come back as 'member;range=0-1499' and the rest has
+# to be requested range by range (member;range=1500-*, ...).
+from ldap3 import Connection, BASE
+import re
+
+
+def _range_of(attribute_key: str, attribute: str) -> tuple[int, int | None] | None:
+    """
+    Returns (start, end) of an 'attr;range=start-end' response key, end being None for '*',
+    or None if the key is not a ranged form of the attribute.
+    """
+    match = re.match(rf'^{re.escape(attribute)};range=(\d+)-(\d+|\*)$', attribute_key, re.IGNORECASE)
+    if not match:
+        return None
+    end = match.group(2)
+    return int(match.group(1)), None if end == '*' else int(end)
+
+
+def iter_ranged_values(conn: Connection, dn: str, attribute: str = 'member', start: int = 0,
+                       search_filter: str = '(objectClass=*)', controls: list = None):
+    """
+    Lazily yields every value of a multi-valued attribute of one entry, following range
+    retrieval until the list is complete. Only one range (up to MaxValRange values) is held
+    at a time, and the connection may be used by the caller between values.
+
+    Args:
+        conn (Connection): An active LDAP connection.
+        dn (str): Distinguished name of the entry (e.g. a group).
+        attribute (str): The attribute to read, 'member' by default.
+        start (int): Index of the first value to read (e.g. after an initial 0-1499 range already read).
+        search_filter (str): Filter the entry must match (e.g. '(objectClass=group)').
+        controls (list): Additional controls for each read (e.g. the extended DN control).
+
+    Yields:
+        str: The attribute values, decoded as UTF-8.
+    """
+    while True:
+        # The first read asks for the plain attribute: small attributes come back whole, large ones
+        # as 'attr;range=0-1499' (and servers without range retrieval just return everything)
+        requested = attribute if start == 0 else f'{attribute};range={start}-*'
+        conn.search(dn, search_filter, search_scope=BASE, attributes=[requested], controls=controls)
+        if not conn.response or conn.response[0].get('type') != 'searchResEntry':
+            return
+
+        page, next_start = None, None
+        for key, values in conn.response[0]['raw_attributes'].items():
+            value_range = _range_of(key, attribute)
+            if value_range is not None:
+                page = values
+                if value_range[1] is not None:
+                    next_start = value_range[1] + 1
+                break
+            if key.lower() == attribute.lower():
+                page = values  # may be an empty placeholder next to the ranged key, so keep looking
+        page = page or []
+
+        # Decode before yielding: the caller may run other searches on this connection meanwhile
+        decoded = [value.decode('utf-8') if isinstance(value, bytes) else str(value) for value in page]
+        yield from decoded
+
+        if next_start is None or not page:
+            return
+        start = next_start
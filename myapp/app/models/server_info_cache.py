@@ -0,0 +1,160 @@
+# myapp/app/models/server_info_cache.py
+from ldap3 import Server, Connection, ALL, BASE, NONE
+from ldap3.protocol.rfc4512 import DsaInfo, SchemaInfo
+import hashlib
+import json
+import logging
+import os
+import time
+from threading import Lock
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+
+class ServerInfoCache:
+    """
+    Caches the root DSE (DSA info) and the schema of each server URL, so new
+    connections do not download the full AD schema again.
+
+    Freshness is checked with the uSNChanged of the schema naming context head,
+    which Active Directory bumps on every schema update. The check costs one BASE
+    read and is done at most once every `ttl` seconds per server.
+    """
+
+    def __init__(self, ttl: float = 600.0, cache_dir: str | None = None):
+        """
+        Args:
+            ttl (float): Seconds between schema freshness checks.
+            cache_dir (str | None): Directory where the cache is persisted, or None to keep it in memory only.
+        """
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self._lock = Lock()
+        self._entries = {}  # server_url -> dict(info, schema, schema_usn, checked_at)
+
+    def _cache_file(self, server_url: str) -> str:
+        digest = hashlib.sha1(server_url.lower().encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"server_info_{digest}.json")
+
+    def _load_from_disk(self, server_url: str) -> dict | None:
+        if not self.cache_dir:
+            return None
+        path = self._cache_file(server_url)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return {
+                'info': DsaInfo.from_json(data['info']),
+                'schema': SchemaInfo.from_json(data['schema']),
+                'schema_usn': data.get('schema_usn'),
+                'checked_at': 0.0  # force a freshness check on first use
+            }
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable server info cache {path}: {e}")
+            return None
+
+    def _save_to_disk(self, server_url: str, entry: dict):
+        if not self.cache_dir:
+            return
+        path = self._cache_file(server_url)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'server_url': server_url,
+                    'schema_usn': entry['schema_usn'],
+                    'info': entry['info'].to_json(),
+                    'schema': entry['schema'].to_json()
+                }, f)
+            os.replace(tmp_path, path)  # atomic, other workers never see a partial file
+        except Exception as e:
+            logger.warning(f"Could not persist server info cache to {path}: {e}")
+
+    def get(self, server_url: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(server_url)
+        if entry is None:
+            entry = self._load_from_disk(server_url)
+            if entry is not None:
+                with self._lock:
+                    self._entries.setdefault(server_url, entry)
+        return entry
+
+    def make_server(self, server_url: str) -> Server:
+        """
+        Returns a Server for the URL, preloaded with the cached info and schema when available.
+        A server without cached info reads it from the DSA on bind as usual.
+        """
+        entry = self.get(server_url)
+        if entry is None:
+            return Server(server_url, get_info=ALL, use_ssl=False)
+
+        server = Server(server_url, get_info=NONE, use_ssl=False)
+        server.attach_dsa_info(entry['info'])
+        server.attach_schema_info(entry['schema'])
+        return server
+
+    def after_bind(self, server_url: str, conn: Connection):
+        """
+        Stores freshly read info, or revalidates cached info against the server.
+        Must be called with the bound connection created from make_server.
+        """
+        entry = self.get(server_url)
+        now = time.monotonic()
+
+        if entry is not None and now - entry['checked_at'] < self.ttl:
+            return
+
+        schema_usn = read_schema_usn(conn)
+        if entry is not None and schema_usn is not None and schema_usn == entry['schema_usn']:
+            entry['checked_at'] = now
+            return
+
+        if entry is not None:
+            # Schema changed (or could not be checked): read it again through this connection
+            logger.info(f"Schema of {server_url} changed (USN {entry['schema_usn']} -> {schema_usn}), reloading")
+            conn.server.get_info = ALL
+            conn.refresh_server_info()
+
+        if not conn.server.info or not conn.server.schema:
+            return
+
+        new_entry = {
+            'info': conn.server.info,
+            'schema': conn.server.schema,
+            'schema_usn': schema_usn,
+            'checked_at': now
+        }
+        with self._lock:
+            self._entries[server_url] = new_entry
+        self._save_to_disk(server_url, new_entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+
+def read_schema_usn(conn: Connection) -> int | None:
+    """
+    Reads the uSNChanged of the schema naming context head, or None if it is not available.
+    """
+    try:
+        info = conn.server.info
+        schema_nc = info.other.get('schemaNamingContext', [None])[0] if info else None
+        if not schema_nc:
+            return None
+        if conn.search(schema_nc, '(objectClass=*)', search_scope=BASE, attributes=['uSNChanged']):
+            return int(conn.response[0]['raw_attributes']['uSNChanged'][0])
+    except Exception as e:
+        logger.warning(f"Could not read schema USN: {e}")
+    return None
+
+
+server_info_cache = ServerInfoCache(
+    ttl=float(os.environ.get('LDAP_SCHEMA_CACHE_TTL', 600)),
+    cache_dir=os.environ.get('LDAP_SCHEMA_CACHE_DIR') or None
+)
@@ -0,0 +1,72 @@
+from datetime import datetime, timezone
+from ldap3 import Connection
+from app.models.all_users import DEFAULT_PAGE_SIZE
+
+ACCOUNTDISABLE = 2
+DONT_EXPIRE_PASSWORD = 65536
+
+# accountExpires is a FILETIME (100 ns intervals since 1601-01-01); 0 and 0x7FFFFFFFFFFFFFFF both mean "never"
+ACCOUNT_NEVER_EXPIRES = 0x7FFFFFFFFFFFFFFF
+_FILETIME_UNIX_EPOCH = 116444736000000000
+
+
+def _now_as_filetime() -> int:
+    return int(datetime.now(timezone.utc).timestamp() * 10000000) + _FILETIME_UNIX_EPOCH
+
+
+def _first_int(raw_attributes: dict, attr: str) -> int:
+    values = raw_attributes.get(attr)
+    if not values:
+        return 0
+    try:
+        return int(values[0])
+    except (TypeError, ValueError):
+        return 0
+
+
+def get_user_statistics(conn: Connection, search_base: str, page_size: int = None) -> dict:
+    """
+    Computes the dashboard statistics in a single paged pass over all users.
+    Only userAccountControl and accountExpires are requested and they are read
+    from the raw response values, so no Entry objects are built.
+
+    Args:
+        conn (Connection): An active LDAP connection.
+        search_base (str): The base from which to perform the search in Active Directory.
+        page_size (int): Number of entries requested per page (optional).
+
+    Returns:
+        dict: total_users, blocked_users, expiring_users (expiration date in the future),
+              expired_users and password_never_expires counts.
+    """
+    stats = {
+        'total_users': 0,
+        'blocked_users': 0,
+        'expiring_users': 0,
+        'expired_users': 0,
+        'password_never_expires': 0
+    }
+    now = _now_as_filetime()
+
+    entries = conn.extend.standard.paged_search(search_base, '(objectClass=user)',
+                                                attributes=['userAccountControl', 'accountExpires'],
+                                                paged_size=page_size or DEFAULT_PAGE_SIZE, generator=True)
+    for entry in entries:
+        if entry.get('type') != 'searchResEntry':
+            continue
+        raw = entry['raw_attributes']
+        uac = _first_int(raw, 'userAccountControl')
+        expires = _first_int(raw, 'accountExpires')
+
+        stats['total_users'] += 1
+        if uac & ACCOUNTDISABLE:
+            stats['blocked_users'] += 1
+        if uac & DONT_EXPIRE_PASSWORD:
+            stats['password_never_expires'] += 1
+        if 0 < expires < ACCOUNT_NEVER_EXPIRES:
+            if expires > now:
+                stats['expiring_users'] += 1
+            else:
+                stats['expired_users'] += 1
+
+    return stats
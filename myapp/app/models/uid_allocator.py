@@ -0,0 +1,137 @@
+# myapp/app/models/uid_allocator.py
+from ldap3 import Connection
+from ldap3.core.exceptions import LDAPSizeLimitExceededResult
+import fcntl
+import hashlib
+import json
+import logging
+import os
+from threading import Lock
+
+from app.models.all_users import DEFAULT_PAGE_SIZE
+from app.models.dn_utils import normalize_dn
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+
+class UidAllocator:
+    """
+    Hands out uidNumbers from a high-water mark kept in a state file, instead of scanning
+    every (uidNumber=*) entry for each new user.
+
+    The state file is locked with flock while a range is reserved, so gunicorn workers never
+    hand out the same number. Each reservation checks the directory once for uidNumbers
+    above the mark (assigned by other tools) and skips past them. Numbers of a reserved
+    block that end up unused are simply skipped; uidNumbers do not need to be contiguous.
+    """
+
+    def __init__(self, state_dir: str, block_size: int = 20, first_uid: int = 1000):
+        """
+        Args:
+            state_dir (str): Directory holding the high-water mark files (shared by all workers).
+            block_size (int): Numbers reserved at once by a worker for single user creation.
+            first_uid (int): uidNumber given to the first user when the directory has none.
+        """
+        self.state_dir = state_dir
+        self.block_size = block_size
+        self.first_uid = first_uid
+        self._lock = Lock()
+        self._pid = os.getpid()
+        self._blocks = {}  # state file -> [next uid, end (exclusive)]
+
+    def _state_file(self, search_base: str) -> str:
+        digest = hashlib.sha1(normalize_dn(search_base).encode('utf-8')).hexdigest()
+        return os.path.join(self.state_dir, f"uid_allocator_{digest}.json")
+
+    @staticmethod
+    def _directory_max(conn: Connection, search_base: str) -> int | None:
+        """
+        Highest uidNumber in the directory (one paged scan, only needed to seed or resync the mark).
+        """
+        highest = None
+        entries = conn.extend.standard.paged_search(search_base, '(uidNumber=*)', attributes=['uidNumber'],
+                                                    paged_size=DEFAULT_PAGE_SIZE, generator=True)
+        for entry in entries:
+            if entry.get('type') != 'searchResEntry':
+                continue
+            for value in entry['raw_attributes'].get('uidNumber') or []:
+                try:
+                    uid = int(value)
+                except (TypeError, ValueError):
+                    continue
+                if highest is None or uid > highest:
+                    highest = uid
+        return highest
+
+    @staticmethod
+    def _directory_has_above(conn: Connection, search_base: str, uid: int) -> bool:
+        try:
+            conn.search(search_base, f'(uidNumber>={uid + 1})', attributes=['uidNumber'], size_limit=1)
+        except LDAPSizeLimitExceededResult:
+            return True  # more than one entry above the mark
+        return any(entry.get('type') == 'searchResEntry' for entry in conn.response or [])
+
+    def reserve(self, conn: Connection, search_base: str, count: int) -> range:
+        """
+        Reserves `count` consecutive uidNumbers for the directory under search_base.
+
+        Args:
+            conn (Connection): An active LDAP connection.
+            search_base (str): The domain's base DN (e.g. "DC=example,DC=com").
+            count (int): How many numbers to reserve.
+
+        Returns:
+            range: The reserved uidNumbers.
+        """
+        os.makedirs(self.state_dir, exist_ok=True)
+        path = self._state_file(search_base)
+        with open(path, 'a+', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)  # released when the file is closed
+            f.seek(0)
+            content = f.read()
+            mark = json.loads(content).get('high_water_mark') if content.strip() else None
+
+            if mark is None:
+                highest = self._directory_max(conn, search_base)
+                mark = highest if highest is not None else self.first_uid - 1
+                logger.info(f"uidNumber high-water mark for {search_base} seeded from the directory: {mark}")
+            elif self._directory_has_above(conn, search_base, mark):
+                highest = self._directory_max(conn, search_base)
+                logger.warning(f"uidNumbers above the high-water mark {mark} were assigned outside this app, "
+                               f"continuing after {highest}")
+                mark = max(mark, highest or mark)
+
+            start = mark + 1
+            mark += max(count, 0)
+            f.seek(0)
+            f.truncate()
+            json.dump({'search_base': search_base, 'high_water_mark': mark}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        return range(start, mark + 1)
+
+    def allocate(self, conn: Connection, search_base: str) -> int:
+        """
+        Returns one free uidNumber, taken from this worker's reserved block (reserving a new block when empty).
+        """
+        key = self._state_file(search_base)
+        with self._lock:
+            if os.getpid() != self._pid:
+                # A block reserved before a fork would be handed out by every worker
+                self._pid = os.getpid()
+                self._blocks = {}
+            block = self._blocks.get(key)
+            if block is None or block[0] >= block[1]:
+                reserved = self.reserve(conn, search_base, self.block_size)
+                block = [reserved.start, reserved.stop]
+                self._blocks[key] = block
+            uid = block[0]
+            block[0] += 1
+        return uid
+
+
+uid_allocator = UidAllocator(
+    state_dir=os.environ.get('UID_ALLOCATOR_DIR', os.path.join("app", "data")),
+    block_size=int(os.environ.get('UID_ALLOCATOR_BLOCK_SIZE', 20))
+)
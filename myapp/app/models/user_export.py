@@ -0,0 +1,131 @@
+# myapp/app/models/user_export.py
+# Export of user listings as CSV or XLSX, produced while the users are still being paged in, so
+# memory stays flat however large the domain is.
+from datetime import datetime
+import csv
+import io
+import os
+import tempfile
+import zlib
+from openpyxl import Workbook
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+# Rows written to the CSV buffer before it is sent as one chunk
+EXPORT_CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', 500))
+# Bytes per chunk when the finished XLSX file is sent
+EXPORT_READ_SIZE = 64 * 1024
+
+
+# A cell starting with one of these is read as a formula by Excel and LibreOffice (CSV and XLSX)
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def export_value(value) -> str:
+    """
+    Formats one attribute value for a cell: multi-valued attributes joined by "; ",
+    binary values as hex, dates in ISO format, missing values as an empty string.
+    Text that a spreadsheet would evaluate as a formula (see FORMULA_PREFIXES) gets a leading
+    apostrophe, so a crafted attribute value such as a description cannot run in the export.
+    """
+    text = _cell_text(value)
+    return "'" + text if text.startswith(FORMULA_PREFIXES) else text
+
+
+def _cell_text(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, (list, tuple)):
+        return '; '.join(_cell_text(item) for item in value)
+    if isinstance(value, bytes):
+        return value.hex()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _user_cells(user, columns: list) -> list:
+    cells = []
+    for column in columns:
+        try:
+            cells.append(export_value(user[column]))
+        except KeyError:
+            cells.append('')
+    return cells
+
+
+def iter_csv_export(users, columns: list, chunk_rows: int = None):
+    """
+    Yields a CSV export of `users` in chunks of text: the header row first (right away), then
+    `chunk_rows` users at a time. The text starts with a byte order mark so Excel reads it as UTF-8.
+    """
+    chunk_rows = max(1, chunk_rows or EXPORT_CHUNK_ROWS)
+    buffer = io.StringIO()
+    buffer.write('\ufeff')
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+
+    buffered = 0
+    buffer.seek(0)
+    buffer.truncate()
+    for user in users:
+        writer.writerow(_user_cells(user, columns))
+        buffered += 1
+        if buffered >= chunk_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            buffered = 0
+    if buffered:
+        yield buffer.getvalue()
+
+
+def iter_xlsx_export(users, columns: list):
+    """
+    Yields an XLSX export of `users` in chunks of bytes. The workbook is built in openpyxl's
+    write-only mode, which streams the rows to a temporary file instead of keeping them in memory;
+    an XLSX file is a zip archive, so it can only be sent once the last row is written.
+    """
+    wb = Workbook(write_only=True)
+    sheet = wb.create_sheet('Users')
+    sheet.append(columns)
+    for user in users:
+        sheet.append(_user_cells(user, columns))
+
+    with tempfile.TemporaryFile() as file:
+        wb.save(file)
+        file.seek(0)
+        for chunk in iter(lambda: file.read(EXPORT_READ_SIZE), b''):
+            yield chunk
+
+
+def gzip_chunks(chunks):
+    """
+    Compresses a stream of text or byte chunks into a gzip stream. Every chunk is flushed, so the
+    compressed stream keeps pace with the rows instead of waiting for deflate's buffer to fill.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+        data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_users(users, columns: list, export_format: str = 'csv', compress: bool = False):
+    """
+    Returns the chunks of an export of `users` (an iterator, e.g. from iter_all_users), limited
+    to `columns`, in the given format (a key of EXPORT_FORMATS), gzip-compressed if asked.
+    Raises ValueError for unknown formats.
+    """
+    if export_format == 'csv':
+        chunks = iter_csv_export(users, columns)
+    elif export_format == 'xlsx':
+        chunks = iter_xlsx_export(users, columns)
+    else:
+        raise ValueError(f"Unsupported export format: {export_format}")
+    return gzip_chunks(chunks) if compress else chunks
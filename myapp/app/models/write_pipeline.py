@@ -0,0 +1,231 @@
+# myapp/app/models/write_pipeline.py
+# Batch writes over ldap3's asynchronous strategy: requests are sent without waiting for the
+# previous response, keeping up to `window` of them outstanding on one connection, so a
+# batch file costs roughly one round trip per window instead of one per row.
+from ldap3 import Connection
+from ldap3.core.exceptions import LDAPException, LDAPCommunicationError
+from collections import deque
+import heapq
+import itertools
+import logging
+import os
+import time
+
+from app.models import connection as co
+from app.models.write_throttle import get_write_throttle, is_overloaded
+from app.models.ldap_retry import (RETRY_ATTEMPTS, call_with_retry, is_transient, is_connection_error,
+                                   already_applied, backoff_delay, rebind)
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# Requests kept in flight at once (1 = one request after another)
+DEFAULT_WRITE_WINDOW = int(os.environ.get('LDAP_WRITE_WINDOW', 32))
+
+
+class WritePipeline:
+    """
+    Sends add / modify / delete requests on an asynchronous connection opened with the
+    credentials of `conn`, keeping at most `window` requests outstanding. When the window is
+    full the oldest request is waited for before the next one is sent (backpressure). Requests
+    also take slots of the DC's write throttle, which narrows the window while the DC is loaded.
+
+    Each request carries a caller supplied tag (e.g. the file row) and ends up in `results`
+    as {"tag", "dn", "ok", "error", "transient"}, in the order the responses arrived; "transient"
+    tells whether a failure was transient (retried until the attempts ran out).
+    Transient failures (busy, unavailable, a dropped connection) are retried up to `attempts`
+    times with backoff (see ldap_retry): they wait in a retry queue while further requests are
+    sent, and a dropped connection is reopened and its outstanding requests are queued again.
+    If no asynchronous connection can be opened, the requests run synchronously on `conn`.
+    `on_result`, when given, is called with each result as soon as it is known (e.g. for progress).
+
+    Usage:
+        with WritePipeline(conn) as pipeline:
+            for row, dn in rows:
+                pipeline.delete(dn, tag=row)
+        processed = pipeline.succeeded
+    """
+
+    def __init__(self, conn: Connection, window: int = None, on_result=None, attempts: int = None):
+        self.conn = conn
+        self.window = max(1, window or DEFAULT_WRITE_WINDOW)
+        self.attempts = max(1, attempts or RETRY_ATTEMPTS)
+        self.on_result = on_result
+        self.results = []
+        self._pending = deque()  # (message id, start time, request), oldest first
+        self._retries = []  # heap of (due time, order, request) waiting for their backoff
+        self._retry_order = itertools.count()
+        self._throttle = get_write_throttle(conn)
+        self._async_conn = None
+        if self.window > 1:
+            is_connected, self._async_conn = co.open_async_connection(conn)
+            if not is_connected:
+                logger.warning("Asynchronous connection unavailable, batch writes will run one at a time")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def succeeded(self) -> int:
+        return sum(1 for result in self.results if result['ok'])
+
+    def add(self, dn: str, object_class=None, attributes: dict = None, tag=None):
+        self._submit('add', dn, tag, object_class, attributes)
+
+    def modify(self, dn: str, changes: dict, tag=None):
+        self._submit('modify', dn, tag, changes)
+
+    def delete(self, dn: str, tag=None):
+        self._submit('delete', dn, tag)
+
+    def _record(self, request: dict, result: dict | None, error: Exception = None, ok: bool = None):
+        if ok is None:
+            ok = error is None and result is not None and result.get('result') == 0
+        message = None
+        if not ok:
+            message = str(error) if error is not None else (
+                f"{result.get('description')}: {result.get('message')}" if result else "no result")
+        record = {"tag": request["tag"], "dn": request["dn"], "ok": ok, "error": message,
+                  "transient": not ok and is_transient(result, error)}
+        self.results.append(record)
+        if self.on_result is not None:
+            self.on_result(record)
+
+    def _submit(self, operation: str, dn: str, tag, *args):
+        self._resend_due()
+        # "lost": the previous attempt dropped with the connection, so it may have been applied
+        self._send({"operation": operation, "dn": dn, "tag": tag, "args": args, "attempt": 1, "lost": False})
+
+    def _send(self, request: dict):
+        started = None
+        if self._async_conn is not None:
+            while self._pending and len(self._pending) >= self.window:
+                self._collect_oldest()
+            # Our own outstanding requests free throttle slots; only wait for other writers without them
+            started = self._throttle.try_acquire()
+            while started is None and self._pending:
+                self._collect_oldest()
+                started = self._throttle.try_acquire()
+
+        if self._async_conn is None:
+            # No asynchronous connection, or it dropped and could not be reopened while collecting above
+            if started is None:
+                started = self._throttle.acquire()
+            result = error = None
+            ok = False
+            try:
+                # True also when a retried write turns out to have been applied already
+                ok = call_with_retry(self.conn, request["operation"], request["dn"], *request["args"],
+                                     attempts=max(1, self.attempts - request["attempt"] + 1), lost=request["lost"])
+                result = self.conn.result
+            except LDAPException as e:
+                error = e
+            self._throttle.release(started, is_overloaded(result, error))
+            self._record(request, result, error, ok=error is None and bool(ok))
+            return
+
+        if started is None:
+            started = self._throttle.acquire()
+        try:
+            message_id = getattr(self._async_conn, request["operation"])(request["dn"], *request["args"])
+        except LDAPException as e:
+            self._throttle.release(started, is_overloaded(error=e))
+            self._failed(request, None, e)
+            return
+        self._pending.append((message_id, started, request))
+
+    def _collect_oldest(self):
+        message_id, started, request = self._pending.popleft()
+        result = error = None
+        try:
+            _, result = self._async_conn.get_response(message_id)
+        except LDAPException as e:
+            error = e
+        self._throttle.release(started, is_overloaded(result, error))
+        if error is None and result is not None and result.get('result') == 0:
+            self._record(request, result)
+        else:
+            self._failed(request, result, error)
+
+    def _failed(self, request: dict, result: dict | None, error: Exception = None):
+        """
+        Records a failed request, or queues it to be sent again after a backoff when the failure
+        is transient. Retries are sent by _resend_due, never from here, so a flapping DC does not
+        recurse through the requests of a full window.
+        """
+        # Only a lost attempt may have been applied; after e.g. busy, noSuchObject is a real failure
+        if request["lost"] and already_applied(request["operation"], result, error):
+            self._record(request, result, ok=True)
+            return
+        if request["attempt"] >= self.attempts or not is_transient(result, error):
+            self._record(request, result, error)
+            return
+
+        delay = backoff_delay(request["attempt"])
+        logger.info(f"Transient failure of {request['operation']} {request['dn']} "
+                    f"({error or result.get('description')}), retrying in {delay:.2f}s")
+        request["attempt"] += 1
+        request["lost"] = is_connection_error(error)
+        self._queue_retry(request, delay)
+        if is_connection_error(error):
+            self._reconnect()
+
+    def _queue_retry(self, request: dict, delay: float = 0):
+        heapq.heappush(self._retries, (time.monotonic() + delay, next(self._retry_order), request))
+
+    def _resend_due(self):
+        """
+        Sends the queued retries whose backoff is over.
+        """
+        while self._retries and self._retries[0][0] <= time.monotonic():
+            _, _, request = heapq.heappop(self._retries)
+            self._send(request)
+
+    def _reconnect(self):
+        """
+        Replaces a dropped asynchronous connection. The requests outstanding on it got no answer,
+        so they are queued to be sent again on the new one (or synchronously, if it cannot be opened).
+        """
+        lost = list(self._pending)
+        self._pending.clear()
+        for _, started, _ in lost:
+            self._throttle.release(started, overloaded=True)
+        co.disconnect_from_active_directory(self._async_conn)
+        is_connected, self._async_conn = co.open_async_connection(self.conn)
+        if not is_connected:
+            self._async_conn = None
+            logger.warning("Could not reopen the asynchronous connection, continuing one request at a time")
+            if self.conn.closed:
+                rebind(self.conn)
+        for _, _, request in lost:
+            if request["attempt"] >= self.attempts:
+                self._record(request, None, LDAPCommunicationError("connection lost before the response arrived"))
+                continue
+            request["attempt"] += 1
+            request["lost"] = True
+            self._queue_retry(request)
+
+    def flush(self):
+        """
+        Waits for every outstanding request and queued retry.
+        """
+        while self._pending or self._retries:
+            self._resend_due()
+            if self._pending:
+                self._collect_oldest()
+            elif self._retries:
+                time.sleep(max(0.0, self._retries[0][0] - time.monotonic()))
+
+    def close(self):
+        """
+        Waits for the outstanding requests and unbinds the asynchronous connection.
+        """
+        try:
+            self.flush()
+        finally:
+            if self._async_conn is not None:
+                co.disconnect_from_active_directory(self._async_conn)
+                self._async_conn = None
@@ -0,0 +1,134 @@
+# myapp/app/models/write_throttle.py
+# Adaptive limit on the number of batch writes in flight to one domain controller (AIMD, as in TCP
+# congestion control): the limit grows by one per limit's worth of fast, successful writes and is
+# halved when the DC answers busy / unavailable / timeLimitExceeded, times out or gets slower than
+# LDAP_WRITE_TARGET_LATENCY. Batches then run as fast as the DC allows while interactive requests,
+# which do not go through the throttle, keep a responsive DC.
+from ldap3.core.exceptions import LDAPOperationResult, LDAPSocketReceiveError, LDAPResponseTimeoutError
+from threading import Condition, Lock
+import logging
+import os
+import time
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+WRITE_INITIAL_CONCURRENCY = int(os.environ.get('LDAP_WRITE_INITIAL_CONCURRENCY', 4))
+WRITE_MAX_CONCURRENCY = int(os.environ.get('LDAP_WRITE_MAX_CONCURRENCY', 32))
+# Seconds a batch write may take before the DC is considered loaded
+WRITE_TARGET_LATENCY = float(os.environ.get('LDAP_WRITE_TARGET_LATENCY', 0.5))
+
+# LDAP result codes a DC uses to shed load
+OVERLOAD_RESULT_CODES = {
+    3,   # timeLimitExceeded
+    51,  # busy
+    52,  # unavailable
+}
+
+
+def is_overloaded(result: dict | None = None, error: Exception | None = None) -> bool:
+    """
+    Tells whether a write result (or the exception it raised) means the DC is overloaded.
+    """
+    if isinstance(error, LDAPOperationResult):  # raised instead of returned with raise_exceptions=True
+        return error.result in OVERLOAD_RESULT_CODES
+    if error is not None:
+        return isinstance(error, (LDAPSocketReceiveError, LDAPResponseTimeoutError))
+    return bool(result) and result.get('result') in OVERLOAD_RESULT_CODES
+
+
+class WriteThrottle:
+    """
+    Shared concurrency limit for the batch writes of one process to one DC.
+    The limit only grows while writers keep all of its slots busy.
+
+    A writer takes a slot with acquire() (which returns the start time) before sending a request and
+    gives it back with release(started, overloaded) when the response arrives. Only one decrease
+    is made per round: congestion signals of requests sent before the last decrease are ignored.
+    """
+
+    def __init__(self, initial: int = None, maximum: int = None, target_latency: float = None):
+        self.maximum = max(1, maximum or WRITE_MAX_CONCURRENCY)
+        self.limit = float(min(max(1, initial or WRITE_INITIAL_CONCURRENCY), self.maximum))
+        self.target_latency = target_latency or WRITE_TARGET_LATENCY
+        self.latency = None  # moving average of write latency, seconds
+        self.in_flight = 0
+        self._decreased_at = 0.0
+        self._condition = Condition(Lock())
+
+    def try_acquire(self) -> float | None:
+        """
+        Takes a slot if one is free. Returns the start time, or None when the limit is reached.
+        """
+        with self._condition:
+            if self.in_flight >= int(self.limit):
+                return None
+            self.in_flight += 1
+            return time.monotonic()
+
+    def acquire(self) -> float:
+        """
+        Takes a slot, waiting for one to be released. Returns the start time.
+        """
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, started: float, overloaded: bool = False):
+        """
+        Gives a slot back and adjusts the limit to the outcome and latency of the write.
+        """
+        now = time.monotonic()
+        latency = now - started
+        with self._condition:
+            was_full = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            if overloaded or latency > self.target_latency:
+                if started >= self._decreased_at:
+                    self._decreased_at = now
+                    previous, self.limit = self.limit, max(1.0, self.limit / 2)
+                    logger.info(f"DC {'overloaded' if overloaded else 'slow'} ({latency:.3f}s), "
+                                f"batch write concurrency {int(previous)} -> {int(self.limit)}")
+            elif was_full and self.limit < self.maximum:  # only grow a limit that is actually used
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def slot(self):
+        """
+        Context manager around one write: `with throttle.slot() as write: ...; write.overloaded = ...`.
+        """
+        return _Slot(self)
+
+
+class _Slot:
+    def __init__(self, throttle: WriteThrottle):
+        self.throttle = throttle
+        self.overloaded = False
+
+    def __enter__(self):
+        self.started = self.throttle.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_value is not None and is_overloaded(error=exc_value):
+            self.overloaded = True
+        self.throttle.release(self.started, self.overloaded)
+
+
+_throttles = {}
+_throttles_lock = Lock()
+
+
+def get_write_throttle(conn) -> WriteThrottle:
+    """
+    Returns the throttle of the DC `conn` is connected to (one per server and process).
+    """
+    key = (conn.server.host or '').lower()
+    with _throttles_lock:
+        throttle = _throttles.get(key)
+        if throttle is None:
+            throttle = _throttles[key] = WriteThrottle()
+        return throttle
@@ -1,13 +1,13 @@
 # myapp/app/routes.py
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, g, current_app
+from flask import Blueprint, render_template, stream_template, stream_with_context, request, redirect, url_for, session, flash, g, current_app, jsonify
 from functools import wraps
 from werkzeug.utils import secure_filename
 import sys
 import os
-import re
 import uuid
 from threading import Lock
 import csv  # Added import for csv
+import itertools
 import openpyxl  # Added import for openpyxl
 
 # Get the absolute path to the 'models' directory
@@ -17,15 +17,25 @@ models_path = os.path.join(os.path.dirname(__file__), 'models')
 sys.path.append(models_path)
 
 # Import the necessary modules and functions
-from app.models.batch_add import import_users_from_file
+from app.models.batch_add import (import_users_from_file, read_import_file, DEFAULT_IMPORT_WORKERS,
+                                  MAX_IMPORT_WORKERS)
+from app.models.batch_files import SUPPORTED_EXTENSIONS
+from app.models.batch_validate import validate_import_rows, validate_user_dns, validate_expiration_rows
 from app.models import connection as co
-from app.models.block import change_users_block_status, get_blocked_users_count, block_multiple_users
-from app.models.all_users import get_all_users, get_all_users_count, get_user_groups
+from app.models.block import block_multiple_users, bulk_change_block_status, iter_block_file
+from app.models.all_users import (get_all_users, iter_all_users, get_users_page, get_user_groups,
+                                  SELECTABLE_USER_ATTRIBUTES, SORTABLE_USER_ATTRIBUTES)
 from app.config_utils import save_user_defaults, get_default_attributes, load_config
-from app.models.expire import expire_multiple_users, set_account_expiration, get_expiring_users_count
+from app.models.expire import expire_users_from_file, bulk_set_account_expiration, iter_expiration_file
 from app.models.add import create_user
+from app.models.statistics import get_user_statistics
+from app.models.directory_mirror import mirrored_users, mirrored_groups
+from app.models.user_export import EXPORT_FORMATS, export_users
+from app.models.group_graph import get_effective_groups, get_nested_groups, iter_effective_members
+from app.models.jobs import JOBS_ENABLED, job_store, enqueue_job, encrypt_credentials
 from app.models.group_modify import (
     list_all_groups,
+    group_cn_to_dn_map,
     add_user_to_group,  # Keep for old usage, or remove if not needed
     remove_user_from_group,  # Keep for old usage, or remove if not needed
     list_group_members,  # Now expects group_dn
@@ -37,8 +47,9 @@ from app.models.group_modify import (
     remove_user_from_group_by_dn
 )
 from app.models.delete import delete_user_from_active_directory
-from app.models.batch_delete_users import delete_multiple_users as batch_delete_users_from_file
+from app.models.batch_delete_users import delete_multiple_users as batch_delete_users_from_file, iter_deletion_file
 from connection_utils import create_distinguished_name  # Renamed import to connection_utils
+from app.models.dn_utils import split_dn, get_cn, normalize_dn, dn_to_domain
 from datetime import datetime
 import base64
 import os
@@ -88,11 +99,13 @@ def verify_credentials(password):
 # --- Add Teardown Handler ---
 @main_routes.teardown_request
 def teardown_request(exception=None):
-    """Clear temporary password after each request"""
+    """Clear temporary password and return the pooled connection after each request"""
     if hasattr(g, 'temp_password'):
         del g.temp_password
     if hasattr(g, 'ldap_conn') and g.ldap_conn:
-        g.ldap_conn.unbind()
+        # A connection that was in use when an exception happened may be in an unknown state
+        co.release_connection(g.ldap_conn, discard=exception is not None)
+        g.ldap_conn = None
 
 
 def get_fernet_key():
@@ -127,8 +140,8 @@ def ldap_connection_required(f):
             flash("Session expired. Please log in again.", "danger")
             return redirect(url_for('main.login'))
         
-        # Re-establish connection
-        is_connected, connection = co.connect_to_active_directory(
+        # Take an already bound connection from this worker's pool
+        is_connected, connection = co.acquire_connection(
             conn_info['ldap_server'],
             conn_info['login'],
             password,
@@ -153,13 +166,14 @@ def login():
         password_form = request.form['password']
         domain_form = request.form['domain']
 
-        # Test connection
-        is_connected, _ = co.connect_to_active_directory(
+        # Test connection (and leave it in the pool for the following requests)
+        is_connected, test_conn = co.acquire_connection(
             ldap_server_form, 
             login_form, 
             password_form, 
             domain_form
         )
+        co.release_connection(test_conn)
 
         if is_connected:
             # Store session info without persisting password
@@ -195,6 +209,22 @@ def flash_error(message):
     flash(message, 'danger')
 
 
+# Names listed in a flash message; flashes live in the session cookie, which browsers cap at about 4 KB
+FLASH_NAME_LIMIT = int(os.environ.get('FLASH_NAME_LIMIT', 10))
+
+
+def name_list(names, limit: int = None) -> str:
+    """
+    Joins the first `limit` names for a flash message and says how many more there are,
+    e.g. "User 1, User 2 and 98 more".
+    """
+    names = list(names)
+    limit = FLASH_NAME_LIMIT if limit is None else limit
+    if len(names) <= limit:
+        return ', '.join(names)
+    return f"{', '.join(names[:limit])} and {len(names) - limit} more"
+
+
 def domain_to_search_base(domain):
     """
     Converts a domain string (e.g., "testad.local") to an LDAP search base (e.g., "dc=testad,dc=local").
@@ -204,50 +234,103 @@ def domain_to_search_base(domain):
     return search_base
 
 
-def parse_distinguished_name(dn_string: str):
+def start_streaming(rows):
+    """
+    Pulls the first row of a lazy row iterator so that LDAP errors are raised
+    before the response starts (while a redirect is still possible), and
+    returns an iterator over all rows.
+    """
+    iterator = iter(rows)
+    try:
+        first_row = next(iterator)
+    except StopIteration:
+        return iter(())
+    return itertools.chain([first_row], iterator)
+
+
+def render_user_table(template_name, users, **context):
+    """
+    Streams a user table template while the users are still being paged in from the directory.
+    """
+    return current_app.response_class(stream_template(template_name, users=start_streaming(users), **context))
+
+
+def load_users(conn, search_base, attributes):
+    """
+    Returns an iterator over users, answered from the local directory mirror when it is
+    enabled and holds the requested attributes, otherwise paged in from the DC.
+    """
+    users = mirrored_users(conn, search_base, attributes)
+    if users is None:
+        users = iter_all_users(conn, search_base, attributes)
+    return users
+
+
+# Default page size of the user tables; 0 renders the whole table unless ?count= is given
+USER_TABLE_PAGE_SIZE = int(os.environ.get('USER_TABLE_PAGE_SIZE', 0))
+
+
+def load_users_page(conn, search_base, attributes):
+    """
+    Returns one page of users (see get_users_page) when the request asks for a paged table
+    through the offset/count/sort/order/filter query parameters, or None for the full table.
+    """
+    count = request.args.get('count', USER_TABLE_PAGE_SIZE, type=int)
+    if not count or count <= 0:
+        return None
+
+    sort_key = request.args.get('sort', 'cn')
+    if sort_key not in SORTABLE_USER_ATTRIBUTES:
+        sort_key = 'cn'
+    page = get_users_page(conn, search_base, attributes,
+                          offset=request.args.get('offset', 0, type=int),
+                          count=min(count, 1000),
+                          sort_key=sort_key,
+                          reverse=request.args.get('order') == 'desc',
+                          filter_text=request.args.get('filter', ''))
+    page.update(sort=sort_key, order='desc' if request.args.get('order') == 'desc' else 'asc',
+                filter=request.args.get('filter', ''), sort_options=SORTABLE_USER_ATTRIBUTES)
+    return page
+
+
+def load_groups(conn, domain):
+    """
+    Returns all groups as a list of {'cn': ..., 'dn': ...}, from the local directory mirror when enabled.
+    """
+    groups = mirrored_groups(conn, domain_to_search_base(domain))
+    if groups is None:
+        groups = list_all_groups(conn, domain)
+    return groups
+
+
+def job_owner():
+    """
+    Identifies the logged-in user for the job store; jobs are only shown to their owner.
+    """
+    conn_info = get_ldap_connection()
+    return f"{conn_info['login']}@{conn_info['domain']}|{conn_info['ldap_server']}".lower()
+
+
+def queue_batch_job(kind, file_path, file_name, params=None):
     """
-    Parses a Distinguished Name (DN) string to extract object CN, domain string, and
-    the organizational unit/container path string suitable for create_distinguished_name.
-    Example: From "CN=John Doe,OU=Sales,CN=Users,DC=example,DC=com"
-    Returns: ("John Doe", "example.com", "OU=Sales/CN=Users")
-    Or: ("John Doe", "example.com", "CN=Users") if no OUs.
-    Or: ("John Doe", "example.com", "Sales") if just "OU=Sales".
+    Queues an uploaded batch file for the job worker, which binds with the current user's credentials.
+    Returns a redirect to the job's status page.
     """
-    if not dn_string:
-        return None, None, None
-
-    object_cn_match = re.match(r"CN=([^,]+)", dn_string, re.IGNORECASE)
-    object_cn = object_cn_match.group(1) if object_cn_match else None
-
-    domain_parts_dc = re.findall(r"DC=([^,]+)", dn_string, re.IGNORECASE)
-    domain_str = ".".join(domain_parts_dc) if domain_parts_dc else None
-
-    # Extract the part between the first CN and the first DC
-    # CN=object_cn , THIS_IS_THE_OU_PATH_STRING , DC=domain,DC=com
-    # Match the part after the first CN=... and before the first DC=...
-    ou_path_string_for_create_dn = None
-    match_ou_part = re.match(r"CN=[^,]+,(.*?),DC=", dn_string, re.IGNORECASE)
-    if match_ou_part:
-        raw_ou_part = match_ou_part.group(1).strip()
-        if raw_ou_part:
-            # Split by comma, reverse, and then format correctly
-            # Example: "OU=Sales,OU=IT,CN=Users" -> ["CN=Users", "OU=IT", "OU=Sales"]
-            # We want to join them with '/' in the order expected by create_distinguished_name's parser
-            # (which is reverse, i.e., child/parent)
-            components = [part.strip() for part in raw_ou_part.split(',')]
-
-            formatted_components = []
-            for comp in reversed(components):  # Iterate from child to parent
-                if comp.upper().startswith("OU="):
-                    formatted_components.append(comp[3:])  # Just the name (e.g., "Sales")
-                elif comp.upper().startswith("CN="):
-                    formatted_components.append(comp)  # Keep as "CN=Users" or "CN=Builtin"
-                else:
-                    formatted_components.append(comp)  # Keep as is if unknown prefix, might be error
-
-            ou_path_string_for_create_dn = "/".join(formatted_components)
-
-    return object_cn, domain_str, ou_path_string_for_create_dn
+    conn_info = get_ldap_connection()
+    key = get_fernet_key()
+    password = Fernet(key).decrypt(conn_info['encrypted_password'].encode()).decode()
+    credentials = encrypt_credentials(key, conn_info['ldap_server'], conn_info['login'], password, conn_info['domain'])
+    job_id = enqueue_job(kind, job_owner(), file_path, file_name, params or {}, credentials)
+    flash(f"File '{file_name}' was queued for processing.", 'info')
+    return redirect(url_for('main.job_status', job_id=job_id))
+
+
+def render_validation_report(report, file_name, back_endpoint):
+    """
+    Shows the dry-run report of a batch file (see batch_validate); nothing was written.
+    """
+    return render_template('validation_report.html', report=report, file_name=file_name,
+                           back_url=url_for(back_endpoint))
 
 
 # Decorator requiring admin privileges (definition was missing, adding a placeholder)
@@ -288,31 +371,21 @@ def index():
     search_base = domain_to_search_base(domain)
 
     try:
-        stats = {
-            'total_users': get_all_users_count(g.ldap_conn, search_base),
-            'blocked_users': get_blocked_users_count(g.ldap_conn, search_base),
-            'expiring_users': get_expiring_users_count(g.ldap_conn, search_base)
-        }
+        # One paged scan for all counters instead of a search per counter
+        stats = get_user_statistics(g.ldap_conn, search_base)
         return render_template('index.html', login=session.get("login"), stats=stats)
     except Exception as e:
         current_app.logger.error(f"Error in index endpoint: {e}", exc_info=True)
         flash(f"An error occurred while fetching statistics: {str(e)}", "danger")
         return render_template('index.html', login=session.get("login"),
-                               stats={'total_users': 'N/A', 'blocked_users': 'N/A', 'expiring_users': 'N/A'})
+                               stats={'total_users': 'N/A', 'blocked_users': 'N/A', 'expiring_users': 'N/A',
+                                      'expired_users': 'N/A', 'password_never_expires': 'N/A'})
 
 
 @main_routes.route('/checkbox_form', methods=['GET', 'POST'])
 def checkbox_form():
     # This route does not directly use LDAP connection but relies on session
-    options = [
-        'objectClass', 'cn', 'sAMAccountName', 'userPrincipalName', 'givenName', 'sn',
-        'displayName', 'uid', 'uidNumber', 'gidNumber', 'unixHomeDirectory', 'loginShell',
-        'homeDirectory', 'homeDrive', 'mail', 'whenChanged', 'whenCreated', 'uSNChanged',
-        'uSNCreated', 'userAccountControl', 'sAMAccountType', 'pwdLastSet', 'primaryGroupID',
-        'objectCategory', 'objectGUID', 'objectSid', 'logonCount', 'instanceType',
-        'dSCorePropagationData', 'countryCode', 'codePage', 'badPwdCount',
-        'badPasswordTime', 'accountExpires'
-    ]
+    options = SELECTABLE_USER_ATTRIBUTES
 
     if request.method == 'POST':
         selected_filters = request.form.getlist('filter_options')
@@ -382,8 +455,10 @@ def delete_user_get_form(conn):
         display_columns = session.get('columns', ["name", "distinguishedName"])
         attributes_to_fetch = list(set(selected_filters + display_columns + ['name', 'distinguishedName']))
 
-        users = get_all_users(conn, search_base, attributes_to_fetch)
-        return render_template('delete_user.html', users=users, cols=display_columns, options=selected_filters)
+        page = load_users_page(conn, search_base, attributes_to_fetch)
+        users = page['users'] if page else load_users(conn, search_base, attributes_to_fetch)
+        return render_user_table('delete_user.html', users, cols=display_columns, options=selected_filters,
+                                 page=page)
     except Exception as e:
         current_app.logger.error(f"Error fetching users for deletion form: {e}", exc_info=True)
         flash_error(f"Could not retrieve user list: {str(e)}")
@@ -405,8 +480,8 @@ def delete_user_post_selected(conn):
             # Expecting value in "name|distinguishedName" format
             user_cn_display, user_dn = user_dn_data.split('|', 1)
 
-            # parse_distinguished_name returns object_cn, domain_str, ou_path_string_for_create_dn
-            object_cn_parsed, domain_str_parsed, ou_path_str_parsed = parse_distinguished_name(user_dn)
+            # split_dn returns object_cn, domain_str, ou_path_string_for_create_dn
+            object_cn_parsed, domain_str_parsed, ou_path_str_parsed = split_dn(user_dn)
 
             if not object_cn_parsed or not domain_str_parsed:
                 errors.append(f"Invalid DN format for deletion: {user_dn}")
@@ -451,6 +526,11 @@ def delete_user_file_upload(conn):
 
     try:
         file.save(file_path)
+        if request.form.get('dry_run'):
+            return render_validation_report(validate_user_dns(conn, iter_deletion_file(file_path)), filename,
+                                            'main.delete_user')
+        if JOBS_ENABLED:
+            return queue_batch_job('delete_users', file_path, filename)
         deleted_count = batch_delete_users_from_file(conn, file_path)
         flash(f"{deleted_count} users were processed for deletion from the file.", 'success')
     except Exception as e:
@@ -474,8 +554,8 @@ def add_user():
             file = request.files['file']
 
             ext = os.path.splitext(file.filename)[1].lower()
-            if ext not in [".csv", ".xlsx", ".xls"]:
-                flash("Unsupported file format. Please use CSV or XLSX.", "danger")
+            if ext not in SUPPORTED_EXTENSIONS:
+                flash("Unsupported file format. Please use CSV, XLSX or JSON Lines.", "danger")
                 return redirect(url_for('main.add_user'))
 
             unique_name = f"import_{uuid.uuid4().hex}{ext}"
@@ -488,23 +568,16 @@ def add_user():
 
             try:
                 file.save(filepath)
-                preview_data = []
-                if ext == ".csv":
-                    with open(filepath, newline='', encoding='utf-8-sig') as csvfile:
-                        reader = csv.DictReader(csvfile)
-                        for row in reader:
-                            preview_data.append(row)
-                elif ext in [".xlsx", ".xls"]:
-                    wb = openpyxl.load_workbook(filepath)
-                    sheet = wb.active
-                    headers = [cell.value for cell in sheet[1]]
-                    for row_idx in range(2, sheet.max_row + 1):
-                        row_values = [cell.value for cell in sheet[row_idx]]
-                        row_data = dict(zip(headers, row_values))
-                        preview_data.append(row_data)
+                preview_data = read_import_file(filepath)
+
+                # Dry run: the whole file is checked against the directory before anything is written
+                search_base_domain = domain_to_search_base(session.get('domain'))
+                report = validate_import_rows(g.ldap_conn, preview_data, search_base_domain, search_base_domain)
 
                 session['import_file'] = filepath
-                return render_template("preview_import.html", users=preview_data)
+                return render_template("preview_import.html", users=preview_data, report=report,
+                                       problems={problem['row']: problem for problem in report['problems']},
+                                       default_workers=DEFAULT_IMPORT_WORKERS, max_workers=MAX_IMPORT_WORKERS)
 
             except Exception as e:
                 current_app.logger.error(f"Error processing file for preview {file.filename}: {e}", exc_info=True)
@@ -523,7 +596,14 @@ def add_user():
             dc_parts = [f"DC={part}" for part in domain.split('.')]
             search_base_domain = ','.join(dc_parts)
 
-            result = import_users_from_file(g.ldap_conn, filepath, search_base_domain, search_base_domain)
+            # Number of rows imported in parallel, chosen on the preview page
+            workers = request.form.get('workers', type=int)
+            if JOBS_ENABLED:
+                session.pop('import_file', None)
+                return queue_batch_job('import_users', filepath, os.path.basename(filepath),
+                                       {'dc': search_base_domain, 'search_base': search_base_domain, 'workers': workers})
+            result = import_users_from_file(g.ldap_conn, filepath, search_base_domain, search_base_domain,
+                                            workers=workers)
 
             if 'error' in result:
                 flash(result['error'], 'danger')
@@ -607,13 +687,11 @@ def toggle_block_user_get_form(conn):
         attributes_to_fetch = list(
             set(selected_filters + display_columns + ['userAccountControl', 'name', 'distinguishedName']))
 
-        users = get_all_users(conn, search_base, attributes_to_fetch)
-
-        for user in users:
-            uac_flags_str = str(user.get("userAccountControl", "")).lower()
-            user["is_disabled"] = "accountdisable" in uac_flags_str
-
-        return render_template('block_user.html', users=users, cols=display_columns, options=selected_filters)
+        # Rows expose is_disabled straight from the userAccountControl bitmask
+        page = load_users_page(conn, search_base, attributes_to_fetch)
+        users = page['users'] if page else load_users(conn, search_base, attributes_to_fetch)
+        return render_user_table('block_user.html', users, cols=display_columns,
+                                 options=selected_filters, page=page)
     except Exception as e:
         current_app.logger.error(f"Error fetching users for block/unblock form: {e}", exc_info=True)
         flash_error(f"Could not retrieve user list: {str(e)}")
@@ -629,34 +707,27 @@ def toggle_block_user_post_selected(conn):
 
     errors = []
     successes = []
+    display_names = {}
     for user_dn_data in selected_users_data:
         try:
             user_cn_display, user_dn = user_dn_data.split('|', 1)
-            # parse_distinguished_name returns object_cn, domain_str, ou_path_string_for_create_dn
-            object_cn_parsed, domain_str_parsed, ou_path_str_parsed = parse_distinguished_name(user_dn)
-
-            if not object_cn_parsed or not domain_str_parsed:
-                errors.append(f"Invalid DN: {user_dn} (could not parse)")
-                current_app.logger.warning(
-                    f"Could not parse DN for toggle block status: {user_dn}. Parsed: cn={object_cn_parsed}, domain={domain_str_parsed}, ou_path={ou_path_str_parsed}")
-                continue
-
-            # The ou_path_str_parsed is the string like "OU=Sales/CN=Users" or "CN=Users" or "Sales".
-            # It's directly compatible with create_distinguished_name's organizational_unit parameter.
-            # change_users_block_status expects conn, canonical_name (CN), domain, organizational_unit string
-            if change_users_block_status(conn, object_cn_parsed, domain_str_parsed, ou_path_str_parsed):
-                successes.append(user_cn_display)
-            else:
-                errors.append(user_cn_display)
-                current_app.logger.error(
-                    f"Failed to toggle block status for {user_cn_display} (DN: {user_dn}). LDAP Result: {conn.result}")
-
+            display_names[user_dn] = user_cn_display
         except ValueError:
             errors.append(f"Invalid data format for: {user_dn_data}")
             current_app.logger.error(f"ValueError parsing user data for toggle block: {user_dn_data}", exc_info=True)
-        except Exception as e:
-            errors.append(f"Error processing {user_dn_data}: {str(e)}")
-            current_app.logger.error(f"Exception toggling block status (DN: {user_dn_data}): {e}", exc_info=True)
+
+    try:
+        # One batched read of the current states, then only the needed modifies
+        summary = bulk_change_block_status(conn, list(display_names), action='toggle')
+        successes.extend(display_names[user_dn] for user_dn in summary["changed"])
+        for user_dn in summary["not_found"]:
+            errors.append(f"{display_names[user_dn]} (not found)")
+        for user_dn, reason in summary["failed"]:
+            errors.append(display_names[user_dn])
+            current_app.logger.error(f"Failed to toggle block status for {display_names[user_dn]} (DN: {user_dn}): {reason}")
+    except Exception as e:
+        errors.append(f"Error processing selected users: {str(e)}")
+        current_app.logger.error(f"Exception toggling block status: {e}", exc_info=True)
 
     if successes:
         flash(f"Block status toggled for users: {', '.join(successes)}.", "success")
@@ -676,6 +747,11 @@ def toggle_block_user_file_upload(conn):
 
     try:
         file.save(file_path)
+        if request.form.get('dry_run'):
+            return render_validation_report(validate_user_dns(conn, iter_block_file(file_path)), filename,
+                                            'main.toggle_block_user')
+        if JOBS_ENABLED:
+            return queue_batch_job('block_users', file_path, filename)
         processed_count = block_multiple_users(conn,
                                                file_path)  # block_multiple_users will use create_distinguished_name
         flash(f"{processed_count} users from file were processed (attempted to block/unblock).", 'info')
@@ -717,8 +793,10 @@ def expire_user_get_form(conn):
         attributes_to_fetch = list(
             set(selected_filters + display_columns + ['accountExpires', 'name', 'distinguishedName']))
 
-        users = get_all_users(conn, search_base, attributes_to_fetch)
-        return render_template('expire_user.html', users=users, cols=display_columns, options=selected_filters)
+        page = load_users_page(conn, search_base, attributes_to_fetch)
+        users = page['users'] if page else load_users(conn, search_base, attributes_to_fetch)
+        return render_user_table('expire_user.html', users, cols=display_columns, options=selected_filters,
+                                 page=page)
     except Exception as e:
         current_app.logger.error(f"Error fetching users for expiration form: {e}", exc_info=True)
         flash_error(f"Could not retrieve user list: {str(e)}")
@@ -738,7 +816,7 @@ def expire_user_post_selected(conn):
         return redirect(url_for('main.expire_user'))
 
     try:
-        # Convert YYYY-MM-DD to DD-MM-YYYY for set_account_expiration function
+        # Convert YYYY-MM-DD to DD-MM-YYYY for bulk_set_account_expiration
         formatted_date_for_ldap = datetime.strptime(expiration_date_str, '%Y-%m-%d').strftime('%d-%m-%Y')
     except ValueError:
         flash_error("Invalid date format provided.")
@@ -746,31 +824,26 @@ def expire_user_post_selected(conn):
 
     errors = []
     successes = []
+    display_names = {}
     for user_dn_data in selected_users_data:
         try:
             user_cn_display, user_dn = user_dn_data.split('|', 1)
-            object_cn_parsed, domain_str_parsed, ou_path_str_parsed = parse_distinguished_name(user_dn)
-
-            if not object_cn_parsed or not domain_str_parsed:
-                errors.append(f"Invalid DN: {user_dn} (could not parse)")
-                current_app.logger.warning(
-                    f"Could not parse DN for expiration: {user_dn}. Parsed: cn={object_cn_parsed}, domain={domain_str_parsed}, ou_path={ou_path_str_parsed}")
-                continue
-
-            # set_account_expiration expects conn, canonical_name (CN), domain, expiration_date (DD-MM-YYYY), organizational_unit string
-            if set_account_expiration(conn, object_cn_parsed, domain_str_parsed, formatted_date_for_ldap,
-                                      ou_path_str_parsed):
-                successes.append(user_cn_display)
-            else:
-                errors.append(user_cn_display)
-                current_app.logger.error(
-                    f"Failed to set expiration for {user_cn_display} (DN: {user_dn}). LDAP Result: {conn.result}")
+            display_names[user_dn] = user_cn_display
         except ValueError:
             errors.append(f"Invalid data format for: {user_dn_data}")
             current_app.logger.error(f"ValueError parsing user data for expiration: {user_dn_data}", exc_info=True)
-        except Exception as e:
-            errors.append(f"Error processing {user_dn_data}: {str(e)}")
-            current_app.logger.error(f"Exception setting expiration (DN: {user_dn_data}): {e}", exc_info=True)
+
+    try:
+        summary = bulk_set_account_expiration(conn, [(user_dn, formatted_date_for_ldap) for user_dn in display_names])
+        successes.extend(display_names[user_dn] for user_dn in summary["updated"] + summary["unchanged"])
+        for user_dn in summary["not_found"]:
+            errors.append(f"{display_names[user_dn]} (not found)")
+        for user_dn, reason in summary["failed"]:
+            errors.append(display_names[user_dn])
+            current_app.logger.error(f"Failed to set expiration for {display_names[user_dn]} (DN: {user_dn}): {reason}")
+    except Exception as e:
+        errors.append(f"Error processing selected users: {str(e)}")
+        current_app.logger.error(f"Exception setting expiration: {e}", exc_info=True)
 
     if successes:
         flash(f"Expiration date set for users: {', '.join(successes)}.", "success")
@@ -790,9 +863,24 @@ def expire_user_file_upload(conn):
 
     try:
         file.save(file_path)
-        expired_count = expire_multiple_users(conn,
-                                              file_path)  # expire_multiple_users will use create_distinguished_name
-        flash(f"{expired_count} users from file had their expiration date processed.", 'info')
+        if request.form.get('dry_run'):
+            return render_validation_report(validate_expiration_rows(conn, iter_expiration_file(file_path)), filename,
+                                            'main.expire_user')
+        if JOBS_ENABLED:
+            return queue_batch_job('expire_users', file_path, filename)
+        summary = expire_users_from_file(conn, file_path)
+        # Counts plus the first few names: a large file would overflow the session cookie
+        if summary["not_found"]:
+            flash_error(f"{len(summary['not_found'])} users not found: "
+                        f"{name_list(get_cn(user_dn) or user_dn for user_dn in summary['not_found'])}.")
+        if summary["invalid_date"]:
+            invalid = (f"{get_cn(user_dn) or user_dn} ({date})" for user_dn, date in summary["invalid_date"])
+            flash_error(f"{len(summary['invalid_date'])} invalid expiration dates: {name_list(invalid)}.")
+        if summary["failed"]:
+            flash_error(f"Errors occurred for {len(summary['failed'])} users: "
+                        f"{name_list(get_cn(user_dn) or user_dn for user_dn, _ in summary['failed'])}.")
+        flash(f"{len(summary['updated'])} users from file had their expiration date set "
+              f"({len(summary['unchanged'])} already had it).", 'info')
     except Exception as e:
         current_app.logger.error(f"Error processing expiration file {filename}: {e}", exc_info=True)
         flash_error(f"An error occurred while processing the file: {str(e)}")
@@ -837,8 +925,7 @@ def handle_post_group_management_actions(conn, domain):
             group_config['General']['Group name (pre-Windows 2000)'] = group_name_cn
             group_config['General']['Description'] = f"Group '{group_name_cn}' created via web app."
 
-            domain_components = [part.split('=')[1] for part in domain.split(',') if part.lower().startswith('dc=')]
-            actual_email_domain = '.'.join(domain_components)
+            actual_email_domain = dn_to_domain(domain)
             if actual_email_domain:
                 group_config['General'][
                     'E-mail'] = f"{group_name_cn.lower().replace(' ', '.').replace('/', '')}@{actual_email_domain}"
@@ -860,13 +947,7 @@ def handle_post_group_management_actions(conn, domain):
 
     elif action == 'delete':
         try:
-            all_groups_data = list_all_groups(conn, domain)  # Returns list of {'cn': ..., 'dn': ...}
-
-            group_dn_to_delete = None
-            for g_data in all_groups_data:
-                if g_data['cn'] == group_name_cn:
-                    group_dn_to_delete = g_data['dn']
-                    break
+            group_dn_to_delete = group_cn_to_dn_map(conn, domain).get(group_name_cn)
 
             if not group_dn_to_delete:
                 flash_error(f"Group '{group_name_cn}' not found for deletion.")
@@ -875,7 +956,7 @@ def handle_post_group_management_actions(conn, domain):
             # Extract components for remove_group or simplify remove_group to take full DN
             # The remove_group function in group_modify.py already takes group_cn, domain, and group_container_ou
             # We need to parse group_dn_to_delete to get the group_container_ou part.
-            object_cn_parsed, domain_str_parsed, ou_path_str_parsed = parse_distinguished_name(group_dn_to_delete)
+            object_cn_parsed, domain_str_parsed, ou_path_str_parsed = split_dn(group_dn_to_delete)
 
             if not object_cn_parsed or not domain_str_parsed:  # Should not happen if DN is valid
                 flash_error(f"Could not parse DN for group '{group_name_cn}' for deletion.")
@@ -901,7 +982,7 @@ def handle_post_group_management_actions(conn, domain):
 # Helper for GET group management form
 def handle_get_group_management_form(conn, domain):
     try:
-        all_groups_data = list_all_groups(conn, domain)  # Returns list of {'cn': ..., 'dn': ...}
+        all_groups_data = load_groups(conn, domain)  # Returns list of {'cn': ..., 'dn': ...}
         # For this template, we just need the CNs for display in the table
         group_cns_for_display = [g_data['cn'] for g_data in all_groups_data]
         return render_template('groups_management.html', groups=group_cns_for_display)
@@ -966,6 +1047,40 @@ def settings():
                            default_ou=default_ou_config)
 
 
+def member_of_group_cns(user_entry: dict) -> list:
+    """
+    Returns the unique, sorted CNs of the groups listed in a user's memberOf attribute.
+    """
+    member_of_dns_raw = user_entry.get('memberOf')  # This is from get_all_users
+
+    member_of_cns = []
+    if member_of_dns_raw:
+        # Ensure member_of_dns_raw is a list of strings
+        # ldap3 might return a ValuesView object or a single string if only one group
+        processed_dns_list = []
+        if hasattr(member_of_dns_raw, 'values') and callable(getattr(member_of_dns_raw, 'values')):
+            processed_dns_list = list(member_of_dns_raw.values)  # For ldap3 ValuesView
+        elif isinstance(member_of_dns_raw, list):
+            processed_dns_list = member_of_dns_raw
+        elif isinstance(member_of_dns_raw, str):
+            processed_dns_list = [member_of_dns_raw]
+        else:
+            # Log unexpected type if necessary
+            pass  # Or current_app.logger.warning(f"Unexpected type for memberOf for user {user_entry.get('dn')}: {type(member_of_dns_raw)}")
+
+        for group_dn_str in processed_dns_list:
+            # Extract CN from Group DN (e.g., "CN=GroupName,OU=Groups,DC=example,DC=com"), memoized per DN
+            group_cn = get_cn(str(group_dn_str))
+            if group_cn is not None:
+                member_of_cns.append(group_cn)
+            else:
+                # Fallback to full DN if CN parsing fails, or log a warning
+                # current_app.logger.warning(f"Could not parse CN from group DN '{str(group_dn_str)}' for user {user_entry.get('distinguishedName')}")
+                member_of_cns.append(str(group_dn_str))
+
+    return sorted(list(set(member_of_cns)))
+
+
 @main_routes.route('/show_all')
 @ldap_connection_required
 def show_all_users():
@@ -982,48 +1097,25 @@ def show_all_users():
                                         ['distinguishedName', 'cn', 'name', 'memberOf']))
 
     try:
-        # Get all users with their attributes, including 'memberOf'
-        users_list = get_all_users(g.ldap_conn, search_base_domain, user_attributes_to_fetch)
-
         # Get all group CNs for the dropdown/checkboxes in the template
         # list_all_groups should return list of {'cn': ..., 'dn': ...}
-        all_groups_data = list_all_groups(g.ldap_conn, domain)
+        all_groups_data = load_groups(g.ldap_conn, domain)
         all_groups_cns_for_template = [g_data['cn'] for g_data in all_groups_data]
 
-        for user_entry in users_list:
-            member_of_dns_raw = user_entry.get('memberOf')  # This is from get_all_users
-
-            member_of_cns = []
-            if member_of_dns_raw:
-                # Ensure member_of_dns_raw is a list of strings
-                # ldap3 might return a ValuesView object or a single string if only one group
-                processed_dns_list = []
-                if hasattr(member_of_dns_raw, 'values') and callable(getattr(member_of_dns_raw, 'values')):
-                    processed_dns_list = list(member_of_dns_raw.values)  # For ldap3 ValuesView
-                elif isinstance(member_of_dns_raw, list):
-                    processed_dns_list = member_of_dns_raw
-                elif isinstance(member_of_dns_raw, str):
-                    processed_dns_list = [member_of_dns_raw]
-                else:
-                    # Log unexpected type if necessary
-                    pass  # Or current_app.logger.warning(f"Unexpected type for memberOf for user {user_entry.get('dn')}: {type(member_of_dns_raw)}")
-
-                for group_dn_str in processed_dns_list:
-                    # Extract CN from Group DN (e.g., "CN=GroupName,OU=Groups,DC=example,DC=com")
-                    match = re.match(r"CN=([^,]+)", str(group_dn_str), re.IGNORECASE)
-                    if match:
-                        member_of_cns.append(match.group(1))
-                    else:
-                        # Fallback to full DN if CN parsing fails, or log a warning
-                        # current_app.logger.warning(f"Could not parse CN from group DN '{str(group_dn_str)}' for user {user_entry.get('distinguishedName')}")
-                        member_of_cns.append(str(group_dn_str))
-
-            user_entry['memberOfList'] = sorted(list(set(member_of_cns)))  # Store unique, sorted group CNs
-
-        return render_template('show_all_users.html',
-                               users=users_list,
-                               cols=display_columns,
-                               groups=all_groups_cns_for_template)  # Pass group CNs for the checkboxes
+        page = load_users_page(g.ldap_conn, search_base_domain, user_attributes_to_fetch)
+
+        def users_with_group_cns():
+            # Get all users with their attributes, including 'memberOf'
+            users = page['users'] if page else load_users(g.ldap_conn, search_base_domain, user_attributes_to_fetch)
+            for user_entry in users:
+                user_entry['memberOfList'] = member_of_group_cns(user_entry)  # Store unique, sorted group CNs
+                yield user_entry
+
+        return render_user_table('show_all_users.html',
+                                 users_with_group_cns(),
+                                 cols=display_columns,
+                                 groups=all_groups_cns_for_template,  # Pass group CNs for the checkboxes
+                                 page=page)
 
     except Exception as e:
         current_app.logger.error(f"Error in show_all_users endpoint: {e}", exc_info=True)
@@ -1031,6 +1123,37 @@ def show_all_users():
         return redirect(url_for('main.index'))
 
 
+@main_routes.route('/export_users')
+@ldap_connection_required
+def export_users_file():
+    """
+    Downloads all users with the columns selected in the display options, as CSV or XLSX
+    (?format=csv|xlsx), gzip-compressed with ?gzip=1. The file is streamed while the users are
+    paged in, so a large domain neither holds the whole list in memory nor delays the first bytes.
+    """
+    domain = session.get('domain')
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        flash_error(f"Unsupported export format: {export_format}.")
+        return redirect(url_for('main.show_all_users'))
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    display_columns = session.get('columns', ["name", "distinguishedName"])
+
+    try:
+        users = start_streaming(load_users(g.ldap_conn, domain_to_dn(domain), display_columns))
+    except Exception as e:
+        current_app.logger.error(f"Error in export_users endpoint: {e}", exc_info=True)
+        flash(f"An error occurred while fetching user data: {str(e)}", "danger")
+        return redirect(url_for('main.show_all_users'))
+
+    file_name = f"users_{domain}_{datetime.now():%Y%m%d_%H%M%S}.{export_format}" + ('.gz' if compress else '')
+    response = current_app.response_class(
+        stream_with_context(export_users(users, display_columns, export_format, compress)),
+        mimetype='application/gzip' if compress else EXPORT_FORMATS[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename="{file_name}"'
+    return response
+
+
 @main_routes.route('/update_user_groups', methods=['POST'])
 @ldap_connection_required
 def update_user_groups():
@@ -1046,10 +1169,8 @@ def update_user_groups():
     try:
         current_user_groups_cns = get_user_groups(g.ldap_conn, user_dn_form)  # Returns list of CNs
 
-        all_groups_data = list_all_groups(g.ldap_conn, domain_session)  # Returns list of {'cn': ..., 'dn': ...}
-
-        # Create a mapping from CN to DN for all available groups for quick lookup
-        all_groups_cn_to_dn_map = {g_data['cn']: g_data['dn'] for g_data in all_groups_data}
+        # Mapping from CN to DN for all available groups, kept by the group catalog between requests
+        all_groups_cn_to_dn_map = group_cn_to_dn_map(g.ldap_conn, domain_session)
 
         selected_group_dns_to_set = []
         for cn_selected in selected_groups_cns:
@@ -1083,10 +1204,13 @@ def update_user_groups():
                 # get_user_groups returns CNs only, which is why we map.
                 # For now, let's keep it as is, relying on current_group_dns_user_is_member_of only containing resolvable groups.
 
+        # DNs are compared the way AD does, ignoring case and escaping differences
+        selected_normalized = {normalize_dn(dn) for dn in selected_group_dns_to_set}
+        current_normalized = {normalize_dn(dn) for dn in current_group_dns_user_is_member_of}
         groups_to_add_user_to = [dn for dn in selected_group_dns_to_set if
-                                 dn not in current_group_dns_user_is_member_of]
+                                 normalize_dn(dn) not in current_normalized]
         groups_to_remove_user_from = [dn for dn in current_group_dns_user_is_member_of if
-                                      dn not in selected_group_dns_to_set]
+                                      normalize_dn(dn) not in selected_normalized]
 
         for group_dn_to_add in groups_to_add_user_to:
             if not add_user_to_group_by_dn(g.ldap_conn, user_dn_form, group_dn_to_add):
@@ -1108,4 +1232,93 @@ def update_user_groups():
         current_app.logger.error(f"Error updating user groups for {user_dn_form}: {e}", exc_info=True)
         flash(f"An error occurred while updating user groups: {str(e)}", "danger")
 
-    return redirect(url_for('main.show_all_users'))
\ No newline at end of file
+    return redirect(url_for('main.show_all_users'))
+
+
+@main_routes.route('/effective_groups')
+@ldap_connection_required
+def effective_groups():
+    """
+    JSON list of all groups a user or group (?dn=...) belongs to, including nested memberships.
+    """
+    object_dn = request.args.get('dn')
+    if not object_dn:
+        return jsonify({'error': 'Missing dn parameter.'}), 400
+
+    try:
+        search_base = domain_to_dn(session.get('domain'))
+        groups = get_effective_groups(g.ldap_conn, search_base, object_dn)
+        return jsonify({'dn': object_dn, 'groups': groups})
+    except Exception as e:
+        current_app.logger.error(f"Error resolving effective groups of {object_dn}: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+
+@main_routes.route('/effective_members')
+@ldap_connection_required
+def effective_members():
+    """
+    JSON list of all members of a group (?group=<CN or DN>), including members of nested groups.
+    The optional ?limit= caps the number of member DNs returned.
+    """
+    group = request.args.get('group')
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(limit, 0)
+    if not group:
+        return jsonify({'error': 'Missing group parameter.'}), 400
+
+    try:
+        domain = session.get('domain')
+        search_base = domain_to_dn(domain)
+        group_dn = group if '=' in group else group_cn_to_dn_map(g.ldap_conn, domain).get(group)
+        if not group_dn:
+            return jsonify({'error': f"Group '{group}' not found."}), 404
+
+        # One extra member tells whether the list was cut at the limit
+        members = list(itertools.islice(iter_effective_members(g.ldap_conn, search_base, group_dn),
+                                        limit + 1 if limit is not None else None))
+        truncated = limit is not None and len(members) > limit
+        return jsonify({
+            'group': group_dn,
+            'nested_groups': get_nested_groups(g.ldap_conn, search_base, group_dn),
+            'members': members[:limit] if truncated else members,
+            'truncated': truncated
+        })
+    except Exception as e:
+        current_app.logger.error(f"Error resolving effective members of {group}: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+
+@main_routes.route('/jobs')
+@ldap_connection_required
+def jobs():
+    return render_template('jobs.html', jobs=job_store.list_jobs(job_owner()))
+
+
+@main_routes.route('/jobs/<job_id>')
+@ldap_connection_required
+def job_status(job_id):
+    job = job_store.get(job_id, job_owner())
+    if job is None:
+        flash_error("Job not found.")
+        return redirect(url_for('main.jobs'))
+    failed_only = request.args.get('failed') == '1'
+    return render_template('job_status.html', job=job, failed_only=failed_only,
+                           rows=job_store.rows(job_id, limit=1000, failed_only=failed_only))
+
+
+@main_routes.route('/jobs/<job_id>/status')
+@ldap_connection_required
+def job_status_json(job_id):
+    """
+    JSON status of a job: progress while it runs, summary and per-row results (?offset=&limit=) when done.
+    """
+    job = job_store.get(job_id, job_owner())
+    if job is None:
+        return jsonify({'error': 'Job not found.'}), 404
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 500, type=int), 1), 5000)
+    job['rows'] = job_store.rows(job_id, offset=offset, limit=limit,
+                                 failed_only=request.args.get('failed') == '1')
+    return jsonify(job)
@@ -0,0 +1,17 @@
+# worker.py
+# Runs the batch jobs queued by the web app (JOBS_ENABLED=1), one after another.
+
+import logging
+
+from app import create_app
+from app.routes import get_fernet_key
+from app.models.jobs import run_worker
+
+# The app is only needed for its configuration (secret key used to decrypt job credentials)
+app = create_app()
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    with app.app_context():
+        key = get_fernet_key()
+    run_worker(key)
@@ -11,4 +11,16 @@ else
     echo "Znalezione PID-y: $PIDS"
     kill $PIDS
     echo "Procesy zostały zatrzymane."
-fi
\ No newline at end of file
+fi
+
+echo "Zatrzymywanie procesu zadań wsadowych..."
+
+WORKER_PIDS=$(pgrep -f "python worker.py")
+
+if [ -z "$WORKER_PIDS" ]; then
+    echo "Brak działającego procesu zadań wsadowych."
+else
+    echo "Znalezione PID-y: $WORKER_PIDS"
+    kill $WORKER_PIDS
+    echo "Proces zadań wsadowych został zatrzymany."
+fi